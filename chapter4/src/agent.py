@@ -1,27 +1,62 @@
+import asyncio
+import contextvars
 import operator
-from typing import Annotated, Literal, Sequence, TypedDict
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Annotated, AsyncIterator, Awaitable, Callable, Literal, Sequence, TypedDict
 
 from langchain_core.utils.function_calling import convert_to_openai_tool
 from langgraph.constants import Send
 from langgraph.graph import END, START, StateGraph
 from langgraph.pregel import Pregel
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessageParam
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+from pydantic import BaseModel
 
+from src.answer_cache import SemanticAnswerCache
 from src.configs import Settings
+from src.context_compaction import compact_subtask_messages
 from src.custom_logger import setup_logger
+from src.instrumentation import Tracer, is_tracing, lane, span, tracing
+from src.keyword_index import char_ngram_tokenize
+from src.llm_cache import LLMCache, LLMResponseStore, completion_from_chunks
 from src.models import (
     AgentResult,
+    AgentStreamEvent,
     Plan,
     ReflectionResult,
     SearchOutput,
     Subtask,
+    TokenUsage,
     ToolResult,
 )
 from src.prompts import HelpDeskAgentPrompts
+from src.rate_limit import COMPLETION_TOKENS_ESTIMATE, OpenAIRateLimiter, estimate_text_tokens, estimate_tokens
+from src.serializers import ToolResultSerializer
 
 MAX_CHALLENGE_COUNT = 3
 
+# ツール1回の呼び出しを待つ時間の上限（秒）
+TOOL_TIMEOUT_SECONDS = 30
+
+# 投機的実行の戦略ごとに最初のツール選択で必ず呼び出させるツール
+SPECULATIVE_STRATEGY_TOOLS = {
+    "keyword": "search_xyz_manual",
+    "vector": "search_xyz_qa",
+    "hybrid": "search_xyz_hybrid",
+}
+
+# QA検索のツール名。最上位の類似度が高い場合はQAの回答をそのままサブタスクの回答にする
+QA_TOOL_NAME = "search_xyz_qa"
+
+# QAのチャンク（CSVの各行を「Q: 質問」「A: 回答」の行にしたもの）から回答の行の先頭を探す
+_QA_ANSWER_PATTERN = re.compile(r"^A\s*[:：]\s*", re.MULTILINE)
+
+# サブグラフの状態のうち、更新を既存の値に追加するキー
+_SUBGRAPH_APPEND_KEYS = ("tool_results", "reflection_results", "token_usages")
+
 logger = setup_logger(__file__)
 
 
@@ -31,6 +66,7 @@ class AgentState(TypedDict):
     current_step: int
     subtask_results: Annotated[Sequence[Subtask], operator.add]
     last_answer: str
+    token_usages: Annotated[Sequence[TokenUsage], operator.add]
 
 
 class AgentSubGraphState(TypedDict):
@@ -43,6 +79,49 @@ class AgentSubGraphState(TypedDict):
     tool_results: Annotated[Sequence[Sequence[SearchOutput]], operator.add]
     reflection_results: Annotated[Sequence[ReflectionResult], operator.add]
     subtask_answer: str
+    answered_from_qa: bool
+    qa_fast_path_tried: bool
+    token_usages: Annotated[Sequence[TokenUsage], operator.add]
+
+
+def extract_qa_answer(content: str) -> str:
+    """QAのチャンクから回答の部分を取り出す（回答の行がない場合はチャンク全体を返す）"""
+    match = _QA_ANSWER_PATTERN.search(content)
+    if match is None:
+        return content.strip()
+    return content[match.end() :].strip()
+
+
+def deduplicate_subtasks(subtasks: list[str], threshold: float) -> list[str]:
+    """ほぼ同じ内容のサブタスクを除く
+
+    文字bigramの集合のJaccard係数がthreshold以上のサブタスクは重複とみなし、先に現れたものだけを残す。
+
+    Args:
+        subtasks (list[str]): 計画のサブタスク
+        threshold (float): 重複とみなすJaccard係数の下限
+
+    Returns:
+        list[str]: 重複を除いたサブタスク（元の順序を保つ）
+    """
+    kept: list[str] = []
+    kept_bigrams: list[set[str]] = []
+    for subtask in subtasks:
+        bigrams = set(char_ngram_tokenize(subtask))
+        duplicate_of = next(
+            (
+                kept[i]
+                for i, other in enumerate(kept_bigrams)
+                if len(bigrams & other) >= threshold * len(bigrams | other)
+            ),
+            None,
+        )
+        if duplicate_of is not None:
+            logger.info(f"Dropping near-duplicate subtask {subtask!r} (similar to {duplicate_of!r})")
+            continue
+        kept.append(subtask)
+        kept_bigrams.append(bigrams)
+    return kept
 
 
 class HelpDeskAgent:
@@ -51,77 +130,263 @@ class HelpDeskAgent:
         settings: Settings,
         tools: list = [],
         prompts: HelpDeskAgentPrompts = HelpDeskAgentPrompts(),
+        answer_cache: SemanticAnswerCache | None = None,
+        rate_limiter: OpenAIRateLimiter | None = None,
+        llm_cache: LLMResponseStore | None = None,
     ) -> None:
         self.settings = settings
         self.tools = tools
         self.tool_map = {tool.name: tool for tool in tools}
         self.prompts = prompts
+        # 類似する過去の質問の回答を返すキャッシュ（Noneの場合は使用しない）
+        self.answer_cache = answer_cache
+        # OpenAIのリクエスト数・トークン数の上限を守るためのリミッター（Noneの場合は制限しない）
+        self.rate_limiter = rate_limiter
+
+        # ツール定義と固定のシステムメッセージは構築時に一度だけ作成する。
+        # 毎回同じバイト列のプレフィックスを送ることで、OpenAIのプロンプトキャッシュにヒットしやすくする
+        self.openai_tools = tuple(convert_to_openai_tool(tool) for tool in tools)
+        self._planner_system_message = {"role": "system", "content": self.prompts.planner_system_prompt}
+        self._subtask_system_message = {"role": "system", "content": self.prompts.subtask_system_prompt}
+        self._answer_system_message = {"role": "system", "content": self.prompts.create_last_answer_system_prompt}
         self.client = OpenAI(api_key=self.settings.openai_api_key)
+        self.async_client = AsyncOpenAI(api_key=self.settings.openai_api_key)
+        # 同じリクエストのレスポンスを保存・再生する（llm_cache_modeがoffの場合は使用しない）
+        self.llm_cache = (
+            LLMCache(llm_cache, self.settings.llm_cache_mode)
+            if llm_cache is not None and self.settings.llm_cache_mode != "off"
+            else None
+        )
 
-    def create_plan(self, state: AgentState) -> dict:
-        """計画を作成する
+        if self.settings.speculative_retry:
+            for strategy in self.settings.speculative_strategies:
+                if SPECULATIVE_STRATEGY_TOOLS[strategy] not in self.tool_map:
+                    logger.warning(
+                        f"Speculative strategy '{strategy}' is disabled: "
+                        f"tool '{SPECULATIVE_STRATEGY_TOOLS[strategy]}' is not registered"
+                    )
+
+        # コンパイル済みのグラフ。コンパイル済みのグラフは状態を持たないため、並行する実行の間で共有できる
+        self._compiled_graphs: dict[tuple[str, bool], Pregel] = {}
+        self._compile_lock = threading.Lock()
+
+    def _log_token_usage(self, response: ChatCompletion) -> None:
+        usage = TokenUsage.from_completion(response)
+        logger.info(
+            f"Token usage: prompt={usage.prompt_tokens} (cached={usage.cached_tokens}), "
+            f"completion={usage.completion_tokens}"
+        )
+
+    def _acquire_rate_limit(self, messages: list) -> int:
+        if self.rate_limiter is None:
+            return 0
+        estimated_tokens = estimate_tokens(messages) + COMPLETION_TOKENS_ESTIMATE
+        self.rate_limiter.acquire(estimated_tokens)
+        return estimated_tokens
+
+    async def _aacquire_rate_limit(self, messages: list) -> int:
+        if self.rate_limiter is None:
+            return 0
+        estimated_tokens = estimate_tokens(messages) + COMPLETION_TOKENS_ESTIMATE
+        await self.rate_limiter.aacquire(estimated_tokens)
+        return estimated_tokens
+
+    def _settle_rate_limit(self, estimated_tokens: int, response: ChatCompletion) -> None:
+        # 使用量が返らなかった場合は実際の量がわからないため、見積もりのまま精算しない
+        if self.rate_limiter is None or response.usage is None:
+            return
+        self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+
+    def _refund_rate_limit(self, estimated_tokens: int) -> None:
+        if self.rate_limiter is not None:
+            self.rate_limiter.refund(estimated_tokens)
+
+    def _lookup_llm_cache(
+        self, endpoint: Literal["chat", "parse", "stream"], request: dict
+    ) -> tuple[bytes | None, ChatCompletion | None]:
+        if self.llm_cache is None:
+            return None, None
+        return self.llm_cache.lookup(endpoint, request)
+
+    def _finish_openai_request(self, key: bytes | None, estimated_tokens: int, response: ChatCompletion) -> None:
+        self._settle_rate_limit(estimated_tokens, response)
+        self._log_token_usage(response)
+        if key is not None:
+            self.llm_cache.save(key, response)
+
+    def _request_openai(
+        self, endpoint: Literal["chat", "parse"], request: dict, send: Callable[[], ChatCompletion]
+    ) -> ChatCompletion:
+        """保存済みのレスポンスがあればそれを返し、なければレートリミッターを通してOpenAIにリクエストを送信する
+
+        保存済みのレスポンスを返す場合はOpenAIを呼び出さないため、リクエスト数・トークン数の枠は使わない。
+        """
+        key, cached = self._lookup_llm_cache(endpoint, request)
+        if cached is not None:
+            return cached
+        estimated_tokens = self._acquire_rate_limit(request["messages"])
+        with span("openai.chat", "llm", model=self.settings.openai_model) as llm_span:
+            try:
+                logger.info("Sending request to OpenAI...")
+                response = send()
+                logger.info("✅ Successfully received response from OpenAI.")
+            except Exception as e:
+                logger.error(f"Error during OpenAI request: {e}")
+                self._refund_rate_limit(estimated_tokens)
+                raise
+            llm_span.add_token_usage(TokenUsage.from_completion(response))
+        self._finish_openai_request(key, estimated_tokens, response)
+        return response
+
+    async def _arequest_openai(
+        self, endpoint: Literal["chat", "parse"], request: dict, send: Callable[[], Awaitable[ChatCompletion]]
+    ) -> ChatCompletion:
+        """_request_openaiの非同期版"""
+        key, cached = self._lookup_llm_cache(endpoint, request)
+        if cached is not None:
+            return cached
+        estimated_tokens = await self._aacquire_rate_limit(request["messages"])
+        with span("openai.chat", "llm", model=self.settings.openai_model) as llm_span:
+            try:
+                logger.info("Sending request to OpenAI...")
+                response = await send()
+                logger.info("✅ Successfully received response from OpenAI.")
+            except Exception as e:
+                logger.error(f"Error during OpenAI request: {e}")
+                self._refund_rate_limit(estimated_tokens)
+                raise
+            llm_span.add_token_usage(TokenUsage.from_completion(response))
+        self._finish_openai_request(key, estimated_tokens, response)
+        return response
+
+    def _create_chat_completion(self, messages: list, **kwargs) -> ChatCompletion:
+        """OpenAIにリクエストを送信する
 
         Args:
-            state (AgentState): 入力の状態
+            messages (list): 送信するメッセージ
+            **kwargs: toolsなどの追加パラメータ
 
         Returns:
-            AgentState: 更新された状態
+            ChatCompletion: OpenAIのレスポンス
         """
+        request = {"model": self.settings.openai_model, "messages": messages, "temperature": 0, "seed": 0, **kwargs}
+        return self._request_openai("chat", request, lambda: self.client.chat.completions.create(**request))
 
-        logger.info("🚀 Starting plan generation process...")
+    async def _acreate_chat_completion(self, messages: list, **kwargs) -> ChatCompletion:
+        """OpenAIに非同期でリクエストを送信する
 
-        # tool定義を渡しシステムプロンプトを生成
-        system_prompt = self.prompts.planner_system_prompt
+        Args:
+            messages (list): 送信するメッセージ
+            **kwargs: toolsなどの追加パラメータ
 
+        Returns:
+            ChatCompletion: OpenAIのレスポンス
+        """
+        request = {"model": self.settings.openai_model, "messages": messages, "temperature": 0, "seed": 0, **kwargs}
+        return await self._arequest_openai(
+            "chat", request, lambda: self.async_client.chat.completions.create(**request)
+        )
+
+    def _parse_chat_completion(self, messages: list, response_format: type[BaseModel]) -> ChatCompletion:
+        """Structured outputを指定してOpenAIにリクエストを送信する
+
+        Args:
+            messages (list): 送信するメッセージ
+            response_format (type[BaseModel]): 出力のスキーマ
+
+        Returns:
+            ChatCompletion: パース済みのOpenAIのレスポンス
+        """
+        request = {
+            "model": self.settings.openai_model,
+            "messages": messages,
+            "response_format": response_format,
+            "temperature": 0,
+            "seed": 0,
+        }
+        return self._request_openai("parse", request, lambda: self.client.beta.chat.completions.parse(**request))
+
+    async def _aparse_chat_completion(self, messages: list, response_format: type[BaseModel]) -> ChatCompletion:
+        """Structured outputを指定してOpenAIに非同期でリクエストを送信する
+
+        Args:
+            messages (list): 送信するメッセージ
+            response_format (type[BaseModel]): 出力のスキーマ
+
+        Returns:
+            ChatCompletion: パース済みのOpenAIのレスポンス
+        """
+        request = {
+            "model": self.settings.openai_model,
+            "messages": messages,
+            "response_format": response_format,
+            "temperature": 0,
+            "seed": 0,
+        }
+        return await self._arequest_openai(
+            "parse", request, lambda: self.async_client.beta.chat.completions.parse(**request)
+        )
+
+    def _build_plan_messages(self, state: AgentState) -> list:
         # ユーザーの質問を渡しユーザープロンプトを生成
         user_prompt = self.prompts.planner_user_prompt.format(
             question=state["question"],
         )
         messages = [
-            {"role": "system", "content": system_prompt},
+            dict(self._planner_system_message),
             {"role": "user", "content": user_prompt},
         ]
         logger.debug(f"Final prompt messages: {messages}")
+        return messages
 
-        # OpenAIにリクエストを送信
-        try:
-            logger.info("Sending request to OpenAI...")
-            response = self.client.beta.chat.completions.parse(
-                model=self.settings.openai_model,
-                messages=messages,
-                response_format=Plan,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("✅ Successfully received response from OpenAI.")
-        except Exception as e:
-            logger.error(f"Error during OpenAI request: {e}")
-            raise
-
+    def _plan_update(self, response: ChatCompletion) -> dict:
         # レスポンスからStructured outputを利用しPlanクラスを取得
         plan = response.choices[0].message.parsed
 
+        # 同じ検索を重複して行わないよう、ほぼ同じ内容のサブタスクは1つにまとめる
+        subtasks = plan.subtasks
+        if self.settings.plan_dedup_threshold is not None:
+            subtasks = deduplicate_subtasks(subtasks, self.settings.plan_dedup_threshold)
+
         logger.info("Plan generation complete!")
 
         # 生成した計画を返し、状態を更新する
-        return {"plan": plan.subtasks}
+        return {"plan": subtasks, "token_usages": [TokenUsage.from_completion(response)]}
 
-    def select_tools(self, state: AgentSubGraphState) -> dict:
-        """ツールを選択する
+    def create_plan(self, state: AgentState) -> dict:
+        """計画を作成する
 
         Args:
-            state (AgentSubGraphState): 入力の状態
+            state (AgentState): 入力の状態
 
         Returns:
-            dict: 更新された状態
+            AgentState: 更新された状態
         """
 
-        logger.info("🚀 Starting tool selection process...")
+        logger.info("🚀 Starting plan generation process...")
+        messages = self._build_plan_messages(state)
+        response = self._parse_chat_completion(messages, Plan)
+        return self._plan_update(response)
+
+    async def acreate_plan(self, state: AgentState) -> dict:
+        """計画を非同期で作成する
+
+        Args:
+            state (AgentState): 入力の状態
+
+        Returns:
+            AgentState: 更新された状態
+        """
 
-        # OpenAI対応のtool定義に書き換える
-        logger.debug("Converting tools for OpenAI format...")
-        openai_tools = [convert_to_openai_tool(tool) for tool in self.tools]
+        logger.info("🚀 Starting plan generation process...")
+        messages = self._build_plan_messages(state)
+        response = await self._aparse_chat_completion(messages, Plan)
+        return self._plan_update(response)
 
+    def _compact_messages(self, messages: list) -> list:
+        return compact_subtask_messages(messages, self.settings.subtask_context_max_tokens)
+
+    def _build_tool_selection_messages(self, state: AgentSubGraphState) -> list:
         # リトライされたかどうかでプロンプトを切り替える
         if state["challenge_count"] == 0:
             logger.debug("Creating user prompt for tool selection...")
@@ -132,7 +397,7 @@ class HelpDeskAgent:
             )
 
             messages = [
-                {"role": "system", "content": self.prompts.subtask_system_prompt},
+                dict(self._subtask_system_message),
                 {"role": "user", "content": user_prompt},
             ]
 
@@ -140,30 +405,16 @@ class HelpDeskAgent:
             logger.debug("Creating user prompt for tool retry...")
 
             # リトライされた場合は過去の対話情報にプロンプトを追加する
-            messages: list = state["messages"]
-
-            # NOTE: トークン数節約のため過去の検索結果は除く
-            # roleがtoolまたはtool_callsを持つものは除く
-            messages = [message for message in messages if message["role"] != "tool" or "tool_calls" not in message]
+            # NOTE: トークン数節約のため、直前の試行より前の試行はリフレクションのアドバイスの要約にまとめる
+            messages = self._compact_messages(state["messages"])
 
             user_retry_prompt = self.prompts.subtask_retry_answer_user_prompt
             user_message = {"role": "user", "content": user_retry_prompt}
             messages.append(user_message)
 
-        try:
-            logger.info("Sending request to OpenAI...")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                tools=openai_tools,  # type: ignore
-                temperature=0,
-                seed=0,
-            )
-            logger.info("✅ Successfully received response from OpenAI.")
-        except Exception as e:
-            logger.error(f"Error during OpenAI request: {e}")
-            raise
+        return messages
 
+    def _tool_selection_update(self, messages: list, response: ChatCompletion) -> dict:
         if response.choices[0].message.tool_calls is None:
             raise ValueError("Tool calls are None")
 
@@ -176,22 +427,52 @@ class HelpDeskAgent:
         messages.append(ai_message)
 
         # リトライの場合は追加分のメッセージのみを更新する
-        return {"messages": messages}
+        return {"messages": messages, "token_usages": [TokenUsage.from_completion(response)]}
 
-    def execute_tools(self, state: AgentSubGraphState) -> dict:
-        """ツールを実行する
+    def _tool_selection_kwargs(self, tool_name: str | None) -> dict:
+        # tool_nameを指定した場合はそのツールを必ず呼び出させる
+        kwargs: dict = {"tools": list(self.openai_tools)}
+        if tool_name is not None:
+            kwargs["tool_choice"] = {"type": "function", "function": {"name": tool_name}}
+        return kwargs
+
+    def select_tools(self, state: AgentSubGraphState) -> dict:
+        """ツールを選択する
 
         Args:
             state (AgentSubGraphState): 入力の状態
 
-        Raises:
-            ValueError: toolがNoneの場合
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting tool selection process...")
+        return self._select_tools(state)
+
+    def _select_tools(self, state: AgentSubGraphState, tool_name: str | None = None) -> dict:
+        messages = self._build_tool_selection_messages(state)
+        response = self._create_chat_completion(messages, **self._tool_selection_kwargs(tool_name))
+        return self._tool_selection_update(messages, response)
+
+    async def aselect_tools(self, state: AgentSubGraphState) -> dict:
+        """ツールを非同期で選択する
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
 
         Returns:
             dict: 更新された状態
         """
 
-        logger.info("🚀 Starting tool execution process...")
+        logger.info("🚀 Starting tool selection process...")
+        return await self._aselect_tools(state)
+
+    async def _aselect_tools(self, state: AgentSubGraphState, tool_name: str | None = None) -> dict:
+        messages = self._build_tool_selection_messages(state)
+        response = await self._acreate_chat_completion(messages, **self._tool_selection_kwargs(tool_name))
+        return self._tool_selection_update(messages, response)
+
+    def _get_tool_calls(self, state: AgentSubGraphState) -> list:
         messages = state["messages"]
 
         # 最後のメッセージからツールの呼び出しを取得
@@ -203,14 +484,48 @@ class HelpDeskAgent:
             logger.error(f"Messages: {messages}")
             raise ValueError("Tool calls are None")
 
+        return tool_calls
+
+    def _tool_execution_update(
+        self,
+        messages: list,
+        tool_calls: list,
+        tool_outputs: list[list[SearchOutput] | None],
+    ) -> dict:
+        """ツールの実行結果から状態の更新内容を作成する
+
+        Args:
+            messages (list): これまでのメッセージ
+            tool_calls (list): ツールの呼び出し
+            tool_outputs (list[list[SearchOutput] | None]): tool_callsと同じ順序の実行結果
+                （タイムアウトした場合はNone）
+
+        Returns:
+            dict: 更新された状態
+        """
         tool_results = []
+        # 複数のツールが同じチャンクを返した場合は本文を1度だけ渡す
+        serializer = ToolResultSerializer(
+            max_tokens_per_hit=self.settings.tool_result_max_tokens_per_hit,
+            max_tokens_per_call=self.settings.tool_result_max_tokens_per_call,
+        )
+        repr_tokens = 0
+        content_tokens = 0
 
-        for tool_call in tool_calls:
+        # 結果はtool_callsの順序で組み立てる
+        for tool_call, tool_output in zip(tool_calls, tool_outputs, strict=True):
             tool_name = tool_call["function"]["name"]
             tool_args = tool_call["function"]["arguments"]
 
-            tool = self.tool_map[tool_name]
-            tool_result: list[SearchOutput] = tool.invoke(tool_args)
+            if tool_output is None:
+                logger.warning(f"Tool {tool_name} timed out after {TOOL_TIMEOUT_SECONDS} seconds")
+                tool_result: list[SearchOutput] = []
+                content = f"ツールの実行が{TOOL_TIMEOUT_SECONDS}秒以内に完了しませんでした。"
+            else:
+                tool_result = tool_output
+                content = serializer.serialize(tool_result)
+                repr_tokens += estimate_text_tokens(str(tool_result))
+                content_tokens += estimate_text_tokens(content)
 
             tool_results.append(
                 ToolResult(
@@ -223,39 +538,88 @@ class HelpDeskAgent:
             messages.append(
                 {
                     "role": "tool",
-                    "content": str(tool_result),
+                    "content": content,
                     "tool_call_id": tool_call["id"],
                 }
             )
+        logger.info(f"Tool result tokens (estimated): {content_tokens} (repr would be {repr_tokens})")
         logger.info("Tool execution complete!")
         return {"messages": messages, "tool_results": [tool_results]}
 
-    def create_subtask_answer(self, state: AgentSubGraphState) -> dict:
-        """サブタスク回答を作成する
+    def _invoke_tool(self, tool_call: dict) -> list[SearchOutput]:
+        tool = self.tool_map[tool_call["function"]["name"]]
+        with span(tool.name, "tool", arguments=tool_call["function"]["arguments"]):
+            return tool.invoke(tool_call["function"]["arguments"])
+
+    def execute_tools(self, state: AgentSubGraphState) -> dict:
+        """ツールを実行する
 
         Args:
             state (AgentSubGraphState): 入力の状態
 
+        Raises:
+            ValueError: toolがNoneの場合
+
         Returns:
             dict: 更新された状態
         """
 
-        logger.info("🚀 Starting subtask answer creation process...")
-        messages = state["messages"]
+        logger.info("🚀 Starting tool execution process...")
+        tool_calls = self._get_tool_calls(state)
 
+        # 複数のツール呼び出しを並列に実行し、最も遅いツールの時間で完了させる
+        executor = ThreadPoolExecutor(max_workers=max(len(tool_calls), 1))
+        # 計測中のトレーサーを引き継ぐため、呼び出し元のコンテキストで実行する
+        futures = [
+            executor.submit(contextvars.copy_context().run, self._invoke_tool, tool_call) for tool_call in tool_calls
+        ]
+        deadline = time.monotonic() + TOOL_TIMEOUT_SECONDS
+
+        tool_outputs: list[list[SearchOutput] | None] = []
         try:
-            logger.info("Sending request to OpenAI...")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("✅ Successfully received response from OpenAI.")
-        except Exception as e:
-            logger.error(f"Error during OpenAI request: {e}")
-            raise
+            for future in futures:
+                try:
+                    tool_outputs.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+                except TimeoutError:
+                    tool_outputs.append(None)
+        finally:
+            # タイムアウトしたツールの完了は待たない
+            executor.shutdown(wait=False, cancel_futures=True)
 
+        return self._tool_execution_update(state["messages"], tool_calls, tool_outputs)
+
+    async def aexecute_tools(self, state: AgentSubGraphState) -> dict:
+        """ツールを非同期で実行する
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
+
+        Raises:
+            ValueError: toolがNoneの場合
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting tool execution process...")
+        tool_calls = self._get_tool_calls(state)
+
+        async def _invoke(tool_call: dict) -> list[SearchOutput] | None:
+            tool = self.tool_map[tool_call["function"]["name"]]
+            with span(tool.name, "tool", arguments=tool_call["function"]["arguments"]):
+                try:
+                    return await asyncio.wait_for(
+                        tool.ainvoke(tool_call["function"]["arguments"]), TOOL_TIMEOUT_SECONDS
+                    )
+                except TimeoutError:
+                    return None
+
+        # 複数のツール呼び出しを並行に実行する。gatherは引数の順序で結果を返す
+        tool_outputs = await asyncio.gather(*(_invoke(tool_call) for tool_call in tool_calls))
+
+        return self._tool_execution_update(state["messages"], tool_calls, list(tool_outputs))
+
+    def _subtask_answer_update(self, messages: list, response: ChatCompletion) -> dict:
         subtask_answer = response.choices[0].message.content
 
         ai_message = {"role": "assistant", "content": subtask_answer}
@@ -266,42 +630,50 @@ class HelpDeskAgent:
         return {
             "messages": messages,
             "subtask_answer": subtask_answer,
+            # QAの回答がリフレクションでNGになった後にLLMで作り直した場合は、QAの回答ではない
+            "answered_from_qa": False,
+            "token_usages": [TokenUsage.from_completion(response)],
         }
 
-    def reflect_subtask(self, state: AgentSubGraphState) -> dict:
-        """サブタスク回答を内省する
+    def create_subtask_answer(self, state: AgentSubGraphState) -> dict:
+        """サブタスク回答を作成する
 
         Args:
             state (AgentSubGraphState): 入力の状態
 
-        Raises:
-            ValueError: reflection resultがNoneの場合
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting subtask answer creation process...")
+        messages = self._compact_messages(state["messages"])
+        response = self._create_chat_completion(messages)
+        return self._subtask_answer_update(messages, response)
+
+    async def acreate_subtask_answer(self, state: AgentSubGraphState) -> dict:
+        """サブタスク回答を非同期で作成する
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
 
         Returns:
             dict: 更新された状態
         """
 
-        logger.info("🚀 Starting reflection process...")
-        messages = state["messages"]
+        logger.info("🚀 Starting subtask answer creation process...")
+        messages = self._compact_messages(state["messages"])
+        response = await self._acreate_chat_completion(messages)
+        return self._subtask_answer_update(messages, response)
+
+    def _build_reflection_messages(self, state: AgentSubGraphState) -> list:
+        messages = self._compact_messages(state["messages"])
 
         user_prompt = self.prompts.subtask_reflection_user_prompt
 
         messages.append({"role": "user", "content": user_prompt})
+        return messages
 
-        try:
-            logger.info("Sending request to OpenAI...")
-            response = self.client.beta.chat.completions.parse(
-                model=self.settings.openai_model,
-                messages=messages,
-                response_format=ReflectionResult,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("✅ Successfully received response from OpenAI.")
-        except Exception as e:
-            logger.error(f"Error during OpenAI request: {e}")
-            raise
-
+    def _reflection_update(self, state: AgentSubGraphState, messages: list, response: ChatCompletion) -> dict:
         reflection_result = response.choices[0].message.parsed
         if reflection_result is None:
             raise ValueError("Reflection result is None")
@@ -318,27 +690,286 @@ class HelpDeskAgent:
             "reflection_results": [reflection_result],
             "challenge_count": state["challenge_count"] + 1,
             "is_completed": reflection_result.is_completed,
+            "token_usages": [TokenUsage.from_completion(response)],
         }
 
         if update_state["challenge_count"] >= MAX_CHALLENGE_COUNT and not reflection_result.is_completed:
             update_state["subtask_answer"] = f"{state['subtask']}の回答が見つかりませんでした。"
+            update_state["answered_from_qa"] = False
 
         logger.info("Reflection complete!")
         return update_state
 
-    def create_answer(self, state: AgentState) -> dict:
-        """最終回答を作成する
+    def reflect_subtask(self, state: AgentSubGraphState) -> dict:
+        """サブタスク回答を内省する
 
         Args:
-            state (AgentState): 入力の状態
+            state (AgentSubGraphState): 入力の状態
+
+        Raises:
+            ValueError: reflection resultがNoneの場合
 
         Returns:
             dict: 更新された状態
         """
 
-        logger.info("🚀 Starting final answer creation process...")
-        system_prompt = self.prompts.create_last_answer_system_prompt
+        logger.info("🚀 Starting reflection process...")
+        messages = self._build_reflection_messages(state)
+        response = self._parse_chat_completion(messages, ReflectionResult)
+        return self._reflection_update(state, messages, response)
+
+    async def areflect_subtask(self, state: AgentSubGraphState) -> dict:
+        """サブタスク回答を非同期で内省する
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
+
+        Raises:
+            ValueError: reflection resultがNoneの場合
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting reflection process...")
+        messages = self._build_reflection_messages(state)
+        response = await self._aparse_chat_completion(messages, ReflectionResult)
+        return self._reflection_update(state, messages, response)
 
+    def _qa_fast_path_hit(self, state: AgentSubGraphState) -> SearchOutput | None:
+        """直前のツール実行でQA検索の最上位の類似度がしきい値以上ならその結果を返す
+
+        QAの回答をそのまま使ってリフレクションでNGになったサブタスクでは、同じ回答を繰り返さないよう使用しない。
+        """
+        min_score = self.settings.qa_fast_path_min_score
+        if min_score is None or state.get("qa_fast_path_tried") or not state["tool_results"]:
+            return None
+        top_hits = [
+            tool_result.results[0]
+            for tool_result in state["tool_results"][-1]
+            if tool_result.tool_name == QA_TOOL_NAME and tool_result.results
+        ]
+        best = max(top_hits, key=lambda hit: hit.score or 0.0, default=None)
+        if best is None or best.score is None or best.score < min_score:
+            return None
+        return best
+
+    def _route_after_tool_execution(
+        self, state: AgentSubGraphState
+    ) -> Literal["answer_from_qa", "create_subtask_answer"]:
+        if self._qa_fast_path_hit(state) is not None:
+            return "answer_from_qa"
+        return "create_subtask_answer"
+
+    def answer_from_qa(self, state: AgentSubGraphState) -> dict:
+        """QA検索の最上位の回答をそのままサブタスクの回答にする
+
+        LLMは呼び出さない。qa_fast_path_reflectionがskipの場合はこの時点でサブタスクを完了とする。
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
+
+        Raises:
+            ValueError: しきい値以上のQA検索の結果がない場合
+
+        Returns:
+            dict: 更新された状態
+        """
+        hit = self._qa_fast_path_hit(state)
+        if hit is None:
+            raise ValueError("No QA hit above the fast path threshold")
+
+        logger.info(f"⚡ Answering subtask from QA hit (score={hit.score:.3f})")
+        subtask_answer = extract_qa_answer(hit.content)
+        messages = [*state["messages"], {"role": "assistant", "content": subtask_answer}]
+        update_state = {
+            "messages": messages,
+            "subtask_answer": subtask_answer,
+            "answered_from_qa": True,
+            "qa_fast_path_tried": True,
+        }
+        if self.settings.qa_fast_path_reflection == "skip":
+            update_state["is_completed"] = True
+            update_state["challenge_count"] = state["challenge_count"] + 1
+        return update_state
+
+    def _subtask_answer_steps(self, state: AgentSubGraphState, is_async: bool) -> list:
+        """ツール実行の後に行う回答作成とリフレクションのノードを返す（サブグラフのエッジと同じ分岐）"""
+        reflect = self.areflect_subtask if is_async else self.reflect_subtask
+        if self._qa_fast_path_hit(state) is None:
+            return [self.acreate_subtask_answer if is_async else self.create_subtask_answer, reflect]
+        if self.settings.qa_fast_path_reflection == "verify":
+            return [self.answer_from_qa, reflect]
+        return [self.answer_from_qa]
+
+    def _speculative_strategies(self) -> list[tuple[str, str]]:
+        """投機的実行に使う (戦略名, ツール名) のリスト。ツールが登録されていない戦略は除く"""
+        return [
+            (strategy, SPECULATIVE_STRATEGY_TOOLS[strategy])
+            for strategy in self.settings.speculative_strategies
+            if SPECULATIVE_STRATEGY_TOOLS[strategy] in self.tool_map
+        ]
+
+    def _new_speculative_attempt(self, state: AgentSubGraphState) -> dict:
+        return {**state, "messages": [], "tool_results": [], "reflection_results": [], "token_usages": []}
+
+    def _apply_subgraph_update(self, attempt: dict, update: dict) -> None:
+        # LangGraphのreducerと同じように、operator.addのキーは追加し、それ以外は上書きする
+        for key, value in update.items():
+            if key in _SUBGRAPH_APPEND_KEYS:
+                attempt[key] = [*attempt[key], *value]
+            else:
+                attempt[key] = value
+
+    def _run_speculative_attempt(self, attempt: dict, tool_name: str, cancel_event: threading.Event) -> dict | None:
+        with lane(f"{attempt['subtask']} ({tool_name})"):
+            return self._run_speculative_steps(attempt, tool_name, cancel_event)
+
+    def _run_speculative_steps(self, attempt: dict, tool_name: str, cancel_event: threading.Event) -> dict | None:
+        for step in [lambda state: self._select_tools(state, tool_name), self.execute_tools]:
+            # 他の試行が完了と評価された場合は、次のLLM呼び出しを行わずに終了する
+            if cancel_event.is_set():
+                return None
+            self._apply_subgraph_update(attempt, step(attempt))
+        for step in self._subtask_answer_steps(attempt, is_async=False):
+            if cancel_event.is_set():
+                return None
+            self._apply_subgraph_update(attempt, step(attempt))
+        return attempt
+
+    async def _arun_speculative_attempt(self, attempt: dict, tool_name: str) -> dict:
+        # タスクごとにコンテキストがコピーされるため、列の設定は他の試行に影響しない
+        with lane(f"{attempt['subtask']} ({tool_name})"):
+            self._apply_subgraph_update(attempt, await self._aselect_tools(attempt, tool_name))
+            self._apply_subgraph_update(attempt, await self.aexecute_tools(attempt))
+            for step in self._subtask_answer_steps(attempt, is_async=True):
+                update = step(attempt)
+                # QAの回答をそのまま使うノードは同期関数
+                self._apply_subgraph_update(attempt, await update if asyncio.iscoroutine(update) else update)
+        return attempt
+
+    def _speculation_update(
+        self,
+        strategies: list[tuple[str, str]],
+        attempts: list[dict],
+        finished: list[int],
+        errors: list[Exception],
+    ) -> dict:
+        """投機的実行の結果から状態の更新内容を作成する
+
+        完了と評価された試行があればそれを、なければ最初に終わった試行を採用する。
+        トークン使用量は打ち切った試行の分も含めて計上する。
+        """
+        if not finished:
+            raise errors[0] if errors else ValueError("No speculative attempt finished")
+
+        chosen_idx = next((idx for idx in finished if attempts[idx]["is_completed"]), finished[0])
+        chosen = attempts[chosen_idx]
+        logger.info(
+            f"Speculative attempts: adopted '{strategies[chosen_idx][0]}' "
+            f"(completed={chosen['is_completed']}, finished={len(finished)}/{len(attempts)})"
+        )
+        return {
+            "messages": chosen["messages"],
+            "tool_results": chosen["tool_results"],
+            "reflection_results": chosen["reflection_results"],
+            "challenge_count": chosen["challenge_count"],
+            "is_completed": chosen["is_completed"],
+            "subtask_answer": chosen["subtask_answer"],
+            "answered_from_qa": chosen["answered_from_qa"],
+            "qa_fast_path_tried": chosen["qa_fast_path_tried"],
+            "token_usages": [usage for attempt in attempts for usage in list(attempt["token_usages"])],
+        }
+
+    def speculate_subtask(self, state: AgentSubGraphState) -> dict:
+        """1回目の試行を複数の戦略で並列に実行し、最初に完了と評価されたものを採用する
+
+        戦略ごとに最初に呼び出すツールを変えて、ツール選択からリフレクションまでを並列に実行する。
+        完了と評価された試行が出た時点で残りの試行は次のステップに進まずに打ち切る。
+        実行中のステップはLLMの呼び出しを途中で止められないため、その完了を待ってトークン使用量を計上する。
+        いずれも完了しなかった場合は、最初に終わった試行の続きから通常のやり直しを行う。
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting speculative attempts...")
+        strategies = self._speculative_strategies()
+        attempts = [self._new_speculative_attempt(state) for _ in strategies]
+        cancel_event = threading.Event()
+
+        executor = ThreadPoolExecutor(max_workers=len(strategies))
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, self._run_speculative_attempt, attempt, tool_name, cancel_event
+            ): idx
+            for idx, (attempt, (_, tool_name)) in enumerate(zip(attempts, strategies, strict=True))
+        }
+        finished: list[int] = []
+        errors: list[Exception] = []
+        try:
+            for future in as_completed(futures):
+                try:
+                    attempt = future.result()
+                except Exception as e:
+                    logger.error(f"Speculative attempt '{strategies[futures[future]][0]}' failed: {e}")
+                    errors.append(e)
+                    continue
+                if attempt is None:
+                    continue
+                finished.append(futures[future])
+                if attempt["is_completed"]:
+                    break
+        finally:
+            # 実行中の試行は現在のステップが終わった時点で止まる。
+            # そのステップのLLM呼び出しのトークン使用量も計上するため、止まるまで待つ
+            cancel_event.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return self._speculation_update(strategies, attempts, finished, errors)
+
+    async def aspeculate_subtask(self, state: AgentSubGraphState) -> dict:
+        """1回目の試行を複数の戦略で並行に実行し、最初に完了と評価されたものを採用する
+
+        完了と評価された試行が出た時点で、残りの試行はLLMの呼び出しやツールの実行の途中でもキャンセルする。
+
+        Args:
+            state (AgentSubGraphState): 入力の状態
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting speculative attempts...")
+        strategies = self._speculative_strategies()
+        attempts = [self._new_speculative_attempt(state) for _ in strategies]
+        tasks = {
+            asyncio.create_task(self._arun_speculative_attempt(attempt, tool_name)): idx
+            for idx, (attempt, (_, tool_name)) in enumerate(zip(attempts, strategies, strict=True))
+        }
+        finished: list[int] = []
+        errors: list[Exception] = []
+        try:
+            pending = set(tasks)
+            while pending and not any(attempts[idx]["is_completed"] for idx in finished):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        logger.error(f"Speculative attempt '{strategies[tasks[task]][0]}' failed: {task.exception()}")
+                        errors.append(task.exception())
+                    else:
+                        finished.append(tasks[task])
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return self._speculation_update(strategies, attempts, finished, errors)
+
+    def _build_answer_messages(self, state: AgentState) -> list:
         # サブタスク結果のうちタスク内容と回答のみを取得
         subtask_results = [(result.task_name, result.subtask_answer) for result in state["subtask_results"]]
         user_prompt = self.prompts.create_last_answer_user_prompt.format(
@@ -346,42 +977,107 @@ class HelpDeskAgent:
             plan=state["plan"],
             subtask_results=str(subtask_results),
         )
-        messages = [
-            {"role": "system", "content": system_prompt},
+        return [
+            dict(self._answer_system_message),
             {"role": "user", "content": user_prompt},
         ]
 
-        try:
-            logger.info("Sending request to OpenAI...")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("✅ Successfully received response from OpenAI.")
-        except Exception as e:
-            logger.error(f"Error during OpenAI request: {e}")
-            raise
+    def create_answer(self, state: AgentState) -> dict:
+        """最終回答を作成する
+
+        Args:
+            state (AgentState): 入力の状態
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting final answer creation process...")
+        messages = self._build_answer_messages(state)
+        response = self._create_chat_completion(messages)
 
         logger.info("Final answer creation complete!")
 
-        return {"last_answer": response.choices[0].message.content}
+        return {
+            "last_answer": response.choices[0].message.content,
+            "token_usages": [TokenUsage.from_completion(response)],
+        }
 
-    def _execute_subgraph(self, state: AgentState):
-        subgraph = self._create_subgraph()
+    async def acreate_answer(self, state: AgentState) -> dict:
+        """最終回答を非同期で作成する
 
-        result = subgraph.invoke(
-            {
-                "question": state["question"],
-                "plan": state["plan"],
-                "subtask": state["plan"][state["current_step"]],
-                "current_step": state["current_step"],
-                "is_completed": False,
-                "challenge_count": 0,
-            }
-        )
+        Args:
+            state (AgentState): 入力の状態
+
+        Returns:
+            dict: 更新された状態
+        """
+
+        logger.info("🚀 Starting final answer creation process...")
+        messages = self._build_answer_messages(state)
+        response = await self._acreate_chat_completion(messages)
+
+        logger.info("Final answer creation complete!")
+
+        return {
+            "last_answer": response.choices[0].message.content,
+            "token_usages": [TokenUsage.from_completion(response)],
+        }
 
+    async def _astream_answer(self, state: AgentState) -> AsyncIterator[str | TokenUsage]:
+        """最終回答をOpenAIのストリーミングで作成し、届いた断片から順に返す
+
+        最後にストリームの末尾で届くトークン使用量を返す。
+        保存済みの回答があればOpenAIを呼び出さず、回答全体を1つの断片として返す。
+
+        Yields:
+            str | TokenUsage: 最終回答の断片、最後にトークン使用量
+        """
+
+        logger.info("🚀 Starting final answer streaming...")
+        messages = self._build_answer_messages(state)
+        request = {"model": self.settings.openai_model, "messages": messages, "temperature": 0, "seed": 0}
+        key, cached = self._lookup_llm_cache("stream", request)
+        if cached is not None:
+            yield cached.choices[0].message.content or ""
+            yield TokenUsage.from_completion(cached)
+            return
+
+        estimated_tokens = await self._aacquire_rate_limit(messages)
+        chunks = []
+        with span("openai.chat", "llm", model=self.settings.openai_model, stream=True) as llm_span:
+            try:
+                stream = await self.async_client.chat.completions.create(
+                    **request, stream=True, stream_options={"include_usage": True}
+                )
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except Exception as e:
+                logger.error(f"Error during OpenAI request: {e}")
+                self._refund_rate_limit(estimated_tokens)
+                raise
+            response = completion_from_chunks(chunks)
+            llm_span.add_token_usage(TokenUsage.from_completion(response))
+        self._finish_openai_request(key, estimated_tokens, response)
+
+        logger.info("Final answer streaming complete!")
+        yield TokenUsage.from_completion(response)
+
+    def _subgraph_input(self, state: AgentState) -> dict:
+        return {
+            "question": state["question"],
+            "plan": state["plan"],
+            "subtask": state["plan"][state["current_step"]],
+            "current_step": state["current_step"],
+            "is_completed": False,
+            "challenge_count": 0,
+            "answered_from_qa": False,
+            "qa_fast_path_tried": False,
+        }
+
+    def _subtask_result_update(self, result: dict) -> dict:
         subtask_result = Subtask(
             task_name=result["subtask"],
             tool_results=result["tool_results"],
@@ -389,9 +1085,62 @@ class HelpDeskAgent:
             is_completed=result["is_completed"],
             subtask_answer=result["subtask_answer"],
             challenge_count=result["challenge_count"],
+            answered_from_qa=result["answered_from_qa"],
         )
 
-        return {"subtask_results": [subtask_result]}
+        return {"subtask_results": [subtask_result], "token_usages": result["token_usages"]}
+
+    def _execute_subgraph(self, state: AgentState):
+        subgraph = self._get_compiled_graph("subgraph", is_async=False)
+        result = subgraph.invoke(self._subgraph_input(state))
+        return self._subtask_result_update(result)
+
+    async def _aexecute_subgraph(self, state: AgentState):
+        subgraph = self._get_compiled_graph("subgraph", is_async=True)
+        result = await subgraph.ainvoke(self._subgraph_input(state))
+        return self._subtask_result_update(result)
+
+    def _add_traced_node(self, workflow: StateGraph, name: str, node) -> None:
+        workflow.add_node(name, self._traced_node(name, node))
+
+    def _traced_node(self, name: str, node):
+        """ノードの処理時間とトークン使用量を計測するようにラップする
+
+        計測が無効の場合はそのままノードを呼び出す。サブグラフのノードはサブタスク名と試行回数を記録し、
+        サブタスクごとの列に並べる。
+        """
+
+        def _open_span(state: dict):
+            attributes = {}
+            if "subtask" in state:
+                attributes = {"subtask": state["subtask"], "attempt": state.get("challenge_count", 0)}
+            return span(name, "node", **attributes)
+
+        def _record_usage(node_span, update: dict) -> None:
+            for usage in update.get("token_usages", []):
+                node_span.add_token_usage(usage)
+
+        if asyncio.iscoroutinefunction(node):
+
+            async def _async_wrapper(state: dict) -> dict:
+                if not is_tracing():
+                    return await node(state)
+                with lane(state.get("subtask", "main")), _open_span(state) as node_span:
+                    update = await node(state)
+                    _record_usage(node_span, update)
+                return update
+
+            return _async_wrapper
+
+        def _wrapper(state: dict) -> dict:
+            if not is_tracing():
+                return node(state)
+            with lane(state.get("subtask", "main")), _open_span(state) as node_span:
+                update = node(state)
+                _record_usage(node_span, update)
+            return update
+
+        return _wrapper
 
     def _should_continue_exec_subtasks(self, state: AgentState) -> list:
         return [
@@ -412,32 +1161,70 @@ class HelpDeskAgent:
         else:
             return "continue"
 
-    def _create_subgraph(self) -> Pregel:
+    def _create_subgraph(self, is_async: bool = False) -> Pregel:
         """サブグラフを作成する
 
+        Args:
+            is_async (bool): Trueの場合は非同期のノードでグラフを作成する
+
         Returns:
             Pregel: サブグラフ
         """
         workflow = StateGraph(AgentSubGraphState)
 
         # ツール選択ノードを追加
-        workflow.add_node("select_tools", self.select_tools)
+        self._add_traced_node(workflow, "select_tools", self.aselect_tools if is_async else self.select_tools)
 
         # ツール実行ノードを追加
-        workflow.add_node("execute_tools", self.execute_tools)
+        self._add_traced_node(workflow, "execute_tools", self.aexecute_tools if is_async else self.execute_tools)
 
         # サブタスク回答作成ノードを追加
-        workflow.add_node("create_subtask_answer", self.create_subtask_answer)
+        self._add_traced_node(
+            workflow,
+            "create_subtask_answer",
+            self.acreate_subtask_answer if is_async else self.create_subtask_answer,
+        )
 
         # サブタスク内省ノードを追加
-        workflow.add_node("reflect_subtask", self.reflect_subtask)
-
-        # ツール選択からスタート
-        workflow.add_edge(START, "select_tools")
+        self._add_traced_node(workflow, "reflect_subtask", self.areflect_subtask if is_async else self.reflect_subtask)
+
+        # QAの回答をそのまま使うノードを追加（LLMを呼び出さないため同期・非同期で共通）
+        use_qa_fast_path = self.settings.qa_fast_path_min_score is not None
+        if use_qa_fast_path:
+            self._add_traced_node(workflow, "answer_from_qa", self.answer_from_qa)
+
+        if self.settings.speculative_retry and len(self._speculative_strategies()) > 1:
+            # 1回目の試行は複数の戦略で並列に実行し、完了しなかった場合は通常のやり直しに進む
+            self._add_traced_node(
+                workflow,
+                "speculate_subtask",
+                self.aspeculate_subtask if is_async else self.speculate_subtask,
+            )
+            workflow.add_edge(START, "speculate_subtask")
+            workflow.add_conditional_edges(
+                "speculate_subtask",
+                self._should_continue_exec_subtask_flow,
+                {"continue": "select_tools", "end": END},
+            )
+        else:
+            # ツール選択からスタート
+            workflow.add_edge(START, "select_tools")
 
         # ノード間のエッジを追加
         workflow.add_edge("select_tools", "execute_tools")
-        workflow.add_edge("execute_tools", "create_subtask_answer")
+        if use_qa_fast_path:
+            # QA検索の類似度が十分に高ければ回答作成をとばす
+            workflow.add_conditional_edges(
+                "execute_tools",
+                self._route_after_tool_execution,
+                {"answer_from_qa": "answer_from_qa", "create_subtask_answer": "create_subtask_answer"},
+            )
+            if self.settings.qa_fast_path_reflection == "verify":
+                workflow.add_edge("answer_from_qa", "reflect_subtask")
+            else:
+                workflow.add_edge("answer_from_qa", END)
+        else:
+            workflow.add_edge("execute_tools", "create_subtask_answer")
         workflow.add_edge("create_subtask_answer", "reflect_subtask")
 
         # サブタスク内省ノードの結果から繰り返しのためのエッジを追加
@@ -451,22 +1238,31 @@ class HelpDeskAgent:
 
         return app
 
-    def create_graph(self) -> Pregel:
+    def create_graph(self, is_async: bool = False, include_answer: bool = True) -> Pregel:
         """エージェントのメイングラフを作成する
 
+        Args:
+            is_async (bool): Trueの場合は非同期のノードでグラフを作成する
+            include_answer (bool): Falseの場合は最終回答作成ノードを含めず、サブタスクの実行で終了する
+
         Returns:
             Pregel: エージェントのメイングラフ
         """
         workflow = StateGraph(AgentState)
 
         # 計画ノードを追加
-        workflow.add_node("create_plan", self.create_plan)
+        self._add_traced_node(workflow, "create_plan", self.acreate_plan if is_async else self.create_plan)
 
         # サブグラフの実行ノードを追加
-        workflow.add_node("execute_subtasks", self._execute_subgraph)
+        self._add_traced_node(
+            workflow,
+            "execute_subtasks",
+            self._aexecute_subgraph if is_async else self._execute_subgraph,
+        )
 
         # 最終回答作成ノードを追加
-        workflow.add_node("create_answer", self.create_answer)
+        if include_answer:
+            self._add_traced_node(workflow, "create_answer", self.acreate_answer if is_async else self.create_answer)
 
         # 実行の視点を計画作成ノードにセット
         workflow.add_edge(START, "create_plan")
@@ -477,35 +1273,181 @@ class HelpDeskAgent:
             self._should_continue_exec_subtasks,
         )
 
-        # サブグラフの実行がすべて終了したら最終回答へ
-        workflow.add_edge("execute_subtasks", "create_answer")
+        if include_answer:
+            # サブグラフの実行がすべて終了したら最終回答へ
+            workflow.add_edge("execute_subtasks", "create_answer")
 
-        workflow.set_finish_point("create_answer")
+            workflow.set_finish_point("create_answer")
+        else:
+            workflow.add_edge("execute_subtasks", END)
 
         app = workflow.compile()
 
         return app
 
-    def run_agent(self, question: str) -> AgentResult:
-        """エージェントを実行する
+    def _get_compiled_graph(
+        self, name: Literal["graph", "graph_without_answer", "subgraph"], is_async: bool
+    ) -> Pregel:
+        """コンパイル済みのグラフを返す
+
+        グラフは初回利用時にエージェントのインスタンスごとに一度だけコンパイルし、以降は使い回す。
 
         Args:
-            question (str): 入力の質問
+            name (Literal["graph", "graph_without_answer", "subgraph"]): メイングラフ、
+                最終回答作成を除いたメイングラフ、サブグラフのいずれか
+            is_async (bool): 非同期のノードで作成したグラフかどうか
 
         Returns:
-            AgentResult: エージェントの実行結果
+            Pregel: コンパイル済みのグラフ
         """
-
-        app = self.create_graph()
-        result = app.invoke(
-            {
-                "question": question,
-                "current_step": 0,
-            }
-        )
+        key = (name, is_async)
+        graph = self._compiled_graphs.get(key)
+        if graph is None:
+            with self._compile_lock:
+                graph = self._compiled_graphs.get(key)
+                if graph is None:
+                    if name == "graph":
+                        graph = self.create_graph(is_async=is_async)
+                    elif name == "graph_without_answer":
+                        graph = self.create_graph(is_async=is_async, include_answer=False)
+                    else:
+                        graph = self._create_subgraph(is_async=is_async)
+                    self._compiled_graphs[key] = graph
+        return graph
+
+    def _to_agent_result(self, question: str, result: dict, tracer: Tracer | None = None) -> AgentResult:
+        metrics = None
+        if tracer is not None:
+            metrics = tracer.metrics(
+                input_price_per_1m=self.settings.openai_input_price_per_1m_tokens,
+                cached_input_price_per_1m=self.settings.openai_cached_input_price_per_1m_tokens,
+                output_price_per_1m=self.settings.openai_output_price_per_1m_tokens,
+            )
+            metrics.qa_fast_path_subtasks = sum(subtask.answered_from_qa for subtask in result["subtask_results"])
         return AgentResult(
             question=question,
             plan=Plan(subtasks=result["plan"]),
             subtasks=result["subtask_results"],
             answer=result["last_answer"],
+            token_usage=sum(result["token_usages"], TokenUsage()),
+            metrics=metrics,
         )
+
+    def run_agent(self, question: str) -> AgentResult:
+        """エージェントを実行する
+
+        回答のキャッシュが設定されている場合は、類似する過去の質問の回答があればグラフを実行せずに返す。
+
+        Args:
+            question (str): 入力の質問
+
+        Returns:
+            AgentResult: エージェントの実行結果
+        """
+
+        if self.answer_cache is not None:
+            cached_result = self.answer_cache.get(question)
+            if cached_result is not None:
+                return cached_result
+
+        tracer = Tracer() if self.settings.tracing_enabled else None
+        with tracing(tracer):
+            app = self._get_compiled_graph("graph", is_async=False)
+            result = app.invoke(
+                {
+                    "question": question,
+                    "current_step": 0,
+                }
+            )
+        agent_result = self._to_agent_result(question, result, tracer)
+
+        if self.answer_cache is not None:
+            self.answer_cache.set(question, agent_result)
+        return agent_result
+
+    async def arun_agent(self, question: str) -> AgentResult:
+        """エージェントを非同期で実行する
+
+        LLMの呼び出しとツールの実行を待つ間はイベントループを他の質問の処理に譲るため、
+        1つのイベントループで多数の質問を並行して処理できる。
+
+        Args:
+            question (str): 入力の質問
+
+        Returns:
+            AgentResult: エージェントの実行結果
+        """
+
+        # 回答のキャッシュは質問の埋め込みでAPIを呼び出すことがあるため、別スレッドで実行する
+        if self.answer_cache is not None:
+            cached_result = await asyncio.to_thread(self.answer_cache.get, question)
+            if cached_result is not None:
+                return cached_result
+
+        tracer = Tracer() if self.settings.tracing_enabled else None
+        with tracing(tracer):
+            app = self._get_compiled_graph("graph", is_async=True)
+            result = await app.ainvoke(
+                {
+                    "question": question,
+                    "current_step": 0,
+                }
+            )
+        agent_result = self._to_agent_result(question, result, tracer)
+
+        if self.answer_cache is not None:
+            await asyncio.to_thread(self.answer_cache.set, question, agent_result)
+        return agent_result
+
+    async def astream_agent(self, question: str) -> AsyncIterator[AgentStreamEvent]:
+        """エージェントを実行し、途中経過をイベントとして順に返す
+
+        計画を作成した時点でplan、サブタスクが1つ完了するごとにsubtask、
+        最終回答はOpenAIから届いた断片ごとにanswer_tokenを返し、最後に実行結果をresultとして返す。
+        回答のキャッシュにヒットした場合はresultのみを返す。
+
+        Args:
+            question (str): 入力の質問
+
+        Yields:
+            AgentStreamEvent: 途中経過のイベント
+        """
+
+        if self.answer_cache is not None:
+            cached_result = await asyncio.to_thread(self.answer_cache.get, question)
+            if cached_result is not None:
+                yield AgentStreamEvent(type="result", result=cached_result)
+                return
+
+        tracer = Tracer() if self.settings.tracing_enabled else None
+        with tracing(tracer):
+            # 最終回答はストリーミングで作成するため、グラフはサブタスクの実行までとする
+            app = self._get_compiled_graph("graph_without_answer", is_async=True)
+            state: dict = {"question": question, "plan": [], "subtask_results": [], "token_usages": []}
+            async for chunk in app.astream({"question": question, "current_step": 0}, stream_mode="updates"):
+                for node_name, update in chunk.items():
+                    state["token_usages"] = [*state["token_usages"], *update.get("token_usages", [])]
+                    if node_name == "create_plan":
+                        state["plan"] = update["plan"]
+                        yield AgentStreamEvent(type="plan", plan=Plan(subtasks=update["plan"]))
+                    elif node_name == "execute_subtasks":
+                        state["subtask_results"] = [*state["subtask_results"], *update["subtask_results"]]
+                        for subtask in update["subtask_results"]:
+                            yield AgentStreamEvent(type="subtask", subtask=subtask)
+
+            # サブタスクは完了した順に届くため、通常の実行と同じく計画の順序に並べ直す
+            state["subtask_results"].sort(key=lambda subtask: state["plan"].index(subtask.task_name))
+
+            answer_tokens = []
+            async for item in self._astream_answer(state):
+                if isinstance(item, TokenUsage):
+                    state["token_usages"].append(item)
+                else:
+                    answer_tokens.append(item)
+                    yield AgentStreamEvent(type="answer_token", token=item)
+            state["last_answer"] = "".join(answer_tokens)
+
+        agent_result = self._to_agent_result(question, state, tracer)
+        if self.answer_cache is not None:
+            await asyncio.to_thread(self.answer_cache.set, question, agent_result)
+        yield AgentStreamEvent(type="result", result=agent_result)
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from src.custom_logger import setup_logger
+from src.index_generation import read_index_generation
+from src.models import AgentResult, TokenUsage
+from src.tools.search_cache import GENERATION_CHECK_INTERVAL
+
+logger = setup_logger(__file__)
+
+
+class SemanticAnswerCache:
+    """質問の埋め込みベクトルの類似度で過去の回答を引き当てるキャッシュ
+
+    質問をベクトル化し、保存済みの質問とのコサイン類似度がsimilarity_threshold以上のものがあれば、
+    その回答をエージェントを実行せずに返す。言い回しが違うだけの同じ質問をまとめて扱うためのもの。
+
+    ベクトルは単位ベクトルに正規化して(max_entries, 次元数)の行列の各行に保存し、検索は行列とベクトルの積で行う。
+    エントリは登録からttl_seconds秒で失効し、max_entriesを超えると最も長く使われていないものの行を再利用する。
+    create_indexが書き込むインデックスの世代が変わった場合は、古い文書に基づく回答を返さないよう全エントリを破棄する。
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[list[str]], list[list[float]]],
+        similarity_threshold: float = 0.92,
+        ttl_seconds: float = 86400.0,
+        max_entries: int = 1000,
+        generation_path: str | None = None,
+    ) -> None:
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generation_path = generation_path
+        self._lock = threading.Lock()
+        # 行番号 -> (失効時刻, 回答)。並び順がLRUの順序になる
+        self._entries: OrderedDict[int, tuple[float, AgentResult]] = OrderedDict()
+        self._vectors: np.ndarray | None = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._generation = read_index_generation(generation_path) if generation_path else ""
+        self._generation_checked_at = time.monotonic()
+
+    def _check_generation(self, now: float) -> None:
+        if self.generation_path is None or now - self._generation_checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._generation_checked_at = now
+        generation = read_index_generation(self.generation_path)
+        if generation != self._generation:
+            self._generation = generation
+            self._clear()
+
+    def _embed_question(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed([question])[0], dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), np.finfo(np.float32).tiny)
+
+    def _find(self, vector: np.ndarray, now: float) -> tuple[int, float] | None:
+        if self._vectors is None or not self._entries:
+            return None
+        scores = self._vectors @ vector
+        scores[~self._valid] = -np.inf
+        # しきい値以上のエントリを類似度の高い順に見て、失効したものは削除して次の候補を使う
+        candidates = np.flatnonzero(scores >= self.similarity_threshold)
+        for slot in candidates[np.argsort(-scores[candidates], kind="stable")]:
+            slot = int(slot)
+            expires_at, _ = self._entries[slot]
+            if expires_at <= now:
+                self._remove(slot)
+                continue
+            return slot, float(scores[slot])
+        return None
+
+    def _remove(self, slot: int) -> None:
+        del self._entries[slot]
+        self._valid[slot] = False
+
+    def get(self, question: str) -> AgentResult | None:
+        """類似する過去の質問の回答を返す
+
+        Args:
+            question (str): 入力の質問
+
+        Returns:
+            AgentResult | None: キャッシュした回答（is_cachedをTrueにしたもの）。見つからない場合はNone
+        """
+        vector = self._embed_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(now)
+            found = self._find(vector, now)
+            if found is None:
+                return None
+            slot, score = found
+            self._entries.move_to_end(slot)
+            _, result = self._entries[slot]
+
+        logger.info(f"Answer cache hit: similarity={score:.3f}, cached question={result.question!r}")
+        # キャッシュから返した回答ではLLMを呼び出していないため、トークン使用量は0にする
+        return result.model_copy(
+            update={"question": question, "is_cached": True, "token_usage": TokenUsage(), "metrics": None}
+        )
+
+    def set(self, question: str, result: AgentResult) -> None:
+        """回答をキャッシュに保存する
+
+        すべてのサブタスクを完了できなかった回答は、不完全な回答を使い回さないよう保存しない。
+
+        Args:
+            question (str): 入力の質問
+            result (AgentResult): エージェントの実行結果
+        """
+        if result.is_cached or not all(subtask.is_completed for subtask in result.subtasks):
+            return
+        vector = self._embed_question(question)
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(now)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            # ほぼ同じ質問がすでにあればその行を上書きし、なければ空き行か最も長く使われていない行を使う
+            found = self._find(vector, now)
+            if found is not None:
+                slot = found[0]
+                self._remove(slot)
+            elif len(self._entries) < self.max_entries:
+                slot = int(np.argmin(self._valid))
+            else:
+                slot, _ = self._entries.popitem(last=False)
+                self._valid[slot] = False
+
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._entries[slot] = (now + self.ttl_seconds, result)
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._valid[:] = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import AsyncIterable, Iterable
+
+from pydantic import BaseModel, Field
+
+from src.agent import HelpDeskAgent
+from src.custom_logger import setup_logger
+
+logger = setup_logger(__file__)
+
+
+class BatchQuestion(BaseModel):
+    id: str = Field(..., description="質問のID。再開時に処理済みかどうかの判定に使う")
+    question: str = Field(..., description="質問")
+
+    @classmethod
+    def from_question(cls, question: str) -> "BatchQuestion":
+        """IDのない質問から、質問文のハッシュをIDとしたBatchQuestionを作成する"""
+        return cls(id=hashlib.sha256(question.encode()).hexdigest()[:16], question=question)
+
+
+class BatchSummary(BaseModel):
+    succeeded: int = Field(0, description="回答できた質問数")
+    failed: int = Field(0, description="エラーになった質問数")
+    skipped: int = Field(0, description="前回までの実行で回答済みのためスキップした質問数")
+
+
+def load_completed_ids(output_path: str) -> set[str]:
+    """出力ファイルから回答済みの質問のIDを読み込む
+
+    エラーになった質問は回答済みとして扱わず、再開時にもう一度実行する。
+    中断時に書きかけになった最後の行は読み飛ばす。
+
+    Args:
+        output_path (str): 結果を書き込むJSONLファイルのパス
+
+    Returns:
+        set[str]: 回答済みの質問のID
+    """
+    completed_ids: set[str] = set()
+    if not os.path.exists(output_path):
+        return completed_ids
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "result" in record:
+                completed_ids.add(record["id"])
+    return completed_ids
+
+
+def truncate_incomplete_line(output_path: str, chunk_size: int = 64 * 1024) -> None:
+    """出力ファイルの末尾の改行で終わっていない行（中断時に書きかけになった行）を切り捨てる
+
+    再開時に追記する最初のレコードが書きかけの行につながって壊れないよう、追記の前に呼び出す。
+
+    Args:
+        output_path (str): 結果を書き込むJSONLファイルのパス
+        chunk_size (int): 末尾から改行を探すときに一度に読むバイト数
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            logger.warning(f"Truncating incomplete last line of {output_path}")
+            f.truncate(position)
+
+
+async def _aiter_questions(
+    questions: Iterable[BatchQuestion] | AsyncIterable[BatchQuestion],
+):
+    if isinstance(questions, AsyncIterable):
+        async for question in questions:
+            yield question
+    else:
+        for question in questions:
+            yield question
+
+
+async def arun_batch(
+    agent: HelpDeskAgent,
+    questions: Iterable[BatchQuestion] | AsyncIterable[BatchQuestion],
+    output_path: str,
+    concurrency: int = 8,
+) -> BatchSummary:
+    """複数の質問を並行してエージェントで処理し、終わったものから結果をJSONLに書き出す
+
+    質問は必要な分だけ順に読み込むため、大量の質問をストリームで渡してもすべてをメモリに載せない。
+    出力ファイルに回答済みとして記録されている質問はスキップするため、中断しても同じ引数で再開できる。
+    OpenAIや検索バックエンドへの負荷は、エージェントのレートリミッターとクライアントの同時実行数の上限で抑える。
+
+    Args:
+        agent (HelpDeskAgent): 質問を処理するエージェント
+        questions (Iterable[BatchQuestion] | AsyncIterable[BatchQuestion]): 質問のリストまたはストリーム
+        output_path (str): 結果を追記するJSONLファイルのパス
+        concurrency (int): 同時に処理する質問数
+
+    Returns:
+        BatchSummary: 処理結果の件数
+    """
+    completed_ids = load_completed_ids(output_path)
+    summary = BatchSummary()
+    queue: asyncio.Queue[BatchQuestion | None] = asyncio.Queue(maxsize=concurrency * 2)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    truncate_incomplete_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as f:
+
+        def write_record(record: dict) -> None:
+            # イベントループ上でのみ書き込むため、行が混ざることはない
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+        async def feed() -> None:
+            async for question in _aiter_questions(questions):
+                if question.id in completed_ids:
+                    summary.skipped += 1
+                    continue
+                # 入力内で同じIDが重複していても1度だけ処理する
+                completed_ids.add(question.id)
+                await queue.put(question)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while (question := await queue.get()) is not None:
+                try:
+                    result = await agent.arun_agent(question.question)
+                except Exception as e:
+                    logger.error(f"Failed to answer question {question.id}: {e}")
+                    write_record({"id": question.id, "question": question.question, "error": str(e)})
+                    summary.failed += 1
+                    continue
+                write_record({"id": question.id, "question": question.question, "result": result.model_dump()})
+                summary.succeeded += 1
+                logger.info(f"Answered question {question.id} ({summary.succeeded + summary.failed} done)")
+
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(feed())
+            for _ in range(concurrency):
+                task_group.create_task(work())
+
+    return summary
@@ -0,0 +1,449 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Literal
+
+import numpy as np
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel, Field
+from qdrant_client.models import PointStruct
+
+from src.agent import HelpDeskAgent
+from src.clients import ClientRegistry
+from src.configs import Settings
+from src.context_compaction import ATTEMPT_SUMMARY_HEADER
+from src.custom_logger import setup_logger
+from src.embedding_cache import EMBEDDING_DIMENSIONS
+from src.keyword_index import LocalKeywordIndex, char_ngram_tokenize
+from src.llm_cache import LLMResponseStore
+from src.models import AgentResult, Plan, ReflectionResult
+from src.rate_limit import estimate_text_tokens, estimate_tokens
+from src.vector_index import LocalVectorIndex
+
+logger = setup_logger(__file__)
+
+# 合成したドキュメントと質問で使う話題
+TOPICS = [
+    "ログイン",
+    "パスワード再設定",
+    "二要素認証",
+    "バックアップ",
+    "データ移行",
+    "権限設定",
+    "監査ログ",
+    "API連携",
+    "通知設定",
+    "ライセンス更新",
+    "帳票出力",
+    "CSVインポート",
+]
+
+# 計画のサブタスクとして調べる観点
+ASPECTS = ["原因", "対処方法", "設定手順", "注意事項", "関連するエラーコード"]
+
+# LLMの応答の種類。呼び出し回数の集計に使う
+CallKind = Literal["chat", "parse", "embeddings"]
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+
+
+def _error_code(topic_index: int) -> str:
+    return f"E{100 + topic_index * 7:03d}"
+
+
+class LLMScript:
+    """OpenAIの代わりに入力から決まった応答を返すスクリプト
+
+    同じ入力には常に同じ応答を返す。応答の内容はエージェントのグラフを最後まで通すためだけのもので、
+    計画はmax(1, subtasks_per_question)個のサブタスク、ツール選択はサブタスクごとに決まったツール、
+    リフレクションはretry_rateの割合のサブタスクで1回目の試行だけNGとする。
+
+    各呼び出しの前にlatency_ms（jitterの割合で前後にばらつかせる）だけ待つ。待ち時間の乱数はseedで固定する。
+    """
+
+    def __init__(
+        self,
+        subtasks_per_question: int = 3,
+        retry_rate: float = 0.0,
+        chat_latency_ms: float = 0.0,
+        embedding_latency_ms: float = 0.0,
+        jitter: float = 0.0,
+        answer_chars: int = 200,
+        seed: int = 0,
+    ) -> None:
+        self.subtasks_per_question = subtasks_per_question
+        self.retry_rate = retry_rate
+        self.latency_ms: dict[CallKind, float] = {
+            "chat": chat_latency_ms,
+            "parse": chat_latency_ms,
+            "embeddings": embedding_latency_ms,
+        }
+        self.jitter = jitter
+        self.answer_chars = answer_chars
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls: Counter[str] = Counter()
+
+    def latency(self, kind: CallKind) -> float:
+        """呼び出しを記録し、待ち時間（秒）を返す"""
+        with self._lock:
+            self._calls[kind] += 1
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter) if self.jitter else 1
+        return max(0.0, self.latency_ms[kind] * factor / 1000)
+
+    def calls(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._calls)
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self._calls.clear()
+
+    def _completion(self, messages: list, message: dict, tools: list | None = None) -> dict:
+        prompt_tokens = estimate_tokens(messages) + estimate_text_tokens(json.dumps(tools or [], ensure_ascii=False))
+        completion_tokens = estimate_text_tokens(message.get("content") or "") + 4
+        for tool_call in message.get("tool_calls") or []:
+            completion_tokens += estimate_text_tokens(tool_call["function"]["arguments"])
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "scripted",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", **message}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _topics(self, text: str) -> list[str]:
+        return [topic for topic in TOPICS if topic in text]
+
+    def _answer(self, messages: list) -> str:
+        topics = self._topics(messages[-1]["content"] or "") or [TOPICS[0]]
+        sentence = f"{topics[0]}については、XYZシステムの管理画面から設定を確認してください。"
+        return (sentence * (self.answer_chars // len(sentence) + 1))[: self.answer_chars]
+
+    def chat(self, messages: list, tools: list | None = None, tool_choice: dict | None = None) -> ChatCompletion:
+        """ツールがある場合はツール選択、ない場合は回答の作成として応答する"""
+        if not tools:
+            message = {"content": self._answer(messages)}
+            return ChatCompletion.model_validate(self._completion(messages, message))
+
+        # ツールの指定がなければサブタスクの指示から決まったツールを選ぶ
+        instruction = next(message["content"] for message in messages if message["role"] == "user")
+        if tool_choice:
+            tool = next(tool for tool in tools if tool["function"]["name"] == tool_choice["function"]["name"])
+        else:
+            tool = tools[_stable_hash(instruction) % len(tools)]
+        argument_name = next(iter(tool["function"]["parameters"]["properties"]))
+        query = " ".join(self._topics(messages[-1]["content"] or "") or self._topics(instruction)) or instruction[:32]
+        message = {
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {
+                        "name": tool["function"]["name"],
+                        "arguments": json.dumps({argument_name: query}, ensure_ascii=False),
+                    },
+                }
+            ],
+        }
+        return ChatCompletion.model_validate(self._completion(messages, message, tools))
+
+    def parse(self, messages: list, response_format: type[BaseModel]) -> ParsedChatCompletion:
+        """計画の作成とリフレクションの構造化出力を返す"""
+        if response_format is Plan:
+            question = messages[-1]["content"] or ""
+            topic = (self._topics(question) or [TOPICS[0]])[0]
+            count = max(1, min(self.subtasks_per_question, len(ASPECTS)))
+            parsed: BaseModel = Plan(subtasks=[f"{topic}の{aspect}を調べる" for aspect in ASPECTS[:count]])
+        elif response_format is ReflectionResult:
+            # 1回目の試行だけ、サブタスクごとに決まった割合でNGにする
+            instruction = next(message["content"] for message in messages if message["role"] == "user")
+            # 過去の試行はコンテキストの圧縮で要約メッセージにまとめられている場合がある
+            attempts = sum(1 for message in messages if message["role"] == "assistant" and message.get("tool_calls"))
+            is_first_attempt = attempts <= 1 and not any(
+                str(message.get("content", "")).startswith(ATTEMPT_SUMMARY_HEADER) for message in messages
+            )
+            should_retry = is_first_attempt and _stable_hash(instruction) % 1000 < self.retry_rate * 1000
+            parsed = ReflectionResult(
+                advice="別のツールで検索し直してください。" if should_retry else "問題ありません。",
+                is_completed=not should_retry,
+            )
+        else:
+            raise ValueError(f"Unsupported response format: {response_format.__name__}")
+        message = {"content": parsed.model_dump_json(), "parsed": parsed}
+        return ParsedChatCompletion[response_format].model_validate(self._completion(messages, message))
+
+    def embed(self, text: str) -> list[float]:
+        """文字bigramを特徴量ハッシングした単位ベクトル。共通する語の多いテキストほど類似度が高くなる"""
+        vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+        for token in char_ngram_tokenize(text):
+            token_hash = _stable_hash(token)
+            vector[token_hash % EMBEDDING_DIMENSIONS] += 1.0 if token_hash & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embeddings(self, input: list[str] | str) -> CreateEmbeddingResponse:
+        texts = [input] if isinstance(input, str) else input
+        tokens = sum(estimate_text_tokens(text) for text in texts)
+        return CreateEmbeddingResponse.model_validate(
+            {
+                "object": "list",
+                "model": "scripted",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": self.embed(text)} for i, text in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+        )
+
+
+class ScriptedOpenAI:
+    """LLMScriptの応答を返すOpenAIクライアントの代わり（chat・parse・embeddingsのみ）"""
+
+    def __init__(self, script: LLMScript) -> None:
+        self.script = script
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _create(self, messages: list, tools: list | None = None, tool_choice: dict | None = None, **kwargs):
+        time.sleep(self.script.latency("chat"))
+        return self.script.chat(messages, tools, tool_choice)
+
+    def _parse(self, messages: list, response_format: type[BaseModel], **kwargs):
+        time.sleep(self.script.latency("parse"))
+        return self.script.parse(messages, response_format)
+
+    def _embed(self, input: list[str] | str, **kwargs):
+        time.sleep(self.script.latency("embeddings"))
+        return self.script.embeddings(input)
+
+
+class AsyncScriptedOpenAI:
+    """LLMScriptの応答を返すAsyncOpenAIクライアントの代わり"""
+
+    def __init__(self, script: LLMScript) -> None:
+        self.script = script
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    async def _create(self, messages: list, tools: list | None = None, tool_choice: dict | None = None, **kwargs):
+        await asyncio.sleep(self.script.latency("chat"))
+        return self.script.chat(messages, tools, tool_choice)
+
+    async def _parse(self, messages: list, response_format: type[BaseModel], **kwargs):
+        await asyncio.sleep(self.script.latency("parse"))
+        return self.script.parse(messages, response_format)
+
+    async def _embed(self, input: list[str] | str, **kwargs):
+        await asyncio.sleep(self.script.latency("embeddings"))
+        return self.script.embeddings(input)
+
+
+class BenchmarkClientRegistry(ClientRegistry):
+    """検索ツールのOpenAIクライアントをScriptedOpenAIに差し替えたレジストリ"""
+
+    def __init__(self, settings: Settings, script: LLMScript) -> None:
+        super().__init__(settings)
+        self.script = script
+
+    def openai(self) -> ScriptedOpenAI:
+        return self._get_or_create("openai", lambda: ScriptedOpenAI(self.script))
+
+
+def make_questions(count: int, offset: int = 0) -> list[str]:
+    """話題とエラーコードを組み合わせた重複しない質問を作成する"""
+    questions = []
+    for i in range(offset, offset + count):
+        topic_index = i % len(TOPICS)
+        topic, code = TOPICS[topic_index], _error_code(topic_index)
+        questions.append(
+            f"{topic}の操作中にエラーコード{code}が表示されました（問い合わせ{i + 1}）。"
+            "原因と対処方法を教えてください。"
+        )
+    return questions
+
+
+def build_local_indexes(settings: Settings, script: LLMScript, docs_per_topic: int = 20) -> int:
+    """合成したマニュアルとQAをプロセス内のキーワード・ベクトルインデックスに書き込む
+
+    Args:
+        settings (Settings): 書き込み先のインデックスのパスを含む設定
+        script (LLMScript): QAの埋め込みベクトルの作成に使うスクリプト
+        docs_per_topic (int): 話題ごとのドキュメント数（マニュアルとQAのそれぞれ）
+
+    Returns:
+        int: 書き込んだドキュメント数
+    """
+    keyword_index = LocalKeywordIndex(settings.local_keyword_index_path)
+    vector_index = LocalVectorIndex(settings.local_vector_index_path)
+    points = []
+    for topic_index, topic in enumerate(TOPICS):
+        code = _error_code(topic_index)
+        for i in range(docs_per_topic):
+            aspect = ASPECTS[i % len(ASPECTS)]
+            manual = (
+                f"第{topic_index + 1}章 {topic} ({i + 1})\n"
+                f"XYZシステムの{topic}の{aspect}について説明します。"
+                f"エラーコード{code}が表示された場合は、管理画面の{topic}の設定を確認してください。" * 3
+            )
+            keyword_index.add(f"manual-{topic_index}-{i}", "XYZシステム統合ユーザーマニュアル.pdf", manual)
+
+            qa = (
+                f"Q: {topic}で{code}が表示される場合の{aspect}は？\nA: {topic}の設定画面で{aspect}を確認してください。"
+            )
+            points.append(
+                PointStruct(
+                    id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"qa-{topic_index}-{i}")),
+                    vector=script.embed(qa),
+                    payload={"file_name": "XYZ_system_QA.csv", "content": qa},
+                )
+            )
+    keyword_index.save()
+    vector_index.upsert(points)
+    vector_index.save()
+    return len(TOPICS) * docs_per_topic * 2
+
+
+class LevelReport(BaseModel):
+    concurrency: int = Field(..., description="同時に処理した質問数")
+    questions: int = Field(..., description="処理した質問数")
+    errors: int = Field(0, description="例外で失敗した質問数")
+    wall_time_s: float = Field(..., description="全質問の処理にかかった時間（秒）")
+    throughput_qps: float = Field(..., description="1秒あたりに処理した質問数")
+    p50_ms: float = Field(..., description="1問あたりの処理時間の中央値（ミリ秒）")
+    p95_ms: float = Field(..., description="1問あたりの処理時間の95パーセンタイル（ミリ秒）")
+    mean_ms: float = Field(..., description="1問あたりの処理時間の平均（ミリ秒）")
+    calls_per_question: dict[str, float] = Field(..., description="1問あたりのAPIの種類ごとの呼び出し回数")
+    tokens_per_question: float = Field(..., description="1問あたりのトークン使用量（入力と出力の合計）")
+    qa_fast_path_rate: float = Field(0.0, description="QA検索の回答をそのまま使ったサブタスクの割合")
+
+
+def _summarize(
+    concurrency: int,
+    latencies_ms: list[float],
+    results: list[AgentResult],
+    errors: int,
+    wall_time_s: float,
+    calls: dict[str, int],
+) -> LevelReport:
+    questions = len(results) + errors
+    total_tokens = sum(result.token_usage.prompt_tokens + result.token_usage.completion_tokens for result in results)
+    subtasks = [subtask for result in results for subtask in result.subtasks]
+    return LevelReport(
+        concurrency=concurrency,
+        questions=questions,
+        errors=errors,
+        wall_time_s=wall_time_s,
+        throughput_qps=len(results) / wall_time_s if wall_time_s > 0 else 0.0,
+        p50_ms=float(np.percentile(latencies_ms, 50)) if latencies_ms else 0.0,
+        p95_ms=float(np.percentile(latencies_ms, 95)) if latencies_ms else 0.0,
+        mean_ms=float(np.mean(latencies_ms)) if latencies_ms else 0.0,
+        calls_per_question={kind: count / questions for kind, count in sorted(calls.items())},
+        tokens_per_question=total_tokens / questions if questions else 0.0,
+        qa_fast_path_rate=sum(subtask.answered_from_qa for subtask in subtasks) / len(subtasks) if subtasks else 0.0,
+    )
+
+
+def run_level(agent: HelpDeskAgent, questions: list[str], concurrency: int, script: LLMScript) -> LevelReport:
+    """run_agentでquestionsをconcurrency件ずつ並列に処理して計測する"""
+    lock = threading.Lock()
+    latencies_ms: list[float] = []
+    results: list[AgentResult] = []
+    errors = 0
+
+    def _run(question: str) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            result = agent.run_agent(question)
+        except Exception as e:
+            logger.error(f"Failed to answer {question!r}: {e}")
+            with lock:
+                errors += 1
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies_ms.append(elapsed_ms)
+            results.append(result)
+
+    script.reset_calls()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_run, questions))
+    wall_time_s = time.perf_counter() - start
+    return _summarize(concurrency, latencies_ms, results, errors, wall_time_s, script.calls())
+
+
+async def arun_level(agent: HelpDeskAgent, questions: list[str], concurrency: int, script: LLMScript) -> LevelReport:
+    """arun_agentでquestionsを最大concurrency件ずつ並行に処理して計測する"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies_ms: list[float] = []
+    results: list[AgentResult] = []
+    errors = 0
+
+    async def _run(question: str) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await agent.arun_agent(question)
+            except Exception as e:
+                logger.error(f"Failed to answer {question!r}: {e}")
+                errors += 1
+                return
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+            results.append(result)
+
+    script.reset_calls()
+    start = time.perf_counter()
+    await asyncio.gather(*(_run(question) for question in questions))
+    wall_time_s = time.perf_counter() - start
+    return _summarize(concurrency, latencies_ms, results, errors, wall_time_s, script.calls())
+
+
+def benchmark_settings(data_dir: str, **overrides) -> Settings:
+    """ネットワークに接続しない設定（検索はプロセス内のインデックス、キャッシュはdata_dir配下）を作成する"""
+    return Settings(
+        openai_api_key="dummy",
+        openai_api_base="dummy",
+        openai_model="scripted",
+        keyword_backend="local",
+        vector_backend="local",
+        local_keyword_index_path=os.path.join(data_dir, "keyword_index"),
+        local_vector_index_path=os.path.join(data_dir, "vector_index"),
+        embedding_cache_dir=os.path.join(data_dir, "embedding_cache"),
+        index_generation_path=os.path.join(data_dir, "index_generation"),
+        **overrides,
+    )
+
+
+def make_agent(
+    settings: Settings, script: LLMScript, tools: list, llm_cache: LLMResponseStore | None = None
+) -> HelpDeskAgent:
+    """OpenAIクライアントをScriptedOpenAIに差し替えたエージェントを作成する
+
+    llm_cacheを指定した場合は、settings.llm_cache_modeでScriptedOpenAIのレスポンスを保存・再生する。
+    """
+    agent = HelpDeskAgent(settings=settings, tools=tools, llm_cache=llm_cache)
+    agent.client = ScriptedOpenAI(script)
+    agent.async_client = AsyncScriptedOpenAI(script)
+    return agent
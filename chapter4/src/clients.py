@@ -0,0 +1,192 @@
+import threading
+from typing import Any, Callable, Literal, TypeVar
+
+import httpx
+from elasticsearch import Elasticsearch
+from openai import DefaultHttpxClient, OpenAI
+from qdrant_client import QdrantClient
+
+from src.answer_cache import SemanticAnswerCache
+from src.configs import Settings
+from src.embedding_cache import EmbeddingCache
+from src.keyword_index import LocalKeywordIndex
+from src.llm_cache import LLMResponseStore
+from src.rate_limit import OpenAIRateLimiter
+from src.tools.search_cache import SearchResultCache
+from src.vector_index import LocalVectorIndex
+
+T = TypeVar("T")
+
+
+class ClientRegistry:
+    """検索ツールが共有するバックエンドクライアントを管理するクラス
+
+    各クライアントは初回利用時に一度だけ作成し、以降はコネクションプールごと使い回す。
+    作成処理はロックで保護しているため、複数スレッドから同時に呼ばれても1つしか作成されない。
+    ロックを保持している間にawaitすることはないため、イベントループ上から呼び出しても問題ない。
+    """
+
+    def __init__(self, settings: Settings | None = None) -> None:
+        self._clients: dict[str, Any] = {}
+        if settings is not None:
+            self._clients["settings"] = settings
+        self._lock = threading.RLock()
+
+    def _get_or_create(self, name: str, factory: Callable[[], T]) -> T:
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = factory()
+                    self._clients[name] = client
+        return client
+
+    def settings(self) -> Settings:
+        return self._get_or_create("settings", Settings)
+
+    def openai(self) -> OpenAI:
+        def _create() -> OpenAI:
+            settings = self.settings()
+            return OpenAI(
+                api_key=settings.openai_api_key,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=settings.openai_max_connections,
+                        max_keepalive_connections=settings.openai_max_connections,
+                    )
+                ),
+            )
+
+        return self._get_or_create("openai", _create)
+
+    def openai_rate_limiter(self) -> OpenAIRateLimiter:
+        def _create() -> OpenAIRateLimiter:
+            settings = self.settings()
+            return OpenAIRateLimiter(
+                requests_per_minute=settings.openai_requests_per_minute,
+                tokens_per_minute=settings.openai_tokens_per_minute,
+            )
+
+        return self._get_or_create("openai_rate_limiter", _create)
+
+    def concurrency_limit(self, backend: Literal["elasticsearch", "qdrant"]) -> threading.BoundedSemaphore:
+        """検索バックエンドへの同時リクエスト数を制限するセマフォを返す
+
+        検索ツールは同期関数として別スレッドで実行されるため、スレッド用のセマフォで制限する。
+        """
+
+        def _create() -> threading.BoundedSemaphore:
+            settings = self.settings()
+            if backend == "elasticsearch":
+                return threading.BoundedSemaphore(settings.elasticsearch_max_concurrency)
+            return threading.BoundedSemaphore(settings.qdrant_max_concurrency)
+
+        return self._get_or_create(f"{backend}_concurrency_limit", _create)
+
+    def elasticsearch(self) -> Elasticsearch:
+        def _create() -> Elasticsearch:
+            settings = self.settings()
+            return Elasticsearch(
+                settings.elasticsearch_url,
+                connections_per_node=settings.elasticsearch_connections_per_node,
+            )
+
+        return self._get_or_create("elasticsearch", _create)
+
+    def qdrant(self) -> QdrantClient:
+        def _create() -> QdrantClient:
+            settings = self.settings()
+            # REST用のhttpxクライアントにコネクションプールの設定を渡す
+            return QdrantClient(
+                settings.qdrant_url,
+                limits=httpx.Limits(
+                    max_connections=settings.qdrant_max_connections,
+                    max_keepalive_connections=settings.qdrant_max_connections,
+                ),
+            )
+
+        return self._get_or_create("qdrant", _create)
+
+    def keyword_index(self) -> LocalKeywordIndex:
+        return self._get_or_create(
+            "local_keyword_index", lambda: LocalKeywordIndex(self.settings().local_keyword_index_path)
+        )
+
+    def vector_index(self) -> QdrantClient | LocalVectorIndex:
+        """設定に応じてQdrantクライアントかプロセス内のベクトルインデックスを返す
+
+        どちらもquery_pointsで同じ形の検索結果を返す。
+        """
+        settings = self.settings()
+        if settings.vector_backend == "local":
+            return self._get_or_create(
+                "local_vector_index", lambda: LocalVectorIndex(settings.local_vector_index_path)
+            )
+        return self.qdrant()
+
+    def embedding_cache(self) -> EmbeddingCache:
+        def _create() -> EmbeddingCache:
+            settings = self.settings()
+            # 検索ツールや回答キャッシュの埋め込みもエージェントのLLM呼び出しと同じ上限の中で行う
+            return EmbeddingCache(
+                settings.embedding_cache_dir,
+                max_entries=settings.embedding_cache_max_entries,
+                rate_limiter=self.openai_rate_limiter(),
+            )
+
+        return self._get_or_create("embedding_cache", _create)
+
+    def search_cache(self) -> SearchResultCache:
+        def _create() -> SearchResultCache:
+            settings = self.settings()
+            return SearchResultCache(
+                ttl_seconds=settings.search_cache_ttl_seconds,
+                max_entries=settings.search_cache_max_entries,
+                generation_path=settings.index_generation_path,
+            )
+
+        return self._get_or_create("search_cache", _create)
+
+    def answer_cache(self) -> SemanticAnswerCache:
+        def _create() -> SemanticAnswerCache:
+            settings = self.settings()
+            return SemanticAnswerCache(
+                embed=lambda texts: self.embedding_cache().embed(self.openai(), texts),
+                similarity_threshold=settings.answer_cache_similarity_threshold,
+                ttl_seconds=settings.answer_cache_ttl_seconds,
+                max_entries=settings.answer_cache_max_entries,
+                generation_path=settings.index_generation_path,
+            )
+
+        return self._get_or_create("answer_cache", _create)
+
+    def llm_cache(self) -> LLMResponseStore:
+        def _create() -> LLMResponseStore:
+            settings = self.settings()
+            return LLMResponseStore(settings.llm_cache_dir, max_bytes=settings.llm_cache_max_bytes)
+
+        return self._get_or_create("llm_cache", _create)
+
+    def close(self) -> None:
+        """作成済みのクライアントの接続やファイルを閉じ、次回利用時に作り直す"""
+        with self._lock:
+            for client in self._clients.values():
+                # 設定やメモリ上のキャッシュのように閉じる必要のないものは除く
+                if hasattr(client, "close"):
+                    client.close()
+            self._clients = {key: value for key, value in self._clients.items() if key == "settings"}
+
+
+# プロセス全体で共有するレジストリ
+_registry = ClientRegistry()
+
+
+def get_client_registry() -> ClientRegistry:
+    return _registry
+
+
+def set_client_registry(registry: ClientRegistry) -> None:
+    """共有レジストリを差し替える（設定を明示的に渡したい場合など）"""
+    global _registry
+    _registry = registry
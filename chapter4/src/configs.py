@@ -1,9 +1,108 @@
+import os
+from typing import Literal
+
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# .envや.rag_dataの相対パスの基準にするディレクトリ（chapter4）。
+# スクリプトはchapter4、ノートブックはリポジトリのルートなど実行時のカレントディレクトリが異なるため、ここに揃える
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def resolve_project_path(path: str) -> str:
+    """相対パスをカレントディレクトリではなくPROJECT_ROOTを基準にした絶対パスにする"""
+    return path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+
 
 class Settings(BaseSettings):
     openai_api_key: str
     openai_api_base: str
     openai_model: str
 
-    model_config = SettingsConfigDict(env_file="./chapter4/.env", extra="ignore")
+    # 検索バックエンドの接続先
+    elasticsearch_url: str = "http://localhost:9200"
+    qdrant_url: str = "http://localhost:6333"
+
+    # マニュアル検索のバックエンド。localの場合はElasticsearchの代わりにプロセス内のBM25インデックスを使う
+    keyword_backend: Literal["elasticsearch", "local"] = "elasticsearch"
+    local_keyword_index_path: str = ".rag_data/keyword_index"
+
+    # QA検索のバックエンド。localの場合はQdrantの代わりにプロセス内のベクトルインデックスを使う
+    vector_backend: Literal["qdrant", "local"] = "qdrant"
+    local_vector_index_path: str = ".rag_data/vector_index"
+
+    # 共有クライアントのコネクションプールの大きさ
+    elasticsearch_connections_per_node: int = 10
+    qdrant_max_connections: int = 10
+    openai_max_connections: int = 20
+
+    # OpenAIの1分あたりのリクエスト数・トークン数の上限（未設定の場合は制限しない）
+    openai_requests_per_minute: int | None = None
+    openai_tokens_per_minute: int | None = None
+
+    # 検索バックエンドへの同時リクエスト数の上限
+    elasticsearch_max_concurrency: int = 8
+    qdrant_max_concurrency: int = 8
+
+    # 埋め込みベクトルのキャッシュの保存先と最大件数
+    embedding_cache_dir: str = ".rag_data/embedding_cache"
+    embedding_cache_max_entries: int = 50_000
+
+    # 検索結果のキャッシュの有効期限（秒）と最大件数
+    search_cache_ttl_seconds: float = 300.0
+    search_cache_max_entries: int = 1024
+
+    # OpenAIのレスポンスの保存・再生（off / record / replay / read_through）と保存先・容量の上限
+    llm_cache_mode: Literal["off", "record", "replay", "read_through"] = "off"
+    llm_cache_dir: str = ".rag_data/llm_cache"
+    llm_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # 回答のキャッシュ。質問の埋め込みのコサイン類似度がしきい値以上なら過去の回答を返す
+    answer_cache_similarity_threshold: float = 0.92
+    answer_cache_ttl_seconds: float = 86400.0
+    answer_cache_max_entries: int = 1000
+
+    # 計画のサブタスクのうち、文字bigramのJaccard係数がしきい値以上のものは重複として除く（Noneの場合は除かない）
+    plan_dedup_threshold: float | None = None
+
+    # サブタスクの1回目の試行を複数の戦略（キーワード検索・ベクトル検索・ハイブリッド検索から始める）で並列に実行する。
+    # トークン使用量は増えるが、やり直しが必要なサブタスクの待ち時間を短くできる
+    speculative_retry: bool = False
+    speculative_strategies: list[Literal["keyword", "vector", "hybrid"]] = ["keyword", "vector", "hybrid"]
+
+    # LLMに渡すツールの結果のトークン数の上限（検索結果1件あたり・ツール呼び出し1回あたり）
+    tool_result_max_tokens_per_hit: int = 400
+    tool_result_max_tokens_per_call: int = 1200
+
+    # QA検索の最上位の類似度がしきい値以上の場合、LLMで回答を作成せずにQAの回答をそのままサブタスクの回答にする。
+    # Noneの場合は使用しない。skipはリフレクションを行わずに完了とし、verifyはリフレクションで評価する
+    qa_fast_path_min_score: float | None = None
+    qa_fast_path_reflection: Literal["skip", "verify"] = "skip"
+
+    # サブタスクの1回のリクエストで送るメッセージの入力トークン数の上限。超える場合は過去の試行を要約・省略する
+    subtask_context_max_tokens: int = 6000
+
+    # ノードごとの処理時間・トークン使用量・検索の待ち時間を計測してAgentResult.metricsに記録する
+    tracing_enabled: bool = False
+
+    # 料金の見積もりに使う100万トークンあたりの単価（USD）。入力と出力の単価が未設定の場合は見積もらない
+    openai_input_price_per_1m_tokens: float | None = None
+    openai_cached_input_price_per_1m_tokens: float | None = None
+    openai_output_price_per_1m_tokens: float | None = None
+
+    # create_indexが書き込むインデックスの世代。変わるとキャッシュを破棄する
+    index_generation_path: str = ".rag_data/index_generation"
+
+    model_config = SettingsConfigDict(env_file=resolve_project_path(".env"), extra="ignore")
+
+    @field_validator(
+        "local_keyword_index_path",
+        "local_vector_index_path",
+        "embedding_cache_dir",
+        "llm_cache_dir",
+        "index_generation_path",
+    )
+    @classmethod
+    def _resolve_data_path(cls, path: str) -> str:
+        # インデックスの作成とエージェントの実行で同じファイルを参照するよう、実行場所によらないパスにする
+        return resolve_project_path(path)
@@ -0,0 +1,124 @@
+from pydantic import ValidationError
+
+from src.custom_logger import setup_logger
+from src.models import ReflectionResult
+from src.rate_limit import estimate_tokens
+
+logger = setup_logger(__file__)
+
+# 過去の試行の要約メッセージの先頭に付ける見出し。既存の要約を見分けるために使う
+ATTEMPT_SUMMARY_HEADER = "これまでの試行の要約（いずれも評価NGのためやり直しました）:"
+
+# 予算に収めるためにツールの結果を切り詰めたときの末尾
+TRUNCATION_MARKER = "…（省略）"
+
+
+def _is_tool_call_message(message: dict) -> bool:
+    return message["role"] == "assistant" and bool(message.get("tool_calls"))
+
+
+def _is_summary_message(message: dict) -> bool:
+    return message["role"] == "user" and str(message.get("content", "")).startswith(ATTEMPT_SUMMARY_HEADER)
+
+
+def _split_attempts(messages: list) -> tuple[list, list[str], list[list]]:
+    """メッセージを先頭部分、既存の要約の各行、ツール呼び出しごとの試行に分ける
+
+    先頭部分はシステムメッセージと最初のユーザーメッセージ（サブタスクの指示）とする。
+    ツール呼び出しの直前のユーザーメッセージ（やり直しの指示）は、そのツール呼び出しの試行に含める。
+    """
+    header_end = next((i + 1 for i, message in enumerate(messages) if message["role"] == "user"), len(messages))
+    header = list(messages[:header_end])
+    summary_lines: list[str] = []
+    attempts: list[list] = []
+    pending: list = []
+    for message in messages[header_end:]:
+        if _is_summary_message(message):
+            summary_lines.extend(message["content"].split("\n")[1:])
+        elif _is_tool_call_message(message):
+            if attempts and attempts[-1][-1]["role"] == "user":
+                pending.insert(0, attempts[-1].pop())
+            attempts.append([*pending, message])
+            pending = []
+        elif attempts:
+            attempts[-1].append(message)
+        else:
+            pending.append(message)
+    if pending:
+        attempts.append(pending)
+    return header, summary_lines, attempts
+
+
+def _summarize_attempt(attempt: list, number: int) -> str:
+    tool_calls = next((message["tool_calls"] for message in attempt if _is_tool_call_message(message)), [])
+    tools = ", ".join(
+        f"{tool_call['function']['name']}({tool_call['function']['arguments']})" for tool_call in tool_calls
+    )
+
+    advice = "なし"
+    for message in reversed(attempt):
+        if message["role"] != "assistant" or not message.get("content"):
+            continue
+        try:
+            advice = ReflectionResult.model_validate_json(message["content"]).advice
+            break
+        except ValidationError:
+            continue
+    return f"- 試行{number}: 使用したツール: {tools or 'なし'} / アドバイス: {advice}"
+
+
+def _truncate_tool_messages(messages: list, excess_tokens: int) -> list:
+    """ツールの結果を切り詰めてexcess_tokens分を削る。各ツールの結果は元の長さに比例して削る"""
+    tool_indices = [i for i, message in enumerate(messages) if message["role"] == "tool"]
+    tool_tokens = {i: estimate_tokens([messages[i]]) for i in tool_indices}
+    total_tool_tokens = sum(tool_tokens.values())
+    if total_tool_tokens == 0:
+        return messages
+
+    # 切り詰めた末尾に付ける印の分も削る
+    excess_tokens += len(TRUNCATION_MARKER) * len(tool_indices)
+    keep_ratio = max(0.0, 1 - excess_tokens / total_tool_tokens)
+    compacted = list(messages)
+    for i in tool_indices:
+        content = compacted[i]["content"]
+        keep_chars = int(len(content) * keep_ratio)
+        if keep_chars < len(content):
+            compacted[i] = {**compacted[i], "content": content[:keep_chars] + TRUNCATION_MARKER}
+    return compacted
+
+
+def compact_subtask_messages(messages: list, max_tokens: int) -> list:
+    """サブタスクのメッセージを入力トークンの予算に収まるように圧縮する
+
+    最新の試行はツールの結果を含めてそのまま残し、それより前の試行は使用したツールと
+    リフレクションのアドバイスだけを1つの要約メッセージにまとめる。
+    それでも予算を超える場合は、最新の試行のツールの結果を切り詰める。
+
+    Args:
+        messages (list): サブタスクのメッセージ
+        max_tokens (int): 入力トークン数の上限（ツール定義を除く）
+
+    Returns:
+        list: 圧縮したメッセージ（元のリストとメッセージは変更しない）
+    """
+    original_tokens = estimate_tokens(messages)
+    header, summary_lines, attempts = _split_attempts(messages)
+    for attempt in attempts[:-1]:
+        summary_lines.append(_summarize_attempt(attempt, len(summary_lines) + 1))
+
+    compacted = list(header)
+    if summary_lines:
+        compacted.append({"role": "user", "content": "\n".join([ATTEMPT_SUMMARY_HEADER, *summary_lines])})
+    if attempts:
+        compacted.extend(attempts[-1])
+
+    excess_tokens = estimate_tokens(compacted) - max_tokens
+    if excess_tokens > 0:
+        compacted = _truncate_tool_messages(compacted, excess_tokens)
+        if estimate_tokens(compacted) > max_tokens:
+            logger.warning(f"Subtask messages still exceed the token budget of {max_tokens} after compaction")
+
+    compacted_tokens = estimate_tokens(compacted)
+    if compacted_tokens < original_tokens:
+        logger.info(f"Compacted subtask messages: {original_tokens} -> {compacted_tokens} tokens (estimated)")
+    return compacted
@@ -0,0 +1,303 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from openai import OpenAI
+from pydantic import BaseModel, Field
+
+from src.rate_limit import OpenAIRateLimiter, estimate_text_tokens
+from src.singleflight import SingleFlight
+
+# 埋め込みに使用するモデル
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# text-embedding-3-smallの次元数
+EMBEDDING_DIMENSIONS = 1536
+
+# SQLiteの1クエリあたりのプレースホルダ数の上限を超えないように分割する件数
+_SQLITE_BATCH_SIZE = 500
+
+# 最終利用時刻の更新をまとめて書き込む件数
+_ACCESS_FLUSH_SIZE = 256
+
+# 行ごとのヘッダー（書き込みの世代とキーのSHA-256）のuint64の個数
+_SLOT_HEADER_WORDS = 5
+
+
+class EmbeddingCacheStats(BaseModel):
+    hits: int = Field(0, description="キャッシュから返した件数")
+    misses: int = Field(0, description="キャッシュになく埋め込みAPIを呼び出した件数")
+    evictions: int = Field(0, description="容量超過により追い出した件数")
+    entries: int = Field(0, description="現在キャッシュに保存されている件数")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュのキー用にテキストを正規化する（NFKC正規化と空白の圧縮）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _key_words(key: str) -> np.ndarray:
+    """16進数のキーを行のヘッダーに書き込むuint64の配列にする"""
+    return np.frombuffer(bytes.fromhex(key), dtype=np.uint64)
+
+
+class EmbeddingCache:
+    """埋め込みベクトルをディスクに保存するLRUキャッシュ
+
+    ベクトルはfloat32の配列としてメモリマップしたファイル（vectors.f32）の各行に保存し、
+    キー（モデル名と正規化したテキストのハッシュ）から行番号への対応と最終利用時刻をSQLiteで管理する。
+    保存件数がmax_entriesに達すると、最も長く使われていないエントリの行を再利用する。
+    最終利用時刻の更新はメモリにためて、保存時か一定件数ごとにまとめて書き込む。
+
+    読み込みはSQLiteのロックを取らずに行う。行ごとのヘッダー（slots.u64）に書き込みの世代とキーを持ち、
+    書き込み側は世代を奇数にしてからベクトルとキーを書き、偶数に戻す。読み込み側はベクトルのコピーの前後で
+    世代が同じ偶数であることとキーが一致することを確認し、別のプロセスが書き換えた行はキャッシュにないものとして扱う。
+
+    インデックス作成スクリプトと検索ツールのように別プロセスから同じディレクトリを共有できる。
+    キャッシュにない同じテキストの埋め込みが同時に要求された場合は、埋め込みAPIの呼び出しを1回にまとめる。
+    rate_limiterを指定した場合、埋め込みAPIの呼び出しはチャットAPIと同じ上限の中で行う。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_entries: int = 50_000,
+        dimensions: int = EMBEDDING_DIMENSIONS,
+        rate_limiter: OpenAIRateLimiter | None = None,
+    ) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self.rate_limiter = rate_limiter
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._inflight: SingleFlight[np.ndarray] = SingleFlight()
+        # まだSQLiteに書き込んでいない最終利用時刻
+        self._accessed: dict[str, float] = {}
+
+        # トランザクションは明示的に制御する
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+        vectors_path = os.path.join(cache_dir, "vectors.f32")
+        slots_path = os.path.join(cache_dir, "slots.u64")
+        expected_sizes = {
+            vectors_path: max_entries * dimensions * np.dtype(np.float32).itemsize,
+            slots_path: max_entries * _SLOT_HEADER_WORDS * np.dtype(np.uint64).itemsize,
+        }
+        if any(not os.path.exists(path) or os.path.getsize(path) != size for path, size in expected_sizes.items()):
+            # 容量や次元数が変わった場合は保存済みの行番号が使えないため、キャッシュを作り直す
+            self._conn.execute("DELETE FROM entries")
+            for path in expected_sizes:
+                if os.path.exists(path):
+                    os.remove(path)
+        mode = "r+" if os.path.exists(vectors_path) else "w+"
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(max_entries, dimensions))
+        self._slots = np.memmap(slots_path, dtype=np.uint64, mode=mode, shape=(max_entries, _SLOT_HEADER_WORDS))
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> list[np.ndarray | None]:
+        """キャッシュからベクトルを取得する
+
+        Args:
+            model (str): 埋め込みモデル名
+            texts (list[str]): テキスト
+
+        Returns:
+            list[np.ndarray | None]: textsと同じ順序のベクトル（キャッシュにない場合はNone）
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        vectors = self._get_many(keys)
+        with self._lock:
+            hits = sum(vector is not None for vector in vectors)
+            self._hits += hits
+            self._misses += len(keys) - hits
+        return vectors
+
+    def _get_many(self, keys: list[str]) -> list[np.ndarray | None]:
+        slots: dict[str, int] = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQLITE_BATCH_SIZE):
+                batch = keys[start : start + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                slots.update(self._conn.execute(f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch))
+
+        vectors = [self._read_slot(slots[key], key) if key in slots else None for key in keys]
+
+        now = time.time()
+        with self._lock:
+            for key, vector in zip(keys, vectors, strict=True):
+                if vector is not None:
+                    self._accessed[key] = now
+            if len(self._accessed) >= _ACCESS_FLUSH_SIZE:
+                self._commit_accessed()
+        return vectors
+
+    def _read_slot(self, slot: int, key: str) -> np.ndarray | None:
+        """行のベクトルをコピーする。コピー中に書き換えられた場合や別のキーの行になっていた場合はNoneを返す"""
+        generation = int(self._slots[slot, 0])
+        if generation % 2:
+            return None
+        vector = np.array(self._vectors[slot])
+        if not np.array_equal(self._slots[slot, 1:], _key_words(key)) or int(self._slots[slot, 0]) != generation:
+            return None
+        return vector
+
+    def _write_slot(self, slot: int, key: str, vector: np.ndarray) -> None:
+        # 書き込み中は世代を奇数にして、読み込み側にこの行を使わせない
+        self._slots[slot, 0] += np.uint64(1)
+        self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+        self._slots[slot, 1:] = _key_words(key)
+        self._slots[slot, 0] += np.uint64(1)
+
+    def _flush_accessed(self) -> None:
+        # トランザクションの中から呼び出す
+        self._conn.executemany(
+            "UPDATE entries SET last_access = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+        )
+        self._accessed.clear()
+
+    def _commit_accessed(self) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._flush_accessed()
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def put_many(self, model: str, texts: list[str], vectors: list[np.ndarray]) -> None:
+        """ベクトルをキャッシュに保存する
+
+        Args:
+            model (str): 埋め込みモデル名
+            texts (list[str]): テキスト
+            vectors (list[np.ndarray]): textsと同じ順序のベクトル
+        """
+        now = time.time()
+        with self._lock:
+            # 行番号の割り当てとベクトルの書き込みを1トランザクションで行い、書き込みを他のプロセスと直列にする
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 追い出す行を最新の利用状況で選ぶため、ためていた最終利用時刻を先に書き込む
+                self._flush_accessed()
+                # 書き込みロックを取っている間は他のプロセスが件数を変えないため、最初に数えた件数を更新していく
+                (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+                for text, vector in zip(texts, vectors, strict=True):
+                    key = self.make_key(model, text)
+                    row = self._conn.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        slot = row[0]
+                    elif count < self.max_entries:
+                        slot = count
+                        count += 1
+                    else:
+                        # 最も長く使われていないエントリを追い出し、その行を再利用する
+                        evicted_key, slot = self._conn.execute(
+                            "SELECT key, slot FROM entries ORDER BY last_access LIMIT 1"
+                        ).fetchone()
+                        self._conn.execute("DELETE FROM entries WHERE key = ?", (evicted_key,))
+                        self._evictions += 1
+
+                    self._write_slot(slot, key, vector)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, slot, last_access) VALUES (?, ?, ?)", (key, slot, now)
+                    )
+                self._vectors.flush()
+                self._slots.flush()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def embed(self, client: OpenAI, texts: list[str], model: str = EMBEDDING_MODEL) -> list[list[float]]:
+        """キャッシュを経由してテキストをベクトル化する
+
+        キャッシュにないテキストだけを1回の埋め込みリクエストにまとめて送信し、結果をキャッシュに保存する。
+
+        Args:
+            client (OpenAI): OpenAIクライアント
+            texts (list[str]): テキスト
+            model (str): 埋め込みモデル名
+
+        Returns:
+            list[list[float]]: textsと同じ順序のベクトル
+        """
+        vectors = self.get_many(model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # 同じテキストが複数含まれる場合は1度だけ送信する
+            missing_texts = {self.make_key(model, texts[i]): texts[i] for i in missing}
+            # 他の呼び出しが埋め込み中のテキストはその結果を待ち、残りだけを送信する
+            new_vectors = self._inflight.do_many(
+                list(missing_texts),
+                lambda keys: self._embed_missing(client, [missing_texts[key] for key in keys], model),
+            )
+            for i in missing:
+                vectors[i] = new_vectors[self.make_key(model, texts[i])]
+
+        return [vector.tolist() for vector in vectors]
+
+    def _embed_missing(self, client: OpenAI, texts: list[str], model: str) -> dict[str, np.ndarray]:
+        """埋め込みAPIでベクトル化してキャッシュに保存し、キーからベクトルへの対応を返す"""
+        keys = [self.make_key(model, text) for text in texts]
+        # get_manyの後に他の呼び出しが保存を終えたテキストは送信しない
+        found = {key: vector for key, vector in zip(keys, self._get_many(keys), strict=True) if vector is not None}
+        texts = [text for key, text in zip(keys, texts, strict=True) if key not in found]
+        if not texts:
+            return found
+
+        estimated_tokens = sum(estimate_text_tokens(text) for text in texts)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimated_tokens)
+        try:
+            response = client.embeddings.create(model=model, input=texts)
+        except Exception:
+            if self.rate_limiter is not None:
+                self.rate_limiter.refund(estimated_tokens)
+            raise
+        if self.rate_limiter is not None:
+            self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+        data = sorted(response.data, key=lambda d: d.index)
+        new_vectors = [np.asarray(d.embedding, dtype=np.float32) for d in data]
+        self.put_many(model, texts, new_vectors)
+        for text, vector in zip(texts, new_vectors, strict=True):
+            found[self.make_key(model, text)] = vector
+        return found
+
+    def stats(self) -> EmbeddingCacheStats:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            return EmbeddingCacheStats(
+                hits=self._hits, misses=self._misses, evictions=self._evictions, entries=entries
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._accessed:
+                self._commit_accessed()
+            self._vectors.flush()
+            self._slots.flush()
+            self._conn.close()
@@ -0,0 +1,32 @@
+import os
+import uuid
+
+
+def write_index_generation(path: str) -> str:
+    """インデックスの世代を表す値を新しく発行してファイルに書き込む
+
+    インデックスを作り直したり更新したりした後に呼び出し、
+    検索結果や回答のキャッシュに古い世代のエントリを使わせないようにする。
+
+    Args:
+        path (str): 世代を書き込むファイルのパス
+
+    Returns:
+        str: 新しい世代
+    """
+    generation = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_path, path)
+    return generation
+
+
+def read_index_generation(path: str) -> str:
+    """現在のインデックスの世代を返す（一度もインデックスを作成していない場合は空文字）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Literal
+
+from src.models import AgentMetrics, AttemptStats, Span, SpanStats, TokenUsage
+
+# 実行中のトレーサー。計測が無効の場合はNone
+_current_tracer: ContextVar["Tracer | None"] = ContextVar("current_tracer", default=None)
+
+# 記録するspanを並べる列（サブタスク名など）
+_current_lane: ContextVar[str] = ContextVar("current_lane", default="main")
+
+
+class _NoopSpan:
+    """計測が無効の場合に返すspan。何も記録しない"""
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+    def set(self, **attributes) -> None:
+        return None
+
+    def add_token_usage(self, usage: TokenUsage) -> None:
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        category: Literal["node", "llm", "tool", "search"],
+        attributes: dict,
+    ) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.lane = _current_lane.get()
+        self._start_ns = 0
+
+    def __enter__(self) -> "_ActiveSpan":
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.record(
+            Span(
+                name=self.name,
+                category=self.category,
+                lane=self.lane,
+                start_us=(self._start_ns - self.tracer.start_ns) // 1000,
+                duration_us=(end_ns - self._start_ns) // 1000,
+                attributes=self.attributes,
+            )
+        )
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add_token_usage(self, usage: TokenUsage) -> None:
+        for key, value in usage.model_dump().items():
+            self.attributes[key] = self.attributes.get(key, 0) + value
+
+
+class Tracer:
+    """1回のエージェントの実行で処理ごとの時間とトークン使用量を記録するクラス
+
+    tracingで現在のトレーサーとして設定すると、その中で呼び出したspanが記録される。
+    LangGraphがノードを実行するスレッドやタスクにはコンテキスト変数が引き継がれるため、
+    並列に実行されるサブタスクの処理も同じトレーサーに記録される。
+    """
+
+    def __init__(self) -> None:
+        self.start_ns = time.perf_counter_ns()
+        self._spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self) -> list[Span]:
+        with self._lock:
+            return sorted(self._spans, key=lambda span: span.start_us)
+
+    def metrics(
+        self,
+        input_price_per_1m: float | None = None,
+        cached_input_price_per_1m: float | None = None,
+        output_price_per_1m: float | None = None,
+    ) -> AgentMetrics:
+        """記録したspanを処理ごと・サブタスクの試行ごとに集計する
+
+        Args:
+            input_price_per_1m (float | None): 入力100万トークンあたりの料金（USD）
+            cached_input_price_per_1m (float | None): キャッシュされた入力100万トークンあたりの料金（USD）。
+                未指定の場合は入力の料金を使う
+            output_price_per_1m (float | None): 出力100万トークンあたりの料金（USD）
+
+        Returns:
+            AgentMetrics: 集計結果
+        """
+        spans = self.spans()
+
+        stats: dict[tuple[str, str], SpanStats] = {}
+        attempts: dict[tuple[str, int], dict] = {}
+        total_usage = TokenUsage()
+        for span in spans:
+            usage = TokenUsage(**{key: span.attributes.get(key, 0) for key in TokenUsage.model_fields})
+            duration_ms = span.duration_us / 1000
+
+            stat = stats.setdefault((span.category, span.name), SpanStats(name=span.name, category=span.category))
+            stat.count += 1
+            stat.total_ms += duration_ms
+            stat.max_ms = max(stat.max_ms, duration_ms)
+            stat.token_usage += usage
+            if span.category == "llm":
+                total_usage += usage
+
+            # サブグラフのノードは試行ごとにまとめる
+            if span.category == "node" and "subtask" in span.attributes:
+                key = (span.attributes["subtask"], span.attributes.get("attempt", 0))
+                attempt = attempts.setdefault(key, {"start": span.start_us, "end": 0, "usage": TokenUsage()})
+                attempt["start"] = min(attempt["start"], span.start_us)
+                attempt["end"] = max(attempt["end"], span.start_us + span.duration_us)
+                attempt["usage"] += usage
+
+        estimated_cost_usd = None
+        if input_price_per_1m is not None and output_price_per_1m is not None:
+            if cached_input_price_per_1m is None:
+                cached_input_price_per_1m = input_price_per_1m
+            uncached_tokens = total_usage.prompt_tokens - total_usage.cached_tokens
+            estimated_cost_usd = (
+                uncached_tokens * input_price_per_1m
+                + total_usage.cached_tokens * cached_input_price_per_1m
+                + total_usage.completion_tokens * output_price_per_1m
+            ) / 1_000_000
+
+        return AgentMetrics(
+            wall_time_ms=(time.perf_counter_ns() - self.start_ns) / 1_000_000,
+            stats=sorted(stats.values(), key=lambda stat: stat.total_ms, reverse=True),
+            attempts=[
+                AttemptStats(
+                    subtask=subtask,
+                    attempt=attempt_number,
+                    wall_time_ms=(attempt["end"] - attempt["start"]) / 1000,
+                    token_usage=attempt["usage"],
+                )
+                for (subtask, attempt_number), attempt in attempts.items()
+            ],
+            estimated_cost_usd=estimated_cost_usd,
+            spans=spans,
+        )
+
+
+def span(name: str, category: Literal["node", "llm", "tool", "search"], **attributes) -> _ActiveSpan | _NoopSpan:
+    """処理の時間を計測するコンテキストマネージャーを返す
+
+    計測が無効の場合は何もしないオブジェクトを返すため、呼び出し側で有効かどうかを確認する必要はない。
+
+    Args:
+        name (str): 処理の名前
+        category (Literal["node", "llm", "tool", "search"]): 処理の種類
+        **attributes: 記録する属性
+
+    Returns:
+        _ActiveSpan | _NoopSpan: withで囲んだ処理の時間を記録するspan
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NOOP_SPAN
+    return _ActiveSpan(tracer, name, category, attributes)
+
+
+def is_tracing() -> bool:
+    return _current_tracer.get() is not None
+
+
+@contextmanager
+def tracing(tracer: Tracer | None) -> Iterator[Tracer | None]:
+    """withの中で記録するトレーサーを設定する（Noneの場合は計測しない）"""
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def lane(name: str) -> Iterator[None]:
+    """withの中で記録するspanの列を設定する"""
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def to_chrome_trace(spans: list[Span]) -> dict:
+    """spanをChromeのトレースイベント形式（chrome://tracingやPerfettoで表示できる形式）に変換する"""
+    lanes: dict[str, int] = {}
+    events = []
+    for span in spans:
+        tid = lanes.setdefault(span.lane, len(lanes) + 1)
+        events.append(
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start_us,
+                "dur": span.duration_us,
+                "pid": 1,
+                "tid": tid,
+                "args": span.attributes,
+            }
+        )
+    for lane_name, tid in lanes.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": lane_name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path: str, spans: list[Span]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(spans), f, ensure_ascii=False)
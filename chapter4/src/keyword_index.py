@@ -0,0 +1,288 @@
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Callable
+
+import numpy as np
+
+# BM25のパラメータ（Elasticsearchのデフォルトと同じ値）
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 英数字の連続を1語として扱い、それ以外の文字の連続を文字n-gramに分割する
+_TOKEN_PATTERN = re.compile(r"[0-9a-z_]+|[^\s0-9a-z_!-/:-@\[-`{-~、。，．・「」『』（）【】]+")
+
+
+def char_ngram_tokenize(text: str, n: int = 2) -> list[str]:
+    """日本語向けに文字n-gramでトークン化する
+
+    NFKC正規化と小文字化の後、英数字の連続（エラーコードなど）は1語のまま、
+    それ以外の文字の連続はn文字ずつずらした文字n-gramに分割する。
+
+    Args:
+        text (str): トークン化するテキスト
+        n (int): n-gramの文字数
+
+    Returns:
+        list[str]: トークン
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        word = match.group()
+        if word.isascii() or len(word) <= n:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i : i + n] for i in range(len(word) - n + 1))
+    return tokens
+
+
+def _encode_terms(terms: list[str]) -> tuple[bytes, np.ndarray]:
+    # 語彙をUTF-8で連結したバイト列と、各語の開始・終了位置の配列に変換する
+    encoded = [term.encode() for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(term) for term in encoded])
+    return b"".join(encoded), offsets
+
+
+# 保存したインデックスと検索時で同じトークナイザーを使うため、名前で登録する
+TOKENIZERS: dict[str, Callable[[str], list[str]]] = {
+    "char_bigram": char_ngram_tokenize,
+}
+
+
+class LocalKeywordIndex:
+    """Elasticsearchの代わりにプロセス内で使えるBM25のキーワード検索インデックス
+
+    1つのディレクトリに以下のファイルとして保存する。
+    - terms.bin / terms_offsets.npy: ソート済みの語彙をUTF-8で連結したバイト列と各語のバイト位置（CSR形式）。
+      二分探索で語のIDを引く
+    - postings_offsets.npy / postings_docs.npy / postings_tfs.npy: 語ごとの転置リスト（CSR形式）
+    - doc_lengths.npy: 文書ごとのトークン数
+    - docs.jsonl / doc_offsets.npy: 文書の本文と各行のバイト位置
+    - meta.json: 文書数・平均文書長・トークナイザー名
+
+    読み込み時はnpyファイルと文書ファイルをメモリマップするだけで、転置リストを解析し直さない。
+    addとdeleteはメモリ上に蓄積し、saveを呼び出したときに全体を作り直して書き出す。
+    """
+
+    def __init__(self, path: str, tokenizer: str = "char_bigram") -> None:
+        self.path = path
+        self.tokenizer_name = tokenizer
+        self._lock = threading.Lock()
+        self._pending: dict[str, dict] = {}
+        self._deleted: set[str] = set()
+        self._loaded_mtime: float | None = None
+        self._index: dict | None = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open_bytes(self, name: str) -> mmap.mmap | bytes:
+        with open(self._file(name), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+
+    def _load_terms(self) -> tuple[mmap.mmap | bytes, np.ndarray]:
+        if os.path.exists(self._file("terms_offsets.npy")):
+            return self._open_bytes("terms.bin"), np.load(self._file("terms_offsets.npy"), mmap_mode="r")
+        # 語彙を固定長の文字列配列（terms.npy）で保存していた以前の形式は、次のsaveまでメモリ上で変換して使う
+        return _encode_terms(np.load(self._file("terms.npy")).tolist())
+
+    def _maybe_reload(self) -> None:
+        # meta.jsonは最後に書き込まれるため、その更新時刻で作り直しを検知する
+        try:
+            mtime = os.stat(self._file("meta.json")).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        with open(self._file("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        terms, terms_offsets = self._load_terms()
+        self._index = {
+            "meta": meta,
+            "terms": terms,
+            "terms_offsets": terms_offsets,
+            "offsets": np.load(self._file("postings_offsets.npy"), mmap_mode="r"),
+            "postings_docs": np.load(self._file("postings_docs.npy"), mmap_mode="r"),
+            "postings_tfs": np.load(self._file("postings_tfs.npy"), mmap_mode="r"),
+            "doc_lengths": np.load(self._file("doc_lengths.npy"), mmap_mode="r"),
+            "doc_offsets": np.load(self._file("doc_offsets.npy"), mmap_mode="r"),
+            "docs": self._open_bytes("docs.jsonl"),
+        }
+        self.tokenizer_name = meta["tokenizer"]
+        self._loaded_mtime = mtime
+
+    def _find_term(self, index: dict, term: str) -> int | None:
+        # 語彙はUTF-8のバイト列の順（コードポイント順と同じ）に並んでいるため、バイト列のまま二分探索する
+        key = term.encode()
+        terms, terms_offsets = index["terms"], index["terms_offsets"]
+        lo, hi = 0, len(terms_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if terms[terms_offsets[mid] : terms_offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(terms_offsets) - 1 and terms[terms_offsets[lo] : terms_offsets[lo + 1]] == key:
+            return lo
+        return None
+
+    def _read_doc(self, index: dict, doc_idx: int) -> dict:
+        start, end = index["doc_offsets"][doc_idx], index["doc_offsets"][doc_idx + 1]
+        return json.loads(index["docs"][start:end])
+
+    def _iter_saved_docs(self):
+        if self._index is None:
+            return
+        for doc_idx in range(self._index["meta"]["num_docs"]):
+            yield self._read_doc(self._index, doc_idx)
+
+    def add(self, doc_id: str, file_name: str, content: str) -> None:
+        """文書を追加または更新する（saveで反映される）"""
+        with self._lock:
+            self._pending[doc_id] = {"id": doc_id, "file_name": file_name, "content": content}
+            self._deleted.discard(doc_id)
+
+    def delete(self, ids: list[str]) -> None:
+        """文書を削除する（saveで反映される）"""
+        with self._lock:
+            for doc_id in ids:
+                self._pending.pop(doc_id, None)
+                self._deleted.add(doc_id)
+
+    def clear(self) -> None:
+        """保存済みの文書と未保存の追加をすべて削除する（saveで反映される）"""
+        with self._lock:
+            self._maybe_reload()
+            self._pending.clear()
+            self._deleted = {doc["id"] for doc in self._iter_saved_docs()}
+
+    def save(self) -> None:
+        """保存済みのインデックスに追加・更新・削除を反映し、転置インデックスを作り直して書き出す"""
+        with self._lock:
+            self._maybe_reload()
+            tokenize = TOKENIZERS[self.tokenizer_name]
+
+            docs = [
+                doc
+                for doc in self._iter_saved_docs()
+                if doc["id"] not in self._deleted and doc["id"] not in self._pending
+            ]
+            docs.extend(self._pending.values())
+
+            postings: dict[str, list[tuple[int, int]]] = {}
+            doc_lengths = np.zeros(len(docs), dtype=np.int32)
+            for doc_idx, doc in enumerate(docs):
+                tokens = tokenize(doc["content"])
+                doc_lengths[doc_idx] = len(tokens)
+                for term, tf in Counter(tokens).items():
+                    postings.setdefault(term, []).append((doc_idx, tf))
+
+            terms = sorted(postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+            postings_docs = np.fromiter(
+                (doc_idx for term in terms for doc_idx, _ in postings[term]), dtype=np.int32, count=offsets[-1]
+            )
+            postings_tfs = np.fromiter(
+                (tf for term in terms for _, tf in postings[term]), dtype=np.int32, count=offsets[-1]
+            )
+
+            os.makedirs(self.path, exist_ok=True)
+            doc_offsets = [0]
+            with open(self._file("docs.jsonl.tmp"), "wb") as f:
+                for doc in docs:
+                    line = (json.dumps(doc, ensure_ascii=False) + "\n").encode()
+                    f.write(line)
+                    doc_offsets.append(doc_offsets[-1] + len(line))
+
+            terms_blob, terms_offsets = _encode_terms(terms)
+            with open(self._file("terms.bin.tmp"), "wb") as f:
+                f.write(terms_blob)
+            arrays = {
+                "terms_offsets.npy": terms_offsets,
+                "postings_offsets.npy": offsets,
+                "postings_docs.npy": postings_docs,
+                "postings_tfs.npy": postings_tfs,
+                "doc_lengths.npy": doc_lengths,
+                "doc_offsets.npy": np.array(doc_offsets, dtype=np.int64),
+            }
+            for name, array in arrays.items():
+                with open(self._file(f"{name}.tmp"), "wb") as f:
+                    np.save(f, array)
+
+            meta = {
+                "num_docs": len(docs),
+                "avg_doc_length": float(doc_lengths.mean()) if len(docs) else 0.0,
+                "tokenizer": self.tokenizer_name,
+            }
+            with open(self._file("meta.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+            for name in ["terms.bin", *arrays, "docs.jsonl", "meta.json"]:
+                os.replace(self._file(f"{name}.tmp"), self._file(name))
+            # 以前の形式の語彙ファイルは読み込まれなくなるため削除する
+            if os.path.exists(self._file("terms.npy")):
+                os.remove(self._file("terms.npy"))
+
+            self._pending.clear()
+            self._deleted.clear()
+            self._loaded_mtime = None
+            self._maybe_reload()
+
+    def search(self, keywords: str, limit: int = 10) -> list[dict]:
+        """キーワードでBM25検索を行う
+
+        Args:
+            keywords (str): 検索キーワード
+            limit (int): 取得件数
+
+        Returns:
+            list[dict]: スコアの高い順の検索結果。Elasticsearchのhitと同じ形（_id, _score, _source）で返す
+        """
+        with self._lock:
+            self._maybe_reload()
+            index = self._index
+        if index is None or index["meta"]["num_docs"] == 0:
+            return []
+
+        num_docs = index["meta"]["num_docs"]
+        avg_doc_length = index["meta"]["avg_doc_length"]
+        offsets = index["offsets"]
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * index["doc_lengths"] / avg_doc_length)
+
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term, query_tf in Counter(TOKENIZERS[self.tokenizer_name](keywords)).items():
+            term_idx = self._find_term(index, term)
+            if term_idx is None:
+                continue
+            start, end = offsets[term_idx], offsets[term_idx + 1]
+            docs = index["postings_docs"][start:end]
+            tfs = index["postings_tfs"][start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            # 1つの語の転置リスト内で文書は重複しないため、ファンシーインデックスで加算できる
+            scores[docs] += query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+
+        hits = []
+        for doc_idx in matched:
+            doc = self._read_doc(index, int(doc_idx))
+            hits.append(
+                {
+                    "_id": doc["id"],
+                    "_score": float(scores[doc_idx]),
+                    "_source": {"file_name": doc["file_name"], "content": doc["content"]},
+                }
+            )
+        return hits
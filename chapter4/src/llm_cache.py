@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Literal
+
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ParsedChatCompletion
+from pydantic import BaseModel, Field
+
+from src.custom_logger import setup_logger
+
+logger = setup_logger(__file__)
+
+# キャッシュの動作モード
+# - off: キャッシュを使わない
+# - record: 常にOpenAIを呼び出し、レスポンスを保存する（既存のレスポンスは上書き）
+# - replay: 保存済みのレスポンスだけを返す。保存されていないリクエストはLLMCacheMissErrorにする
+# - read_through: 保存済みならそれを返し、なければOpenAIを呼び出して保存する
+LLMCacheMode = Literal["off", "record", "replay", "read_through"]
+
+# キーの作り方を変えたときに古いレコードを使わないようにするためのバージョン
+KEY_VERSION = 1
+
+# レコードのヘッダー（キーのSHA-256・圧縮済み本文のバイト数・本文のCRC32）
+_RECORD_HEADER = struct.Struct(">32sII")
+
+# 容量をいくつのセグメントに分けるか。追い出しはセグメント単位で行う
+_SEGMENTS_PER_CACHE = 8
+
+_SEGMENT_SUFFIX = ".seg"
+
+
+class LLMCacheMissError(LookupError):
+    """replayモードで保存されていないリクエストを受け取った場合の例外"""
+
+
+class LLMCacheStats(BaseModel):
+    hits: int = Field(0, description="保存済みのレスポンスを返した件数")
+    misses: int = Field(0, description="保存されておらずOpenAIを呼び出した（replayの場合はエラーにした）件数")
+    writes: int = Field(0, description="保存した件数")
+    entries: int = Field(0, description="現在保存されているキーの数")
+    size_bytes: int = Field(0, description="セグメントファイルの合計サイズ")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def make_request_key(endpoint: str, request: dict) -> bytes:
+    """リクエストの内容から保存用のキーを作成する
+
+    モデル・メッセージ・ツール定義・tool_choice・temperatureやseedなどの引数をすべて含める。
+    response_formatのクラスはクラス名とJSONスキーマに置き換えるため、スキーマが変わると別のキーになる。
+    """
+    normalized = dict(request)
+    response_format = normalized.get("response_format")
+    if isinstance(response_format, type) and issubclass(response_format, BaseModel):
+        normalized["response_format"] = {
+            "name": response_format.__name__,
+            "schema": response_format.model_json_schema(),
+        }
+    payload = json.dumps(
+        {"version": KEY_VERSION, "endpoint": endpoint, "request": normalized},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).digest()
+
+
+class LLMResponseStore:
+    """リクエストの内容をキーにOpenAIのレスポンスを保存する追記専用のストア
+
+    レスポンスはJSONをzlibで圧縮し、ヘッダー付きのレコードとしてセグメントファイルの末尾に追記する。
+    保存済みのレコードを書き換えることはなく、同じキーを再度保存した場合は新しいレコードが有効になる。
+    メモリにはキーからレコードの位置への対応だけを持ち、起動時にセグメントを先頭から走査して作り直す。
+
+    セグメントの合計サイズがmax_bytesを超えると、最も古いセグメントから削除する。
+    書き込みはプロセス内のロックで保護しているため、同じディレクトリを複数のプロセスから同時に書き込まないこと。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(max_bytes // _SEGMENTS_PER_CACHE, 1)
+        self._lock = threading.Lock()
+        self._index: dict[bytes, tuple[int, int, int]] = {}
+        self._segment_sizes: dict[int, int] = {}
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+
+        for segment in sorted(self._list_segments()):
+            self._load_segment(segment)
+        self._active_segment = max(self._segment_sizes, default=0)
+        if not self._segment_sizes:
+            self._open_segment(self._active_segment)
+        self._writer = open(self._segment_path(self._active_segment), "ab")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.cache_dir, f"{segment:08d}{_SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> list[int]:
+        return [
+            int(name.removesuffix(_SEGMENT_SUFFIX))
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(_SEGMENT_SUFFIX) and name.removesuffix(_SEGMENT_SUFFIX).isdigit()
+        ]
+
+    def _load_segment(self, segment: int) -> None:
+        """セグメントのレコードの位置を読み込む。書き込み途中で終わったレコードは切り捨てる"""
+        path = self._segment_path(segment)
+        size = os.path.getsize(path)
+        offset = 0
+        with open(path, "rb") as f:
+            while offset + _RECORD_HEADER.size <= size:
+                key, length, _ = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                if offset + _RECORD_HEADER.size + length > size:
+                    break
+                self._index[key] = (segment, offset, length)
+                offset += _RECORD_HEADER.size + length
+                f.seek(offset)
+        if offset < size:
+            logger.warning(f"Truncating incomplete record at the end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._segment_sizes[segment] = offset
+
+    def _open_segment(self, segment: int) -> None:
+        open(self._segment_path(segment), "ab").close()
+        self._segment_sizes[segment] = 0
+        self._active_segment = segment
+
+    def _evict(self) -> None:
+        # 書き込み中のセグメントは残す
+        while sum(self._segment_sizes.values()) > self.max_bytes and len(self._segment_sizes) > 1:
+            oldest = min(self._segment_sizes)
+            os.remove(self._segment_path(oldest))
+            del self._segment_sizes[oldest]
+            self._index = {key: location for key, location in self._index.items() if location[0] != oldest}
+            logger.info(f"Evicted LLM cache segment {oldest}")
+
+    def get(self, key: bytes) -> dict | None:
+        """保存済みのレスポンスを返す（なければNone）"""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                self._misses += 1
+                return None
+            segment, offset, length = location
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                record = f.read(_RECORD_HEADER.size + length)
+            _, _, checksum = _RECORD_HEADER.unpack_from(record)
+            body = record[_RECORD_HEADER.size :]
+            if zlib.crc32(body) != checksum:
+                logger.warning(f"Discarding corrupted LLM cache record in segment {segment}")
+                del self._index[key]
+                self._misses += 1
+                return None
+            self._hits += 1
+        return json.loads(zlib.decompress(body))
+
+    def put(self, key: bytes, response: dict) -> None:
+        """レスポンスを追記する"""
+        body = zlib.compress(json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode())
+        record = _RECORD_HEADER.pack(key, len(body), zlib.crc32(body)) + body
+        with self._lock:
+            if self._segment_sizes[self._active_segment] + len(record) > self.segment_bytes:
+                self._writer.close()
+                self._open_segment(self._active_segment + 1)
+                self._writer = open(self._segment_path(self._active_segment), "ab")
+            offset = self._segment_sizes[self._active_segment]
+            self._writer.write(record)
+            self._writer.flush()
+            self._index[key] = (self._active_segment, offset, len(body))
+            self._segment_sizes[self._active_segment] = offset + len(record)
+            self._writes += 1
+            self._evict()
+
+    def stats(self) -> LLMCacheStats:
+        with self._lock:
+            return LLMCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                writes=self._writes,
+                entries=len(self._index),
+                size_bytes=sum(self._segment_sizes.values()),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+
+
+def _without_usage(response: ChatCompletion) -> ChatCompletion:
+    # 保存済みのレスポンスではトークンを消費していないため、使用量は0にする
+    return response.model_copy(update={"usage": CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)})
+
+
+def completion_from_chunks(chunks: list[ChatCompletionChunk]) -> ChatCompletion:
+    """ストリーミングで受け取った断片をつなげ、1つのChatCompletionに組み立てる
+
+    先頭の選択肢の本文だけを扱う。トークン使用量はストリームの末尾の断片から取る。
+
+    Args:
+        chunks (list[ChatCompletionChunk]): 受け取った順の断片
+
+    Returns:
+        ChatCompletion: 組み立てたレスポンス
+    """
+    content = []
+    finish_reason = "stop"
+    usage = None
+    for chunk in chunks:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices:
+            content.append(chunk.choices[0].delta.content or "")
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+    return ChatCompletion.model_validate(
+        {
+            "id": chunks[0].id if chunks else "",
+            "object": "chat.completion",
+            "created": chunks[0].created if chunks else 0,
+            "model": chunks[0].model if chunks else "",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": finish_reason,
+                    "message": {"role": "assistant", "content": "".join(content)},
+                }
+            ],
+            "usage": usage.model_dump() if usage is not None else None,
+        }
+    )
+
+
+class LLMCache:
+    """モードに従ってLLMResponseStoreからOpenAIのレスポンスを探し、保存するクラス
+
+    エージェントはtemperature=0・seed=0で呼び出すため、同じリクエストには同じレスポンスを返してよい。
+    保存済みのレスポンスを返した場合、トークン使用量は0になる。
+    ストリーミングのリクエストは組み立てたレスポンスを保存し、保存済みの場合は本文を1つの断片として返す。
+    エージェントはOpenAIを呼び出す前にlookupで探し、見つからなかった場合だけレートリミッターを通して呼び出す。
+    """
+
+    def __init__(self, store: LLMResponseStore, mode: LLMCacheMode) -> None:
+        self.store = store
+        self.mode = mode
+
+    def lookup(
+        self, endpoint: Literal["chat", "parse", "stream"], request: dict
+    ) -> tuple[bytes, ChatCompletion | None]:
+        """保存済みのレスポンスを探す
+
+        Args:
+            endpoint (Literal["chat", "parse", "stream"]): chat.completions.create（streamはストリーミング）か
+                beta.chat.completions.parseか
+            request (dict): OpenAIに渡す引数
+
+        Raises:
+            LLMCacheMissError: replayモードで保存されていない場合
+
+        Returns:
+            tuple[bytes, ChatCompletion | None]: 保存用のキーと保存済みのレスポンス（なければNone）
+        """
+        key = make_request_key(endpoint, request)
+        if self.mode == "record":
+            return key, None
+        cached = self.store.get(key)
+        if cached is None:
+            if self.mode == "replay":
+                raise LLMCacheMissError(f"No recorded response for this {endpoint} request (key={key.hex()[:16]})")
+            return key, None
+        logger.info(f"LLM cache hit: {endpoint} (key={key.hex()[:16]})")
+        response_format = request.get("response_format")
+        if endpoint == "parse":
+            return key, _without_usage(ParsedChatCompletion[response_format].model_validate(cached))
+        return key, _without_usage(ChatCompletion.model_validate(cached))
+
+    def save(self, key: bytes, response: ChatCompletion) -> None:
+        """lookupで見つからなかったリクエストのレスポンスを保存する"""
+        self.store.put(key, response.model_dump(mode="json"))
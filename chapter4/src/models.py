@@ -1,3 +1,6 @@
+from typing import Literal
+
+from openai.types.chat import ChatCompletion
 from pydantic import BaseModel, Field
 from qdrant_client.models import ScoredPoint
 
@@ -5,6 +8,7 @@ from qdrant_client.models import ScoredPoint
 class SearchOutput(BaseModel):
     file_name: str = Field(description="The file name")
     content: str = Field(description="The content of the file")
+    score: float | None = Field(None, description="ベクトル検索の類似度（キーワード検索の結果はNone）")
 
     @classmethod
     def from_hit(cls, hit: dict) -> "SearchOutput":
@@ -17,7 +21,7 @@ class SearchOutput(BaseModel):
         if point.payload is None:
             raise ValueError("Payload is None")
         return cls(
-            file_name=point.payload["file_name"], content=point.payload["content"]
+            file_name=point.payload["file_name"], content=point.payload["content"], score=point.score
         )
 
 
@@ -53,6 +57,68 @@ class Subtask(BaseModel):
     is_completed: bool = Field(..., description="サブタスクが完了しているかどうか")
     subtask_answer: str = Field(..., description="サブタスクの回答")
     challenge_count: int = Field(..., description="サブタスクの挑戦回数")
+    answered_from_qa: bool = Field(False, description="QA検索の回答をLLMを介さずにそのまま回答にしたかどうか")
+
+
+class TokenUsage(BaseModel):
+    prompt_tokens: int = Field(0, description="入力トークン数")
+    completion_tokens: int = Field(0, description="出力トークン数")
+    cached_tokens: int = Field(0, description="入力トークンのうちプロンプトキャッシュにヒットしたトークン数")
+
+    @classmethod
+    def from_completion(cls, response: ChatCompletion) -> "TokenUsage":
+        usage = response.usage
+        if usage is None:
+            return cls()
+        details = usage.prompt_tokens_details
+        return cls(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=(details.cached_tokens or 0) if details is not None else 0,
+        )
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(
+            prompt_tokens=self.prompt_tokens + other.prompt_tokens,
+            completion_tokens=self.completion_tokens + other.completion_tokens,
+            cached_tokens=self.cached_tokens + other.cached_tokens,
+        )
+
+
+class Span(BaseModel):
+    name: str = Field(..., description="計測した処理の名前（ノード名、ツール名など）")
+    category: Literal["node", "llm", "tool", "search"] = Field(..., description="処理の種類")
+    lane: str = Field("main", description="トレース表示で並べる列（サブタスク名など）")
+    start_us: int = Field(..., description="実行開始からの開始時刻（マイクロ秒）")
+    duration_us: int = Field(..., description="処理時間（マイクロ秒）")
+    attributes: dict = Field(default_factory=dict, description="サブタスク名、試行回数、トークン数などの属性")
+
+
+class SpanStats(BaseModel):
+    name: str = Field(..., description="処理の名前")
+    category: str = Field(..., description="処理の種類")
+    count: int = Field(0, description="実行回数")
+    total_ms: float = Field(0.0, description="処理時間の合計（ミリ秒）")
+    max_ms: float = Field(0.0, description="処理時間の最大（ミリ秒）")
+    token_usage: TokenUsage = Field(default_factory=TokenUsage, description="トークン使用量の合計")
+
+
+class AttemptStats(BaseModel):
+    subtask: str = Field(..., description="サブタスクの名前")
+    attempt: int = Field(..., description="試行回数（0始まり）")
+    wall_time_ms: float = Field(..., description="試行の開始から終了までの時間（ミリ秒）")
+    token_usage: TokenUsage = Field(default_factory=TokenUsage, description="試行のトークン使用量")
+
+
+class AgentMetrics(BaseModel):
+    wall_time_ms: float = Field(..., description="実行全体の時間（ミリ秒）")
+    stats: list[SpanStats] = Field(..., description="処理ごとの集計（処理時間の合計の降順）")
+    attempts: list[AttemptStats] = Field(..., description="サブタスクの試行ごとの集計")
+    estimated_cost_usd: float | None = Field(
+        None, description="トークン単価から見積もったOpenAIの料金（単価が未設定の場合はNone）"
+    )
+    qa_fast_path_subtasks: int = Field(0, description="QA検索の回答をそのまま使ったサブタスクの数")
+    spans: list[Span] = Field(..., description="計測したすべての処理。Chromeのトレース形式に書き出せる")
 
 
 class AgentResult(BaseModel):
@@ -60,3 +126,20 @@ class AgentResult(BaseModel):
     plan: Plan = Field(..., description="エージェントの計画")
     subtasks: list[Subtask] = Field(..., description="サブタスクのリスト")
     answer: str = Field(..., description="最終的な回答")
+    token_usage: TokenUsage = Field(default_factory=TokenUsage, description="実行全体のトークン使用量")
+    metrics: AgentMetrics | None = Field(
+        None, description="処理時間とトークン使用量の計測結果（計測が無効の場合はNone）"
+    )
+    is_cached: bool = Field(False, description="類似する過去の質問の回答をキャッシュから返したかどうか")
+
+
+class AgentStreamEvent(BaseModel):
+    type: Literal["plan", "subtask", "answer_token", "result"] = Field(
+        ...,
+        description="イベントの種類。plan: 計画の作成、subtask: サブタスクの完了、"
+        "answer_token: 最終回答の断片、result: 実行結果",
+    )
+    plan: Plan | None = Field(None, description="作成した計画（planの場合）")
+    subtask: Subtask | None = Field(None, description="完了したサブタスク（subtaskの場合）")
+    token: str | None = Field(None, description="最終回答の断片（answer_tokenの場合）")
+    result: AgentResult | None = Field(None, description="エージェントの実行結果（resultの場合）")
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+
+# レスポンスのトークン数の見積もり。max_tokensを指定していないため固定値で予約し、実際の使用量で精算する
+COMPLETION_TOKENS_ESTIMATE = 1024
+
+
+def estimate_text_tokens(text: str) -> int:
+    """テキストのトークン数を文字数から概算する
+
+    トークナイザーを使わずに、ASCII文字は4文字で1トークン、それ以外（日本語など）は1文字で1トークンとして数える。
+    """
+    ascii_count = sum(char.isascii() for char in text)
+    return ascii_count // 4 + len(text) - ascii_count
+
+
+def estimate_tokens(messages: list) -> int:
+    """メッセージの入力トークン数を文字数から概算する
+
+    Args:
+        messages (list): 送信するメッセージ
+
+    Returns:
+        int: 入力トークン数の概算
+    """
+    tokens = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = str(content)
+        # ツール呼び出しは関数名と引数の文字列を数える
+        for tool_call in message.get("tool_calls") or []:
+            content += tool_call["function"]["name"] + tool_call["function"]["arguments"]
+        # メッセージごとの区切りの分を加える
+        tokens += estimate_text_tokens(content) + 4
+    return tokens
+
+
+class TokenBucket:
+    """1分あたりの量で補充されるトークンバケット
+
+    取得した量はその場でバケットから差し引き（足りない場合はマイナスになる）、不足分が補充されるまで待つ。
+    先に取得した呼び出しから順に待ち時間が決まるため、並行する呼び出しの間で取得順が入れ替わらない。
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """amountを差し引き、使えるようになるまでの待ち時間（秒）を返す"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """見積もりとの差を精算する（正なら返却、負なら追加で差し引く）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def acquire(self, amount: float = 1) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, amount: float = 1) -> None:
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class OpenAIRateLimiter:
+    """OpenAIの1分あたりのリクエスト数とトークン数の上限を守るためのリミッター
+
+    プロセス内のすべての呼び出しで1つのインスタンスを共有する。上限にNoneを指定した項目は制限しない。
+    リクエスト前にacquire（非同期の場合はaacquire）で見積もりのトークン数を予約し、
+    レスポンスを受け取った後にsettleで実際の使用量との差を精算し、リクエストが失敗した場合はrefundで予約を返却する。
+    """
+
+    def __init__(self, requests_per_minute: int | None = None, tokens_per_minute: int | None = None) -> None:
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.reserve(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.reserve(estimated_tokens))
+        return max(waits)
+
+    def acquire(self, estimated_tokens: int) -> None:
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, estimated_tokens: int) -> None:
+        wait = self._reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """予約したトークン数と実際の使用量（usage.total_tokens）の差を精算する"""
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def refund(self, estimated_tokens: int) -> None:
+        """リクエストが失敗した場合に、予約したトークン数をすべて返却する
+
+        送信したリクエストは上限に数えられるため、リクエスト数の枠は返却しない。
+        """
+        self.settle(estimated_tokens, 0)
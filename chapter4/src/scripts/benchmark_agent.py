@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+from src.benchmark import (
+    BenchmarkClientRegistry,
+    LevelReport,
+    LLMScript,
+    arun_level,
+    benchmark_settings,
+    build_local_indexes,
+    make_agent,
+    make_questions,
+    run_level,
+)
+from src.clients import set_client_registry
+from src.llm_cache import LLMResponseStore
+from src.tools.search_xyz_hybrid import search_xyz_hybrid
+from src.tools.search_xyz_manual import search_xyz_manual
+from src.tools.search_xyz_qa import search_xyz_qa
+
+
+def print_reports(reports: list[LevelReport]) -> None:
+    print(
+        f"{'concurrency':>11} {'questions':>9} {'errors':>6} {'p50_ms':>9} {'p95_ms':>9} {'mean_ms':>9} "
+        f"{'q/s':>7} {'chat/q':>7} {'parse/q':>7} {'embed/q':>7} {'tokens/q':>9} {'qa_fast':>7}"
+    )
+    for report in reports:
+        calls = report.calls_per_question
+        print(
+            f"{report.concurrency:>11} {report.questions:>9} {report.errors:>6} {report.p50_ms:>9.1f} "
+            f"{report.p95_ms:>9.1f} {report.mean_ms:>9.1f} {report.throughput_qps:>7.2f} "
+            f"{calls.get('chat', 0):>7.2f} {calls.get('parse', 0):>7.2f} {calls.get('embeddings', 0):>7.2f} "
+            f"{report.tokens_per_question:>9.0f} {report.qa_fast_path_rate:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="OpenAI・Elasticsearch・Qdrantに接続せずにエージェントの処理時間とスループットを計測する"
+    )
+    parser.add_argument("--questions", type=int, default=24, help="並列度ごとに処理する質問数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="計測する並列度")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="run_agentかarun_agentか")
+    parser.add_argument("--subtasks", type=int, default=3, help="1つの質問の計画に含めるサブタスク数")
+    parser.add_argument("--retry-rate", type=float, default=0.2, help="1回目の試行がNGになるサブタスクの割合")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0, help="チャットAPIの1回あたりの待ち時間")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0, help="埋め込みAPIの1回あたりの待ち時間")
+    parser.add_argument("--jitter", type=float, default=0.2, help="待ち時間を前後にばらつかせる割合")
+    parser.add_argument("--seed", type=int, default=0, help="待ち時間のばらつきの乱数のシード")
+    parser.add_argument("--docs-per-topic", type=int, default=20, help="話題ごとに合成するドキュメント数")
+    parser.add_argument("--speculative-retry", action="store_true", help="サブタスクの1回目の試行を並列に実行する")
+    parser.add_argument(
+        "--qa-fast-path-min-score",
+        type=float,
+        help="QA検索の最上位の類似度がこの値以上ならQAの回答をそのまま使う（未指定の場合は使用しない）",
+    )
+    parser.add_argument(
+        "--llm-cache-mode",
+        choices=["off", "record", "replay", "read_through"],
+        default="off",
+        help="LLMのレスポンスの保存・再生のモード",
+    )
+    parser.add_argument("--llm-cache-dir", help="LLMのレスポンスの保存先（実行をまたいで再生する場合に指定する）")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル（実行ごとの比較用）")
+    parser.add_argument("--verbose", action="store_true", help="エージェントのINFOログを表示する")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    script = LLMScript(
+        subtasks_per_question=args.subtasks,
+        retry_rate=args.retry_rate,
+        chat_latency_ms=args.chat_latency_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        jitter=args.jitter,
+        seed=args.seed,
+    )
+    tools = [search_xyz_manual, search_xyz_qa, search_xyz_hybrid]
+    questions = make_questions(args.questions)
+
+    reports: list[LevelReport] = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        settings = benchmark_settings(
+            data_dir,
+            speculative_retry=args.speculative_retry,
+            qa_fast_path_min_score=args.qa_fast_path_min_score,
+            llm_cache_mode=args.llm_cache_mode,
+            llm_cache_dir=args.llm_cache_dir or os.path.join(data_dir, "llm_cache"),
+        )
+        llm_cache = (
+            LLMResponseStore(settings.llm_cache_dir, max_bytes=settings.llm_cache_max_bytes)
+            if args.llm_cache_mode != "off"
+            else None
+        )
+        doc_count = build_local_indexes(settings, script, args.docs_per_topic)
+        print(f"Indexed {doc_count} synthetic documents, {len(questions)} questions per level ({args.mode})")
+
+        def fresh_registry(name: str) -> BenchmarkClientRegistry:
+            """検索結果と埋め込みのキャッシュが空のレジストリを共有レジストリに設定する"""
+            cache_dir = os.path.join(data_dir, f"embedding_cache_{name}")
+            registry = BenchmarkClientRegistry(settings.model_copy(update={"embedding_cache_dir": cache_dir}), script)
+            set_client_registry(registry)
+            return registry
+
+        for concurrency in args.concurrency:
+            # グラフのコンパイルなど初回だけの処理を計測から除くため、別の質問で1回実行しておく
+            agent = make_agent(settings, script, tools, llm_cache)
+            # 同期と非同期でコンパイルするグラフが異なるため、計測するモードで実行する
+            warmup_registry = fresh_registry(f"{concurrency}_warmup")
+            warmup_question = make_questions(1, offset=args.questions)[0]
+            if args.mode == "async":
+                asyncio.run(agent.arun_agent(warmup_question))
+            else:
+                agent.run_agent(warmup_question)
+            warmup_registry.close()
+
+            # 並列度ごとに同じ条件で比較するため、キャッシュは空の状態から計測する
+            registry = fresh_registry(f"{concurrency}_measure")
+            if args.mode == "async":
+                report = asyncio.run(arun_level(agent, questions, concurrency, script))
+            else:
+                report = run_level(agent, questions, concurrency, script)
+            registry.close()
+            reports.append(report)
+
+        if llm_cache is not None:
+            stats = llm_cache.stats()
+            print(
+                f"LLM cache ({args.llm_cache_mode}): hits={stats.hits}, misses={stats.misses}, "
+                f"entries={stats.entries}, size={stats.size_bytes / 1024:.1f} KiB"
+            )
+            llm_cache.close()
+
+    print_reports(reports)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"config": vars(args), "levels": [report.model_dump() for report in reports]},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
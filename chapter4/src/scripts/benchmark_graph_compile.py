@@ -0,0 +1,44 @@
+import argparse
+import time
+
+from src.agent import HelpDeskAgent
+from src.configs import Settings
+
+
+def measure(func, repeat: int) -> float:
+    """funcをrepeat回実行したときの1回あたりの平均時間（ミリ秒）を返す"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="質問1件あたりのグラフコンパイルのオーバーヘッドを計測する")
+    parser.add_argument("--subtasks", type=int, default=3, help="1つの質問の計画に含まれるサブタスク数")
+    parser.add_argument("--repeat", type=int, default=50, help="計測の繰り返し回数")
+    args = parser.parse_args()
+
+    # グラフの作成のみを計測するため、OpenAIには接続しない
+    settings = Settings(openai_api_key="dummy", openai_api_base="dummy", openai_model="dummy")
+    agent = HelpDeskAgent(settings=settings)
+
+    # 変更前: 質問ごとにメイングラフを、サブタスクごとにサブグラフをコンパイルしていた
+    def compile_per_question() -> None:
+        agent.create_graph()
+        for _ in range(args.subtasks):
+            agent._create_subgraph()
+
+    # 変更後: コンパイル済みのグラフを使い回す
+    def reuse_compiled() -> None:
+        agent._get_compiled_graph("graph", is_async=False)
+        for _ in range(args.subtasks):
+            agent._get_compiled_graph("subgraph", is_async=False)
+
+    uncached = measure(compile_per_question, args.repeat)
+    cached = measure(reuse_compiled, args.repeat)
+
+    print(f"Subtasks per question: {args.subtasks}")
+    print(f"Compile per question:  {uncached:.3f} ms/question")
+    print(f"Reuse compiled graphs: {cached:.3f} ms/question")
+    print(f"Overhead removed:      {uncached - cached:.3f} ms/question")
@@ -1,5 +1,24 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import contextmanager
+from functools import partial
 from glob import glob
+from itertools import batched, chain
+from multiprocessing.connection import Connection
+from typing import Callable, Iterable, Iterator
 
 from elasticsearch import Elasticsearch, helpers
 from langchain_community.document_loaders import PyPDFLoader
@@ -7,9 +26,23 @@ from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from openai import OpenAI
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, PointStruct, VectorParams
+from qdrant_client.models import Distance, PointIdsList, PointStruct, VectorParams
+
+from src.configs import resolve_project_path
+from src.embedding_cache import EMBEDDING_MODEL, EmbeddingCache
+from src.index_generation import write_index_generation
+from src.keyword_index import LocalKeywordIndex
+from src.scripts.delete_index import delete_es_index, delete_qdrant_index
+from src.vector_index import LocalVectorIndex
+
+# 差分インデックス用のマニフェストの保存先
+MANIFEST_PATH = resolve_project_path(".rag_data/index_manifest.json")
+
+# PDF1ファイルの読み込みを待つ時間の上限（秒）
+PDF_LOAD_TIMEOUT = 120.0
 
 
 class Settings(BaseSettings):
@@ -17,12 +50,39 @@ class Settings(BaseSettings):
     openai_api_base: str
     openai_model: str
 
-    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+    # 埋め込みベクトルのキャッシュの保存先と最大件数
+    embedding_cache_dir: str = ".rag_data/embedding_cache"
+    embedding_cache_max_entries: int = 50_000
+
+    # --keyword-backend localの場合のキーワード検索インデックスの保存先
+    local_keyword_index_path: str = ".rag_data/keyword_index"
+
+    # --vector-backend localの場合のベクトルインデックスの保存先
+    local_vector_index_path: str = ".rag_data/vector_index"
+
+    # 検索結果のキャッシュを無効化するためのインデックスの世代
+    index_generation_path: str = ".rag_data/index_generation"
+
+    model_config = SettingsConfigDict(env_file=resolve_project_path(".env"), extra="ignore")
+
+    @field_validator(
+        "embedding_cache_dir",
+        "local_keyword_index_path",
+        "local_vector_index_path",
+        "index_generation_path",
+    )
+    @classmethod
+    def _resolve_data_path(cls, path: str) -> str:
+        # エージェントのSettingsと同じく、実行場所によらずchapter4の.rag_dataを参照する
+        return resolve_project_path(path)
 
 
-def load_pdf_docs(data_dir_path: str) -> list[Document]:
-    pdf_path = glob(os.path.join(data_dir_path, "**", "*.pdf"), recursive=True)
-    docs = []
+def find_files(data_dir_path: str, extension: str) -> list[str]:
+    # 再実行時にチャンクの並びが変わらないようにパスをソートして返す
+    return sorted(glob(os.path.join(data_dir_path, "**", f"*.{extension}"), recursive=True))
+
+
+def load_pdf_file(path: str) -> list[Document]:
     text_splitter = RecursiveCharacterTextSplitter(
         # Set a really small chunk size, just to show.
         chunk_size=300,
@@ -30,23 +90,154 @@ def load_pdf_docs(data_dir_path: str) -> list[Document]:
         length_function=len,
         is_separator_regex=False,
     )
-    for path in pdf_path:
-        loader = PyPDFLoader(path)
-        pages = loader.load_and_split(text_splitter)
-        docs.extend(pages)
-
-    return docs
+    loader = PyPDFLoader(path)
+    return loader.load_and_split(text_splitter)
+
+
+def load_csv_file(path: str) -> list[Document]:
+    loader = CSVLoader(file_path=path)
+    return loader.load()
+
+
+def _load_file_in_subprocess(load_file: Callable[[str], list[Document]], path: str, conn: Connection) -> None:
+    # 子プロセスで1ファイルを読み込み、(チャンク, エラー) をパイプで親プロセスに送る
+    try:
+        result = (load_file(path), None)
+    except Exception as e:
+        result = (None, str(e))
+    try:
+        conn.send(result)
+    except Exception as e:
+        # チャンクをpickleできない場合などもファイル単位の失敗として扱う
+        conn.send((None, str(e)))
+    finally:
+        conn.close()
+
+
+def iter_loaded_files(
+    paths: list[str],
+    load_file: Callable[[str], list[Document]],
+    max_workers: int = 1,
+    timeout: float | None = None,
+) -> Iterator[tuple[str, list[Document] | None]]:
+    """ファイルを読み込み、pathsの順序どおりに (パス, チャンク) を返す
+
+    max_workersが2以上の場合は1ファイルごとに子プロセスを起動し、最大max_workers件を並列に読み込む。
+    先読みするファイルはmax_workers件までに制限するため、結果はストリームとして返る。
+    読み込みに失敗したファイル、子プロセスが異常終了したファイル、起動からtimeout秒経っても読み込みが終わらないファイルは
+    チャンクをNoneとして返す。タイムアウトしたファイルはその子プロセスだけを終了させ、他のファイルの読み込みは続ける。
+
+    Args:
+        paths (list[str]): 読み込むファイルパス
+        load_file (Callable[[str], list[Document]]): ファイルをチャンクに分割して読み込む関数（pickle可能なこと）
+        max_workers (int): 並列に読み込むプロセス数
+        timeout (float | None): 1ファイルあたりの待ち時間の上限（秒）
+
+    Yields:
+        tuple[str, list[Document] | None]: ファイルパスとチャンク
+    """
+    if max_workers <= 1:
+        for path in paths:
+            try:
+                yield path, load_file(path)
+            except Exception as e:
+                print(f"Failed to load {path}: {e}")
+                yield path, None
+        return
+
+    remaining = iter(paths)
+    # (パス, 子プロセス, 結果を受け取るパイプ, 起動した時刻)
+    pending: deque[tuple[str, multiprocessing.Process, Connection, float]] = deque()
+
+    def _fill() -> None:
+        while len(pending) < max_workers:
+            path = next(remaining, None)
+            if path is None:
+                return
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_load_file_in_subprocess, args=(load_file, path, sender), daemon=True
+            )
+            process.start()
+            # 子プロセスが異常終了したときに受信側がEOFを検知できるよう、親プロセスの送信側は閉じる
+            sender.close()
+            pending.append((path, process, receiver, time.monotonic()))
+
+    try:
+        _fill()
+        while pending:
+            path, process, receiver, started_at = pending.popleft()
+            time_left = None if timeout is None else max(0.0, started_at + timeout - time.monotonic())
+            docs = None
+            # 送信が始まっていれば、先頭のファイルを待つ間に期限を過ぎていても結果を受け取る
+            if receiver.poll(time_left):
+                try:
+                    docs, error = receiver.recv()
+                except EOFError:
+                    process.join()
+                    error = f"worker exited unexpectedly (exit code {process.exitcode})"
+                if error is not None:
+                    print(f"Failed to load {path}: {error}")
+            else:
+                print(f"Timed out loading {path}")
+                process.kill()
+            receiver.close()
+            process.join()
+
+            _fill()
+            yield path, docs
+    finally:
+        for _, process, receiver, _ in pending:
+            process.kill()
+            process.join()
+            receiver.close()
+
+
+def iter_pdf_docs(
+    data_dir_path: str, max_workers: int = 1, timeout: float | None = None
+) -> Iterator[Document]:
+    paths = find_files(data_dir_path, "pdf")
+    for _, docs in iter_loaded_files(paths, load_pdf_file, max_workers=max_workers, timeout=timeout):
+        if docs is not None:
+            yield from docs
+
+
+def iter_csv_docs(data_dir_path: str) -> Iterator[Document]:
+    for path in find_files(data_dir_path, "csv"):
+        yield from load_csv_file(path)
+
+
+def load_pdf_docs(
+    data_dir_path: str, max_workers: int = 1, timeout: float | None = None
+) -> list[Document]:
+    return list(iter_pdf_docs(data_dir_path, max_workers=max_workers, timeout=timeout))
 
 
 def load_csv_docs(data_dir_path: str) -> list[Document]:
-    csv_path = glob(os.path.join(data_dir_path, "**", "*.csv"), recursive=True)
-    docs = []
+    return list(iter_csv_docs(data_dir_path))
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(doc: Document) -> str:
+    # 同じ文章でもファイルが異なれば別のチャンクとして扱う
+    file_name = os.path.basename(doc.metadata["source"])
+    return hashlib.sha256(f"{file_name}\0{doc.page_content}".encode()).hexdigest()
 
-    for path in csv_path:
-        loader = CSVLoader(file_path=path)
-        docs.extend(loader.load())
 
-    return docs
+def chunk_id(doc: Document) -> str:
+    """チャンクの内容から決まる安定したIDを返す
+
+    ElasticsearchとQdrantの両方で同じIDを使う。QdrantのポイントIDは
+    UUIDか整数である必要があるため、内容ハッシュの先頭128bitをUUIDとして扱う。
+    """
+    return str(uuid.UUID(hex=chunk_hash(doc)[:32]))
 
 
 def create_keyword_search_index(es: Elasticsearch, index_name: str) -> None:
@@ -109,6 +300,9 @@ def create_keyword_search_index(es: Elasticsearch, index_name: str) -> None:
 
 
 def create_vector_search_index(qdrant_client: QdrantClient, index_name: str) -> None:
+    if qdrant_client.collection_exists(collection_name=index_name):
+        return
+
     result = qdrant_client.create_collection(
         collection_name=index_name,
         vectors_config=VectorParams(size=1536, distance=Distance.COSINE),
@@ -119,63 +313,346 @@ def create_vector_search_index(qdrant_client: QdrantClient, index_name: str) ->
         print(f"Failed to create collection {index_name}")
 
 
-def add_documents_to_es(
-    es: Elasticsearch, index_name: str, docs: list[Document]
-) -> None:
-    insert_docs = []
+@contextmanager
+def bulk_ingest_mode(es: Elasticsearch, index_name: str) -> Iterator[None]:
+    """一括投入の間だけインデックスを投入向けの設定に切り替える
+
+    リフレッシュを止めてレプリカを0にし、終了後に元の設定へ戻してリフレッシュする。
+    """
+    current = es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+    # 未設定の項目はNoneを書き戻すことでデフォルト値に戻る
+    original = {
+        "refresh_interval": current.get("refresh_interval"),
+        "number_of_replicas": current.get("number_of_replicas"),
+    }
+
+    es.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+    try:
+        yield
+    finally:
+        es.indices.put_settings(index=index_name, settings={"index": original})
+        es.indices.refresh(index=index_name)
 
-    for doc in docs:
-        content = doc.page_content
 
-        # ドキュメントの作成
-        insert_doc = {
+def add_documents_to_es(
+    es: Elasticsearch,
+    index_name: str,
+    docs: Iterable[Document],
+    thread_count: int = 4,
+    chunk_size: int = 500,
+) -> None:
+    """ドキュメントをElasticsearchに一括投入する
+
+    ドキュメントを逐次バルクリクエストに変換し、thread_count個のワーカーで並列に送信する。
+
+    Args:
+        es (Elasticsearch): Elasticsearchクライアント
+        index_name (str): インデックス名
+        docs (Iterable[Document]): 追加するドキュメント
+        thread_count (int): 並列に送信するバルクワーカー数
+        chunk_size (int): 1バルクリクエストあたりのドキュメント数
+    """
+    # ドキュメントの作成
+    insert_docs = (
+        {
             "_index": index_name,
+            "_id": chunk_id(doc),
             "_source": {
                 "file_name": os.path.basename(doc.metadata["source"]),
-                "content": content,
+                "content": doc.page_content,
             },
         }
-        insert_docs.append(insert_doc)
+        for doc in docs
+    )
 
     # Elasticsearchにドキュメントを追加
-    helpers.bulk(es, insert_docs)
+    total = 0
+    start = time.perf_counter()
+    with bulk_ingest_mode(es, index_name):
+        for _ in helpers.parallel_bulk(es, insert_docs, thread_count=thread_count, chunk_size=chunk_size):
+            total += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"Indexed {total} documents in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} docs/sec)")
+
+
+def _embed_batch(
+    client: OpenAI, docs: list[Document], embedding_cache: EmbeddingCache
+) -> list[PointStruct]:
+    # 複数のドキュメントを1リクエストでまとめてベクトル化する。
+    # キャッシュ済みのチャンクは埋め込みAPIに送らない
+    contents = [doc.page_content.replace(" ", "") for doc in docs]
+    vectors = embedding_cache.embed(client, contents, model=EMBEDDING_MODEL)
+
+    return [
+        PointStruct(
+            id=chunk_id(doc),
+            vector=vector,
+            payload={
+                "file_name": os.path.basename(doc.metadata["source"]),
+                "content": content,
+            },
+        )
+        for doc, content, vector in zip(docs, contents, vectors, strict=True)
+    ]
+
+
+def embed_documents(
+    docs: Iterable[Document],
+    settings: Settings,
+    batch_size: int = 100,
+    max_workers: int = 4,
+    embedding_cache: EmbeddingCache | None = None,
+) -> Iterator[list[PointStruct]]:
+    """ドキュメントをベクトル化し、ベクトル化が終わったバッチから順にポイントを返す
+
+    ドキュメントをbatch_size件ずつまとめて埋め込みAPIに送り、
+    同時に実行中のリクエストをmax_workers件までに制限する。
+    メモリ上に保持するポイントはおおよそbatch_size * max_workers件に収まる。
+
+    Args:
+        docs (Iterable[Document]): ベクトル化するドキュメント
+        settings (Settings): 設定
+        batch_size (int): 1リクエストでベクトル化するドキュメント数
+        max_workers (int): 同時に実行する埋め込みリクエスト数の上限
+        embedding_cache (EmbeddingCache | None): 埋め込みベクトルのキャッシュ。Noneの場合は設定の保存先を使う
+
+    Yields:
+        list[PointStruct]: ベクトル化したバッチ
+    """
+    client = OpenAI(api_key=settings.openai_api_key)
+    if embedding_cache is None:
+        embedding_cache = EmbeddingCache(
+            settings.embedding_cache_dir, max_entries=settings.embedding_cache_max_entries
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight: set[Future] = set()
+        for batch in batched(docs, batch_size):
+            in_flight.add(executor.submit(_embed_batch, client, list(batch), embedding_cache))
+
+            # 実行中のリクエストが上限に達したら、完了したものから返す
+            if len(in_flight) >= max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in as_completed(in_flight):
+            yield future.result()
+
+    stats = embedding_cache.stats()
+    print(f"Embedding cache: {stats.hits} hits, {stats.misses} misses (hit rate {stats.hit_rate:.1%})")
 
 
 def add_documents_to_qdrant(
     qdrant_client: QdrantClient,
     index_name: str,
-    docs: list[Document],
+    docs: Iterable[Document],
     settings: Settings,
+    batch_size: int = 100,
+    max_workers: int = 4,
+    embedding_cache: EmbeddingCache | None = None,
 ) -> None:
-    points = []
-    client = OpenAI(api_key=settings.openai_api_key)
+    """ドキュメントをベクトル化してQdrantに追加する
+
+    ベクトル化が終わったバッチから順にupsertするため、全ポイントをメモリに載せない。
+
+    Args:
+        qdrant_client (QdrantClient): Qdrantクライアント
+        index_name (str): コレクション名
+        docs (Iterable[Document]): 追加するドキュメント
+        settings (Settings): 設定
+        batch_size (int): 1リクエストでベクトル化するドキュメント数
+        max_workers (int): 同時に実行する埋め込みリクエスト数の上限
+        embedding_cache (EmbeddingCache | None): 埋め込みベクトルのキャッシュ。Noneの場合は設定の保存先を使う
+    """
+    total = 0
+    for points in embed_documents(docs, settings, batch_size, max_workers, embedding_cache):
+        qdrant_client.upsert(collection_name=index_name, points=points, wait=True)
+        total += len(points)
+        print(f"Upserted {total} points")
+
+
+def add_documents_to_local_vector_index(
+    vector_index: LocalVectorIndex,
+    docs: Iterable[Document],
+    settings: Settings,
+    batch_size: int = 100,
+    max_workers: int = 4,
+    embedding_cache: EmbeddingCache | None = None,
+) -> None:
+    """ドキュメントをベクトル化してプロセス内のベクトルインデックスに追加する
+
+    追加したポイントはvector_index.save()を呼び出したときにファイルへ書き出される。
+
+    Args:
+        vector_index (LocalVectorIndex): ベクトルインデックス
+        docs (Iterable[Document]): 追加するドキュメント
+        settings (Settings): 設定
+        batch_size (int): 1リクエストでベクトル化するドキュメント数
+        max_workers (int): 同時に実行する埋め込みリクエスト数の上限
+        embedding_cache (EmbeddingCache | None): 埋め込みベクトルのキャッシュ。Noneの場合は設定の保存先を使う
+    """
+    total = 0
+    for points in embed_documents(docs, settings, batch_size, max_workers, embedding_cache):
+        vector_index.upsert(points)
+        total += len(points)
+        print(f"Embedded {total} points")
+
+
+def add_documents_to_local_keyword_index(keyword_index: LocalKeywordIndex, docs: Iterable[Document]) -> None:
+    """ドキュメントをプロセス内のキーワード検索インデックスに追加する
+
+    追加したドキュメントはkeyword_index.save()を呼び出したときに転置インデックスへ反映される。
+    """
+    total = 0
+    for doc in docs:
+        keyword_index.add(chunk_id(doc), os.path.basename(doc.metadata["source"]), doc.page_content)
+        total += 1
+    print(f"Added {total} documents")
+
+
+def delete_documents_from_es(es: Elasticsearch, index_name: str, ids: list[str]) -> None:
+    actions = ({"_op_type": "delete", "_index": index_name, "_id": id_} for id_ in ids)
+    # 既に存在しないドキュメントの削除は無視する
+    helpers.bulk(es, actions, raise_on_error=False)
+
+
+def delete_documents_from_qdrant(qdrant_client: QdrantClient, index_name: str, ids: list[str]) -> None:
+    qdrant_client.delete(collection_name=index_name, points_selector=PointIdsList(points=ids), wait=True)
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 書き込み途中で中断されてもマニフェストが壊れないよう、一時ファイルから置き換える
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def sync_documents(
+    paths: list[str],
+    manifest: dict,
+    load_file: Callable[[str], list[Document]],
+    add_documents: Callable[[Iterable[Document]], None],
+    delete_documents: Callable[[list[str]], None],
+    max_workers: int = 1,
+    timeout: float | None = None,
+) -> tuple[dict, bool]:
+    """マニフェストとの差分だけをインデックスに反映する
+
+    ファイルのハッシュが変わっていないファイルは読み込みもしない。
+    変更されたファイルは新しく増えたチャンクだけを追加し、消えたチャンクを削除する。
+    削除されたファイルのチャンクはすべて削除する。
+
+    Args:
+        paths (list[str]): 現在のファイルパス
+        manifest (dict): 前回実行時のマニフェスト（ファイルパス -> ファイルとチャンクのハッシュ）
+        load_file (Callable[[str], list[Document]]): ファイルをチャンクに分割して読み込む関数
+        add_documents (Callable[[Iterable[Document]], None]): チャンクをインデックスに追加する関数
+        delete_documents (Callable[[list[str]], None]): チャンクIDを指定してインデックスから削除する関数
+        max_workers (int): ファイルを並列に読み込むプロセス数
+        timeout (float | None): 1ファイルの読み込みを待つ時間の上限（秒）
+
+    Returns:
+        tuple[dict, bool]: 更新後のマニフェストと、チャンクを追加・削除したかどうか
+    """
+    new_manifest = {}
+    stale_hashes: set[str] = set()
+    added_count = 0
+
+    changed_file_hashes = {}
+    for path in paths:
+        current_file_hash = file_hash(path)
+        entry = manifest.get(path)
+        if entry is not None and entry["file_hash"] == current_file_hash:
+            new_manifest[path] = entry
+        else:
+            changed_file_hashes[path] = current_file_hash
 
-    for i, doc in enumerate(docs):
-        content = doc.page_content
-        content = content.replace(" ", "")
-        embedding = client.embeddings.create(
-            model="text-embedding-3-small", input=content
-        )
-        points.append(
-            PointStruct(
-                id=i,
-                vector=embedding.data[0].embedding,
-                payload={
-                    "file_name": os.path.basename(doc.metadata["source"]),
-                    "content": content,
-                },
-            )
+    def _iter_new_docs() -> Iterator[Document]:
+        # 追加するチャンクをファイル単位で読み込みながら流し、全件をメモリに載せない
+        nonlocal added_count, stale_hashes
+        loaded_files = iter_loaded_files(
+            list(changed_file_hashes), load_file, max_workers=max_workers, timeout=timeout
         )
-
-    operation_info = qdrant_client.upsert(
-        collection_name=index_name,
-        points=points,
-        wait=True,
-    )
-    print(operation_info)
+        for path, loaded_docs in loaded_files:
+            entry = manifest.get(path)
+            if loaded_docs is None:
+                # 読み込めなかったファイルは前回の状態を維持し、次回の実行で再度読み込む
+                if entry is not None:
+                    new_manifest[path] = entry
+                continue
+
+            docs = {chunk_hash(doc): doc for doc in loaded_docs}
+            old_hashes = set(entry["chunk_hashes"]) if entry is not None else set()
+            for hash_, doc in docs.items():
+                if hash_ not in old_hashes:
+                    added_count += 1
+                    yield doc
+            stale_hashes |= old_hashes - docs.keys()
+            new_manifest[path] = {"file_hash": changed_file_hashes[path], "chunk_hashes": list(docs)}
+
+    # 追加するチャンクがない場合はインデックスに触れない
+    new_docs = _iter_new_docs()
+    first_doc = next(new_docs, None)
+    if first_doc is not None:
+        add_documents(chain([first_doc], new_docs))
+
+    for path in manifest.keys() - new_manifest.keys():
+        stale_hashes |= set(manifest[path]["chunk_hashes"])
+
+    # 別のファイルに移動しただけのチャンクは削除しない
+    stale_hashes -= {hash_ for entry in new_manifest.values() for hash_ in entry["chunk_hashes"]}
+
+    print(f"Added {added_count} chunks, deleting {len(stale_hashes)} chunks")
+    if stale_hashes:
+        delete_documents([str(uuid.UUID(hex=hash_[:32])) for hash_ in stale_hashes])
+
+    return new_manifest, added_count > 0 or bool(stale_hashes)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="前回実行時のマニフェストと比較し、追加・変更・削除されたチャンクだけを反映する",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="PDFを並列に読み込むプロセス数",
+    )
+    parser.add_argument(
+        "--pdf-timeout",
+        type=float,
+        default=PDF_LOAD_TIMEOUT,
+        help="PDF1ファイルの読み込みを待つ時間の上限（秒）",
+    )
+    parser.add_argument(
+        "--keyword-backend",
+        choices=["elasticsearch", "local"],
+        default="elasticsearch",
+        help="マニュアルデータの登録先。localの場合はElasticsearchの代わりにプロセス内のBM25インデックスを作成する",
+    )
+    parser.add_argument(
+        "--vector-backend",
+        choices=["qdrant", "local"],
+        default="qdrant",
+        help="QAデータの登録先。localの場合はQdrantの代わりにプロセス内のベクトルインデックスを作成する",
+    )
+    args = parser.parse_args()
+
     es = Elasticsearch("http://localhost:9200")
     qdrant_client = QdrantClient("http://localhost:6333")
 
@@ -183,26 +660,79 @@ if __name__ == "__main__":
 
     index_name = "documents"
     print(f"Creating index for keyword search {index_name}")
-    create_keyword_search_index(es, index_name)
+    # フルインデックス時は削除・改名されたファイルのチャンクが残らないよう、インデックスを空にしてから作成する
+    if args.keyword_backend == "elasticsearch":
+        if not args.incremental:
+            delete_es_index(es, index_name)
+        create_keyword_search_index(es, index_name)
+        add_keyword_documents = partial(add_documents_to_es, es, index_name)
+        delete_keyword_documents = partial(delete_documents_from_es, es, index_name)
+    else:
+        local_keyword_index = LocalKeywordIndex(settings.local_keyword_index_path)
+        if not args.incremental:
+            local_keyword_index.clear()
+        add_keyword_documents = partial(add_documents_to_local_keyword_index, local_keyword_index)
+        delete_keyword_documents = local_keyword_index.delete
     print("--------------------------------")
 
     print(f"Creating index for vector search {index_name}")
-    create_vector_search_index(qdrant_client, index_name)
+    if args.vector_backend == "qdrant":
+        if not args.incremental:
+            delete_qdrant_index(qdrant_client, index_name)
+        create_vector_search_index(qdrant_client, index_name)
+        add_vector_documents = partial(add_documents_to_qdrant, qdrant_client, index_name, settings=settings)
+        delete_vector_documents = partial(delete_documents_from_qdrant, qdrant_client, index_name)
+    else:
+        local_vector_index = LocalVectorIndex(settings.local_vector_index_path, name=index_name)
+        if not args.incremental:
+            local_vector_index.clear()
+        add_vector_documents = partial(add_documents_to_local_vector_index, local_vector_index, settings=settings)
+        delete_vector_documents = local_vector_index.delete
     print("--------------------------------")
-    print("Loading documents from manual data")
-    manual_docs = load_pdf_docs(data_dir_path="data")
-    print(f"Loaded {len(manual_docs)} documents")
 
+    # バックエンドごとに登録済みのチャンクが異なるため、マニフェストも分ける
+    keyword_manifest_key = "keyword" if args.keyword_backend == "elasticsearch" else f"keyword_{args.keyword_backend}"
+    vector_manifest_key = "vector" if args.vector_backend == "qdrant" else f"vector_{args.vector_backend}"
+
+    # フルインデックス時は空にしたインデックスの分だけマニフェストを空にし、全チャンクを追加する。
+    # 他のバックエンドの分は残さないと、そのバックエンドの次回の差分インデックスで全チャンクが重複して追加される
+    manifest = load_manifest(MANIFEST_PATH)
+    if not args.incremental:
+        manifest[keyword_manifest_key] = {}
+        manifest[vector_manifest_key] = {}
+
+    print("Syncing manual data to keyword search index")
+    manifest[keyword_manifest_key], keyword_changed = sync_documents(
+        find_files("data", "pdf"),
+        manifest.get(keyword_manifest_key, {}),
+        load_file=load_pdf_file,
+        add_documents=add_keyword_documents,
+        delete_documents=delete_keyword_documents,
+        max_workers=args.workers,
+        timeout=args.pdf_timeout,
+    )
+    if args.keyword_backend == "local":
+        local_keyword_index.save()
     print("--------------------------------")
-    print("Loading documents from qa data")
-    qa_docs = load_csv_docs(data_dir_path="data")
-    print(f"Loaded {len(qa_docs)} documents")
 
-    print("Adding documents to keyword search index")
-    add_documents_to_es(es, index_name, manual_docs)
+    print("Syncing qa data to vector search index")
+    manifest[vector_manifest_key], vector_changed = sync_documents(
+        find_files("data", "csv"),
+        manifest.get(vector_manifest_key, {}),
+        load_file=load_csv_file,
+        add_documents=add_vector_documents,
+        delete_documents=delete_vector_documents,
+    )
+    if args.vector_backend == "local":
+        local_vector_index.save()
     print("--------------------------------")
 
-    print("Adding documents to vector search index")
-    add_documents_to_qdrant(qdrant_client, index_name, qa_docs, settings)
-    print("--------------------------------")
+    save_manifest(MANIFEST_PATH, manifest)
+
+    # インデックスが変わったことを検索結果と回答のキャッシュに知らせる。
+    # 差分がなかった場合は、キャッシュを無駄に破棄しないよう世代を変えない
+    if not args.incremental or keyword_changed or vector_changed:
+        write_index_generation(settings.index_generation_path)
+    else:
+        print("No changes; keeping the index generation")
     print("Done")
@@ -1,6 +1,9 @@
 from elasticsearch import Elasticsearch
 from qdrant_client import QdrantClient
 
+from src.configs import Settings
+from src.index_generation import write_index_generation
+
 
 def delete_es_index(es: Elasticsearch, index_name: str) -> None:
     # インデックスの削除
@@ -15,7 +18,7 @@ def delete_qdrant_index(qdrant_client: QdrantClient, collection_name: str) -> No
 
     if qdrant_client.collection_exists(collection_name=collection_name):
         # qdrantでインデックスを削除
-        qdrant_client.delete_collection("documents")
+        qdrant_client.delete_collection(collection_name)
         print(f"Collection '{collection_name}' has been deleted.")
     else:
         print(f"Collection '{collection_name}' does not exist.")
@@ -30,3 +33,6 @@ if __name__ == "__main__":
     delete_es_index(es=es, index_name=index_name)
 
     delete_qdrant_index(qdrant_client=qdrant_client, collection_name=index_name)
+
+    # 検索結果や回答のキャッシュが読むのと同じ世代のファイルを更新する
+    write_index_generation(Settings().index_generation_path)
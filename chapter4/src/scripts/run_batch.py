@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import Iterator
+
+from src.agent import HelpDeskAgent
+from src.batch import BatchQuestion, arun_batch
+from src.clients import get_client_registry
+from src.tools.search_xyz_hybrid import search_xyz_hybrid
+from src.tools.search_xyz_manual import search_xyz_manual
+from src.tools.search_xyz_qa import search_xyz_qa
+
+
+def iter_questions(input_path: str) -> Iterator[BatchQuestion]:
+    """質問ファイルを1行ずつ読み込む
+
+    各行は{"id": ..., "question": ...}のJSONとする。idがない行やJSONでない行は、質問文のハッシュをIDにする。
+    """
+    with open(input_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield BatchQuestion.from_question(line)
+                continue
+            if isinstance(record, dict) and "id" in record:
+                yield BatchQuestion(id=str(record["id"]), question=record["question"])
+            elif isinstance(record, dict):
+                yield BatchQuestion.from_question(record["question"])
+            else:
+                yield BatchQuestion.from_question(str(record))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="質問ファイルの質問をまとめてエージェントで処理する")
+    parser.add_argument("--input", required=True, help="質問のJSONLファイル")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="結果を追記するJSONLファイル（同じパスを指定すると続きから再開する）",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に処理する質問数")
+    parser.add_argument(
+        "--use-answer-cache",
+        action="store_true",
+        help="類似する過去の質問の回答をキャッシュから返す",
+    )
+    args = parser.parse_args()
+
+    clients = get_client_registry()
+    settings = clients.settings()
+    agent = HelpDeskAgent(
+        settings=settings,
+        tools=[search_xyz_manual, search_xyz_qa, search_xyz_hybrid],
+        answer_cache=clients.answer_cache() if args.use_answer_cache else None,
+        rate_limiter=clients.openai_rate_limiter(),
+        llm_cache=clients.llm_cache() if settings.llm_cache_mode != "off" else None,
+    )
+
+    start = time.perf_counter()
+    summary = asyncio.run(arun_batch(agent, iter_questions(args.input), args.output, args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    print(f"Succeeded: {summary.succeeded}, Failed: {summary.failed}, Skipped: {summary.skipped} ({elapsed:.1f}s)")
+    clients.close()
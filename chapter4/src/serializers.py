@@ -0,0 +1,95 @@
+import hashlib
+import re
+
+from src.embedding_cache import normalize_text
+from src.models import SearchOutput
+from src.rate_limit import estimate_text_tokens
+
+# 検索結果1件あたりの本文のトークン数の上限
+MAX_TOKENS_PER_HIT = 400
+
+# ツール1回の呼び出し結果全体のトークン数の上限
+MAX_TOKENS_PER_CALL = 1200
+
+TRUNCATION_MARKER = "…"
+
+_SPACES_PATTERN = re.compile(r"[ \t　]+")
+_BLANK_LINES_PATTERN = re.compile(r"\n\s*\n+")
+
+
+def compact_whitespace(text: str) -> str:
+    """連続する空白と空行を1つにまとめる（PDFから抽出したチャンクに多い）"""
+    return _BLANK_LINES_PATTERN.sub("\n", _SPACES_PATTERN.sub(" ", text)).strip()
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """概算のトークン数がmax_tokens以下になるように末尾を切り詰める"""
+    if estimate_text_tokens(text) <= max_tokens:
+        return text
+    # ASCII文字は1/4トークン、それ以外は1トークンとして先頭から数える
+    cost = 0.0
+    for i, char in enumerate(text):
+        cost += 0.25 if char.isascii() else 1.0
+        if cost > max_tokens - 1:
+            return text[:i] + TRUNCATION_MARKER
+    return text
+
+
+def content_key(output: SearchOutput) -> str:
+    """重複判定用のキー。空白や全角半角の違いだけのチャンクは同じものとして扱う"""
+    return hashlib.sha256(normalize_text(output.content).encode()).hexdigest()
+
+
+class ToolResultSerializer:
+    """検索結果をLLMに渡すツールメッセージ用の短いテキストにするクラス
+
+    pydanticモデルのreprの代わりに、1件ごとに「[番号] ファイル名」の行と本文だけを並べる。
+    本文は空白を詰めたうえで1件あたりmax_tokens_per_hitまでに切り詰め、1回の呼び出し結果が
+    max_tokens_per_callを超える場合は残りの結果を省略する。
+
+    番号と出力済みの本文は同じインスタンスで変換したすべての呼び出しで共有する。
+    1回のツール実行ごとにインスタンスを作成することで、複数のツールが同じチャンクを返しても本文は1度だけ出力する。
+    """
+
+    def __init__(
+        self,
+        max_tokens_per_hit: int = MAX_TOKENS_PER_HIT,
+        max_tokens_per_call: int = MAX_TOKENS_PER_CALL,
+    ) -> None:
+        self.max_tokens_per_hit = max_tokens_per_hit
+        self.max_tokens_per_call = max_tokens_per_call
+        self._labels: dict[str, str] = {}
+        self._count = 0
+
+    def serialize(self, outputs: list[SearchOutput]) -> str:
+        """1回のツール呼び出しの検索結果をテキストにする
+
+        Args:
+            outputs (list[SearchOutput]): 検索結果
+
+        Returns:
+            str: ツールメッセージの内容
+        """
+        if not outputs:
+            return "検索結果はありませんでした。"
+
+        lines: list[str] = []
+        used_tokens = 0
+        for i, output in enumerate(outputs):
+            key = content_key(output)
+            label = f"[{self._count + 1}]"
+            if key in self._labels:
+                entry = f"{label} {output.file_name}（{self._labels[key]}と同じ内容）"
+            else:
+                content = truncate_to_tokens(compact_whitespace(output.content), self.max_tokens_per_hit)
+                entry = f"{label} {output.file_name}\n{content}"
+
+            entry_tokens = estimate_text_tokens(entry)
+            if lines and used_tokens + entry_tokens > self.max_tokens_per_call:
+                lines.append(f"（上限のため残り{len(outputs) - i}件を省略）")
+                break
+            self._labels.setdefault(key, label)
+            self._count += 1
+            lines.append(entry)
+            used_tokens += entry_tokens
+        return "\n".join(lines)
@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Generic, Hashable, TypeVar
+
+from src.custom_logger import setup_logger
+
+logger = setup_logger(__file__)
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """同じキーの呼び出しが実行中の場合、新たに実行せずにその結果を待って共有するクラス
+
+    最初の呼び出しだけがfnを実行し、実行中に届いた同じキーの呼び出しはその完了を待って同じ結果（例外）を受け取る。
+    完了した呼び出しの結果は保持しないため、結果を使い回す場合はキャッシュと組み合わせる。
+
+    検索ツールと埋め込みは同期・非同期のどちらのグラフでもワーカースレッドで実行されるため、スレッド間で共有する。
+    fnの中から同じキーで呼び出すと自身の完了を待ち続けるため、そのような使い方はしないこと。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """keyの呼び出しが実行中ならその結果を待ち、なければfnを実行して結果を返す
+
+        Args:
+            key (Hashable): 同一の呼び出しとみなすキー
+            fn (Callable[[], T]): 実行する処理
+
+        Returns:
+            T: fnの結果（他の呼び出しと共有するため、変更しないこと）
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+                is_leader = True
+            else:
+                self._coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            logger.debug(f"Joined an in-flight call: {key!r}")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def do_many(self, keys: list[Hashable], fn: Callable[[list[Hashable]], dict[Hashable, T]]) -> dict[Hashable, T]:
+        """キーごとに、実行中ならその結果を待ち、なければまとめてfnで実行して結果を返す
+
+        一部のキーだけが重なる呼び出しでも、重なったキーは先に実行している呼び出しの結果を共有する。
+        fnは実行中でなかったキーだけを受け取り、そのすべてのキーの結果を返すこと。
+
+        Args:
+            keys (list[Hashable]): 同一の呼び出しとみなすキー
+            fn (Callable[[list[Hashable]], dict[Hashable, T]]): 渡したキーの結果をまとめて返す処理
+
+        Returns:
+            dict[Hashable, T]: キーごとの結果（他の呼び出しと共有するため、変更しないこと）
+
+        Raises:
+            KeyError: fnが渡したキーの一部の結果を返さなかった場合（そのキーを待つ呼び出しにも送出する）
+        """
+        leading: dict[Hashable, Future] = {}
+        joined: dict[Hashable, Future] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    future = Future()
+                    self._calls[key] = future
+                    leading[key] = future
+                else:
+                    self._coalesced += 1
+                    joined[key] = future
+
+        results: dict[Hashable, T] = {}
+        if leading:
+            try:
+                results = fn(list(leading))
+            except BaseException as e:
+                for future in leading.values():
+                    future.set_exception(e)
+                raise
+            else:
+                # fnが結果を返さなかったキーも含め、待っている呼び出しが残らないようすべてのFutureを完了させる
+                missing = [key for key in leading if key not in results]
+                for key, future in leading.items():
+                    if key in results:
+                        future.set_result(results[key])
+                    else:
+                        future.set_exception(KeyError(key))
+                if missing:
+                    raise KeyError(f"fn returned no result for {len(missing)} keys: {missing[:5]!r}")
+            finally:
+                with self._lock:
+                    for key in leading:
+                        del self._calls[key]
+
+        if joined:
+            logger.debug(f"Joined {len(joined)} in-flight keys")
+        # 先に実行している呼び出しはfnの中で他の呼び出しを待たないため、ここで待っても互いに待ち続けることはない
+        return {**results, **{key: future.result() for key, future in joined.items()}}
+
+    @property
+    def coalesced_calls(self) -> int:
+        """実行中の呼び出しの結果を共有した回数"""
+        with self._lock:
+            return self._coalesced
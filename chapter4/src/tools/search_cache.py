@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from src.embedding_cache import normalize_text
+from src.index_generation import read_index_generation
+from src.models import SearchOutput
+from src.singleflight import SingleFlight
+
+# インデックスの世代ファイルを確認する間隔（秒）
+GENERATION_CHECK_INTERVAL = 1.0
+
+
+class SearchResultCache:
+    """検索ツールの結果を保持するTTL付きのLRUキャッシュ
+
+    キーはツール名・正規化したクエリ・検索パラメータから作成する。
+    エントリは登録からttl_seconds秒で失効し、max_entriesを超えると最も長く使われていないものから追い出す。
+    create_indexが書き込むインデックスの世代が変わった場合は全エントリを破棄する。
+    キャッシュにない同じキーの検索が同時に要求された場合は、バックエンドへのリクエストを1回にまとめる。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 300.0,
+        max_entries: int = 1024,
+        generation_path: str | None = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generation_path = generation_path
+        self._entries: OrderedDict[tuple, tuple[float, list[SearchOutput]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = read_index_generation(generation_path) if generation_path else ""
+        self._generation_checked_at = time.monotonic()
+        self._inflight: SingleFlight[list[SearchOutput]] = SingleFlight()
+
+    @staticmethod
+    def make_key(tool_name: str, query: str, **params) -> tuple:
+        return (tool_name, normalize_text(query), tuple(sorted(params.items())))
+
+    def _check_generation(self, now: float, force: bool = False) -> None:
+        # 世代ファイルの読み込みは一定間隔に抑える
+        if self.generation_path is None:
+            return
+        if not force and now - self._generation_checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._generation_checked_at = now
+        generation = read_index_generation(self.generation_path)
+        if generation != self._generation:
+            self._generation = generation
+            self._entries.clear()
+
+    def get(self, key: tuple) -> list[SearchOutput] | None:
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, outputs = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(outputs)
+
+    def set(self, key: tuple, outputs: list[SearchOutput], generation: str | None = None) -> None:
+        """検索結果を登録する
+
+        generationを指定した場合は世代ファイルを読み直し、世代が変わっていれば登録しない。
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(now, force=generation is not None)
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (now + self.ttl_seconds, list(outputs))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_search(self, key: tuple, search: Callable[[], list[SearchOutput]]) -> list[SearchOutput]:
+        """キャッシュにあればその結果を、なければsearchを実行して結果をキャッシュし返す
+
+        同じキーの検索が実行中の場合は、新たに検索せずにその結果を待つ。
+        """
+        outputs = self.get(key)
+        if outputs is None:
+            outputs = list(self._inflight.do(key, lambda: self._search_and_set(key, search)))
+        return outputs
+
+    def _search_and_set(self, key: tuple, search: Callable[[], list[SearchOutput]]) -> list[SearchOutput]:
+        # 直前に完了した同じキーの検索の結果がキャッシュに入っている場合は検索しない
+        outputs = self.get(key)
+        if outputs is None:
+            # 検索中にインデックスが作り直された場合は、古い世代の結果を新しい世代のキャッシュに入れない
+            with self._lock:
+                generation = self._generation
+            outputs = search()
+            self.set(key, outputs, generation=generation)
+        return outputs
+
+    @property
+    def coalesced_searches(self) -> int:
+        """実行中の検索の結果を共有した回数"""
+        return self._inflight.coalesced_calls
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
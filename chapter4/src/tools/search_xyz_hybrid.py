@@ -0,0 +1,73 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.tools import tool
+from pydantic import BaseModel, Field
+
+from src.custom_logger import setup_logger
+from src.models import SearchOutput
+from src.tools.search_xyz_manual import search_manual
+from src.tools.search_xyz_qa import search_qa
+
+# 検索結果の最大取得数
+MAX_SEARCH_RESULTS = 3
+
+# 融合前に各検索から取得する候補数
+MAX_CANDIDATES = 10
+
+# Reciprocal Rank Fusionの定数。大きいほど下位の結果の寄与が相対的に大きくなる
+RRF_K = 60
+
+logger = setup_logger(__name__)
+
+# キーワード検索とベクトル検索を並行に実行するためのスレッドプール
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid_search")
+
+
+class SearchHybridInput(BaseModel):
+    query: str = Field(description="検索クエリ。キーワード検索とベクトル検索の両方に使用する")
+
+
+def reciprocal_rank_fusion(rankings: list[list[SearchOutput]], k: int = RRF_K) -> list[SearchOutput]:
+    """複数の検索結果をReciprocal Rank Fusionで1つのランキングに統合する
+
+    各結果のスコアは、それが現れる各ランキングでの順位rに対する1 / (k + r)の和とする。
+    ファイル名と内容が同じ結果は同一の文書として扱う。
+
+    Args:
+        rankings (list[list[SearchOutput]]): 順位順に並んだ検索結果のリスト
+        k (int): RRFの定数
+
+    Returns:
+        list[SearchOutput]: スコアの高い順に並べた検索結果
+    """
+    scores: dict[tuple[str, str], float] = {}
+    outputs: dict[tuple[str, str], SearchOutput] = {}
+    for ranking in rankings:
+        for rank, output in enumerate(ranking, start=1):
+            key = (output.file_name, output.content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            outputs.setdefault(key, output)
+
+    # 同点の場合は先に現れた結果を優先する（sortedは安定ソート）
+    return [outputs[key] for key in sorted(scores, key=lambda key: scores[key], reverse=True)]
+
+
+@tool(args_schema=SearchHybridInput)
+def search_xyz_hybrid(query: str) -> list[SearchOutput]:
+    """
+    XYZシステムのドキュメントと過去の質問回答ペアを同時に検索する関数。
+    キーワード検索とベクトル検索の結果を統合して返すため、どちらの検索を使うか迷う場合はこの関数を使う。
+    """
+
+    logger.info(f"Searching XYZ manual and QA by hybrid query: {query}")
+
+    # 計測中のトレーサーを引き継ぐため、呼び出し元のコンテキストで実行する
+    manual_future = _executor.submit(contextvars.copy_context().run, search_manual, query, MAX_CANDIDATES)
+    qa_future = _executor.submit(contextvars.copy_context().run, search_qa, query, MAX_CANDIDATES)
+
+    outputs = reciprocal_rank_fusion([manual_future.result(), qa_future.result()])[:MAX_SEARCH_RESULTS]
+
+    logger.info(f"Finished hybrid search: {len(outputs)} results")
+
+    return outputs
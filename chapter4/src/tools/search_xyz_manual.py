@@ -1,9 +1,11 @@
-from elasticsearch import Elasticsearch
 from langchain.tools import tool
 from pydantic import BaseModel, Field
 
+from src.clients import get_client_registry
 from src.custom_logger import setup_logger
+from src.instrumentation import span
 from src.models import SearchOutput
+from src.tools.search_cache import SearchResultCache
 
 # 検索結果の最大取得数
 MAX_SEARCH_RESULTS = 3
@@ -16,37 +18,59 @@ class SearchKeywordInput(BaseModel):
     keywords: str = Field(description="全文検索用のキーワード")
 
 
-# LangChainのtoolデコレーターを使って、検索機能をツール化
-@tool(args_schema=SearchKeywordInput)
-def search_xyz_manual(keywords: str) -> list[SearchOutput]:
-    """
-    XYZシステムのドキュメントを調査する関数。
-    エラーコードや固有名詞が質問に含まれる場合は、この関数を使ってキーワード検索を行う。
+def search_manual(keywords: str, limit: int = MAX_SEARCH_RESULTS) -> list[SearchOutput]:
+    """XYZシステムのドキュメントをキーワードで全文検索し、上位limit件を返す
+
+    同じキーワードとパラメータの検索結果は一定時間キャッシュから返す。
     """
 
-    logger.info(f"Searching XYZ manual by keyword: {keywords}")
+    clients = get_client_registry()
+    cache_key = SearchResultCache.make_key("search_manual", keywords, limit=limit)
+    return clients.search_cache().get_or_search(cache_key, lambda: _search_manual(keywords, limit))
+
+
+def _search_manual(keywords: str, limit: int) -> list[SearchOutput]:
+    clients = get_client_registry()
+
+    # プロセス内のBM25インデックスを使う場合はElasticsearchに接続しない
+    if clients.settings().keyword_backend == "local":
+        with span("search_manual", "search", backend="local"):
+            hits = clients.keyword_index().search(keywords, limit=limit)
+        logger.info(f"Search results: {len(hits)} hits")
+        return [SearchOutput.from_hit(hit) for hit in hits]
 
-    # Elasticsearchのインスタンスを作成して、ローカルのElasticsearchに接続
-    es = Elasticsearch("http://localhost:9200")
+    # 共有レジストリから接続済みのElasticsearchクライアントを取得
+    es = clients.elasticsearch()
 
     # 検索対象のインデックスを指定
     index_name = "documents"
 
     # 検索クエリを作成。'content' フィールドに対してキーワードで全文検索を行う
-    keyword_query = {"query": {"match": {"content": keywords}}}
+    keyword_query = {"query": {"match": {"content": keywords}}, "size": limit}
 
     # Elasticsearchに検索クエリを送信し、結果を 'response' に格納
-    response = es.search(index=index_name, body=keyword_query)
+    # 同時リクエスト数は上限までに抑える
+    with clients.concurrency_limit("elasticsearch"), span("search_manual", "search", backend="elasticsearch"):
+        response = es.search(index=index_name, body=keyword_query)
 
     logger.info(f"Search results: {len(response['hits']['hits'])} hits")
 
-    # 検索結果を格納するリスト
-    outputs = []
+    # 検索結果からヒットしたドキュメントを1つずつ処理し、
+    # カスタムモデルSearchOutputのfrom_hitメソッドを使ってオブジェクト化する
+    return [SearchOutput.from_hit(hit) for hit in response["hits"]["hits"][:limit]]
+
+
+# LangChainのtoolデコレーターを使って、検索機能をツール化
+@tool(args_schema=SearchKeywordInput)
+def search_xyz_manual(keywords: str) -> list[SearchOutput]:
+    """
+    XYZシステムのドキュメントを調査する関数。
+    エラーコードや固有名詞が質問に含まれる場合は、この関数を使ってキーワード検索を行う。
+    """
+
+    logger.info(f"Searching XYZ manual by keyword: {keywords}")
 
-    # 検索結果からヒットしたドキュメントを1つずつ処理
-    for hit in response["hits"]["hits"][:MAX_SEARCH_RESULTS]:
-        # カスタムモデルSearchOutputのfrom_hitメソッドを使って、検索結果をオブジェクト化しリストに追加
-        outputs.append(SearchOutput.from_hit(hit))
+    outputs = search_manual(keywords)
 
     logger.info("Finished searching XYZ manual by keyword")
 
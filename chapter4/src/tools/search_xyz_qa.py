@@ -1,11 +1,14 @@
+from contextlib import nullcontext
+
 from langchain.tools import tool
-from openai import OpenAI
 from pydantic import BaseModel, Field
-from qdrant_client import QdrantClient
 
-from src.configs import Settings
+from src.clients import get_client_registry
 from src.custom_logger import setup_logger
+from src.embedding_cache import EMBEDDING_MODEL
+from src.instrumentation import span
 from src.models import SearchOutput
+from src.tools.search_cache import SearchResultCache
 
 # 検索結果の最大取得数
 MAX_SEARCH_RESULTS = 3
@@ -17,35 +20,51 @@ class SearchQueryInput(BaseModel):
     query: str = Field(description="検索クエリ")
 
 
-@tool(args_schema=SearchQueryInput)
-def search_xyz_qa(query: str) -> list[SearchOutput]:
-    """
-    XYZシステムの過去の質問回答ペアを検索する関数。
+def search_qa(query: str, limit: int = MAX_SEARCH_RESULTS) -> list[SearchOutput]:
+    """XYZシステムの過去の質問回答ペアをベクトル検索し、類似度の高い上位limit件を返す
+
+    同じクエリとパラメータの検索結果は一定時間キャッシュから返す。
     """
 
-    logger.info(f"Searching XYZ QA by query: {query}")
+    clients = get_client_registry()
+    cache_key = SearchResultCache.make_key("search_qa", query, limit=limit)
+    return clients.search_cache().get_or_search(cache_key, lambda: _search_qa(query, limit))
 
-    qdrant_client = QdrantClient("http://localhost:6333")
 
-    settings = Settings()
-    openai_client = OpenAI(api_key=settings.openai_api_key)
+def _search_qa(query: str, limit: int) -> list[SearchOutput]:
+    # 共有レジストリから接続済みのクライアントを取得
+    clients = get_client_registry()
+    vector_index = clients.vector_index()
+    openai_client = clients.openai()
+    embedding_cache = clients.embedding_cache()
 
+    # 同じクエリのベクトルはキャッシュから取得し、埋め込みAPIの呼び出しを省く
     logger.info("Generating embedding vector from input query")
-    query_vector = (
-        openai_client.embeddings.create(input=query, model="text-embedding-3-small")
-        .data[0]
-        .embedding
-    )
+    with span("embedding", "search", model=EMBEDDING_MODEL):
+        query_vector = embedding_cache.embed(openai_client, [query], model=EMBEDDING_MODEL)[0]
 
-    search_results = qdrant_client.query_points(
-        collection_name="documents", query=query_vector, limit=MAX_SEARCH_RESULTS
-    ).points
+    # Qdrantへの同時リクエスト数は上限までに抑える（プロセス内のインデックスの場合は制限しない）
+    backend = clients.settings().vector_backend
+    concurrency_limit = clients.concurrency_limit("qdrant") if backend == "qdrant" else nullcontext()
+    with concurrency_limit, span("search_qa", "search", backend=backend):
+        search_results = vector_index.query_points(
+            collection_name="documents", query=query_vector, limit=limit
+        ).points
 
     logger.info(f"Search results: {len(search_results)} hits")
-    outputs = []
 
-    for point in search_results:
-        outputs.append(SearchOutput.from_point(point))
+    return [SearchOutput.from_point(point) for point in search_results]
+
+
+@tool(args_schema=SearchQueryInput)
+def search_xyz_qa(query: str) -> list[SearchOutput]:
+    """
+    XYZシステムの過去の質問回答ペアを検索する関数。
+    """
+
+    logger.info(f"Searching XYZ QA by query: {query}")
+
+    outputs = search_qa(query)
 
     logger.info("Finished searching XYZ QA by query")
 
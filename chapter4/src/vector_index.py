@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+
+import numpy as np
+from qdrant_client.http.models import QueryResponse
+from qdrant_client.models import PointStruct, ScoredPoint
+
+VECTORS_FILE_NAME = "vectors.npy"
+PAYLOADS_FILE_NAME = "payloads.jsonl"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class LocalVectorIndex:
+    """Qdrantの代わりにプロセス内で使えるベクトルインデックス
+
+    単位ベクトルに正規化したfloat32の行列（vectors.npy）と、各行のIDとペイロード（payloads.jsonl）を
+    1つのディレクトリに保存する。行列はメモリマップで読み込むため、起動時に全体をメモリへ展開しない。
+    検索は行列積によるコサイン類似度の計算とargpartitionによる上位k件の抽出で行い、
+    QdrantClient.query_pointsと同じ形のレスポンスを返す。
+
+    upsertとdeleteはメモリ上に蓄積し、saveを呼び出したときにファイルへ反映する。
+    別プロセスがファイルを書き換えた場合は、次の検索時に読み込み直す。
+    """
+
+    def __init__(self, path: str, name: str = "documents") -> None:
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[np.ndarray, dict]] = {}
+        self._deleted: set[str] = set()
+        self._loaded_mtime: float | None = None
+        self._ids: list[str] = []
+        self._payloads: list[dict] = []
+        self._vectors: np.ndarray = np.empty((0, 0), dtype=np.float32)
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, VECTORS_FILE_NAME)
+
+    @property
+    def _payloads_path(self) -> str:
+        return os.path.join(self.path, PAYLOADS_FILE_NAME)
+
+    def _maybe_reload(self) -> None:
+        try:
+            mtime = os.stat(self._vectors_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        ids, payloads = [], []
+        with open(self._payloads_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                payloads.append(record["payload"])
+        self._vectors = np.load(self._vectors_path, mmap_mode="r")
+        self._ids = ids
+        self._payloads = payloads
+        self._loaded_mtime = mtime
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._maybe_reload()
+            return len(self._ids)
+
+    def upsert(self, points: list[PointStruct]) -> None:
+        """ポイントを追加または更新する（saveで反映される）"""
+        with self._lock:
+            for point in points:
+                point_id = str(point.id)
+                self._pending[point_id] = (np.asarray(point.vector, dtype=np.float32), point.payload or {})
+                self._deleted.discard(point_id)
+
+    def delete(self, ids: list[str]) -> None:
+        """ポイントを削除する（saveで反映される）"""
+        with self._lock:
+            for point_id in ids:
+                self._pending.pop(str(point_id), None)
+                self._deleted.add(str(point_id))
+
+    def clear(self) -> None:
+        """保存済みのポイントと未保存の追加をすべて削除する（saveで反映される）"""
+        with self._lock:
+            self._maybe_reload()
+            self._pending.clear()
+            self._deleted = set(self._ids)
+
+    def save(self) -> None:
+        """保存済みのインデックスに追加・更新・削除を反映して書き出す"""
+        with self._lock:
+            self._maybe_reload()
+            ids, payloads, rows = [], [], []
+            for row, (point_id, payload) in enumerate(zip(self._ids, self._payloads, strict=True)):
+                if point_id in self._deleted or point_id in self._pending:
+                    continue
+                ids.append(point_id)
+                payloads.append(payload)
+                rows.append(row)
+            parts = []
+            if rows:
+                parts.append(np.asarray(self._vectors[rows], dtype=np.float32))
+            if self._pending:
+                parts.append(_normalize(np.stack([vector for vector, _ in self._pending.values()])))
+                for point_id, (_, payload) in self._pending.items():
+                    ids.append(point_id)
+                    payloads.append(payload)
+            vectors = np.concatenate(parts) if parts else np.empty((0, 0), dtype=np.float32)
+
+            os.makedirs(self.path, exist_ok=True)
+            with open(f"{self._payloads_path}.tmp", "w", encoding="utf-8") as f:
+                for point_id, payload in zip(ids, payloads, strict=True):
+                    f.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n")
+            with open(f"{self._vectors_path}.tmp", "wb") as f:
+                np.save(f, vectors.astype(np.float32, copy=False))
+            # ペイロードを先に置き換え、行列の更新時刻の変化で読み込み直しを検知させる
+            os.replace(f"{self._payloads_path}.tmp", self._payloads_path)
+            os.replace(f"{self._vectors_path}.tmp", self._vectors_path)
+
+            self._pending.clear()
+            self._deleted.clear()
+            self._loaded_mtime = None
+            self._maybe_reload()
+
+    def search_batch(self, queries: np.ndarray, limit: int) -> list[list[ScoredPoint]]:
+        """複数のクエリベクトルに対してコサイン類似度の上位limit件をまとめて検索する
+
+        Args:
+            queries (np.ndarray): (クエリ数, 次元数)のクエリベクトル
+            limit (int): 各クエリの取得件数
+
+        Returns:
+            list[list[ScoredPoint]]: クエリごとの類似度の高い順の検索結果
+        """
+        with self._lock:
+            self._maybe_reload()
+            vectors, ids, payloads = self._vectors, self._ids, self._payloads
+
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if len(ids) == 0:
+            return [[] for _ in range(len(queries))]
+
+        limit = min(limit, len(ids))
+        scores = queries @ vectors.T
+        # 全件をソートせず、上位limit件だけを取り出してから並べ替える
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        return [
+            [ScoredPoint(id=ids[row], version=0, score=float(scores[i, row]), payload=payloads[row]) for row in top[i]]
+            for i in range(len(queries))
+        ]
+
+    def query_points(self, collection_name: str, query: list[float], limit: int = 10) -> QueryResponse:
+        """QdrantClient.query_pointsと同じ形で検索結果を返す"""
+        if collection_name != self.name:
+            raise ValueError(f"Collection {collection_name} does not exist")
+        return QueryResponse(points=self.search_batch(np.asarray([query]), limit)[0])